@@ -0,0 +1,308 @@
+"""
+Approximate nearest-neighbour index over Siamese embeddings (NumPy only)
+
+IVF + product quantization, scored with the model's own distance head:
+the Siamese logit is w . |q - x| + b, which is a sum over dimensions, so
+it splits across PQ subspaces exactly like an L2 distance would. Each
+query builds one (subspaces x centroids) lookup table of partial head
+scores and every candidate is scored with M table lookups (asymmetric
+distance computation). The best candidates are re-ranked with the exact
+Dense head score against the stored float32 embeddings.
+"""
+import numpy as np
+from threading import Lock
+
+# ================================
+# K-MEANS
+# ================================
+def kmeans(vectors, num_centroids, iterations=10, seed=0):
+    """
+    Plain Lloyd k-means with matmul-based squared L2 assignment
+
+    Args:
+        vectors: (n, d) float32 training vectors
+        num_centroids: number of clusters (clipped to n)
+        iterations: Lloyd iterations
+        seed: RNG seed for the initial centroids
+
+    Returns:
+        numpy array: (num_centroids, d) centroids
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    num_centroids = min(num_centroids, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), num_centroids, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroids(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=num_centroids)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters on random points
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+    return centroids
+
+def nearest_centroids(vectors, centroids, chunk_size=4096):
+    """Index of the nearest centroid (squared L2) for every vector"""
+    centroid_norms = np.einsum('kd,kd->k', centroids, centroids)
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start:start + chunk_size]
+        distances = centroid_norms[None, :] - 2.0 * (chunk @ centroids.T)
+        assignment[start:start + len(chunk)] = distances.argmin(axis=1)
+    return assignment
+
+# ================================
+# IVF-PQ INDEX
+# ================================
+class IVFPQIndex:
+    """
+    Inverted-file index with product-quantized codes and exact re-ranking
+
+    Vectors are partitioned by a coarse k-means into `num_lists` lists and
+    encoded as `num_subspaces` uint8 codes (one per subspace codebook of
+    `num_centroids` entries). A search probes the `nprobe` lists whose
+    centroids score best under the head, ranks their members by the
+    table-based approximate logit, and re-ranks the top `rerank` with the
+    exact head. Before training (or when too small to train) every search
+    is exact brute force.
+
+    Vectors can be added and removed at any time; removal frees the slot
+    for reuse. Methods are thread-safe.
+    """
+
+    def __init__(self, kernel, bias, num_lists=64, num_subspaces=64, num_centroids=256,
+                 nprobe=8, rerank=128, seed=0):
+        self.kernel = np.asarray(kernel, dtype=np.float32).reshape(-1)
+        self.bias = np.float32(bias)
+        self.dim = len(self.kernel)
+        if self.dim % num_subspaces:
+            raise ValueError(f"Embedding size {self.dim} is not divisible by {num_subspaces} subspaces")
+        if num_centroids > 256:
+            raise ValueError("At most 256 centroids per subspace (uint8 codes)")
+        self.num_lists = num_lists
+        self.num_subspaces = num_subspaces
+        self.num_centroids = num_centroids
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self.seed = seed
+        self.subspace_dim = self.dim // num_subspaces
+        self.subspace_kernel = self.kernel.reshape(num_subspaces, self.subspace_dim)
+
+        self.coarse_centroids = None   # (num_lists, dim)
+        self.codebooks = None          # (num_subspaces, num_centroids, subspace_dim)
+
+        self._lock = Lock()
+        self._vectors = np.empty((0, self.dim), dtype=np.float32)
+        self._codes = np.empty((0, num_subspaces), dtype=np.uint8)
+        self._lists = np.empty(0, dtype=np.int64)
+        self._alive = np.empty(0, dtype=bool)
+        self._labels = []
+        self._slots = {}        # label -> slot
+        self._free = []
+        self._list_members = None   # cached list -> alive slots
+
+    @property
+    def is_trained(self):
+        return self.codebooks is not None
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, label):
+        return label in self._slots
+
+    # ----- scoring helpers -----
+    def head_logits(self, query, vectors):
+        """Exact head logits w . |q - x| + b for one query"""
+        return np.abs(vectors - query[None, :]) @ self.kernel + self.bias
+
+    def _lookup_table(self, query):
+        """(num_subspaces, num_centroids) partial head scores for one query"""
+        query_sub = query.reshape(self.num_subspaces, 1, self.subspace_dim)
+        return np.einsum('mkd,md->mk', np.abs(query_sub - self.codebooks), self.subspace_kernel)
+
+    # ----- training / encoding -----
+    def train(self, vectors, iterations=10, max_samples=8192):
+        """
+        Fit the coarse partition and PQ codebooks, then re-encode stored vectors
+
+        Args:
+            vectors: (n, dim) training embeddings (a sample is used if n is large)
+            iterations: k-means iterations
+            max_samples: cap on training vectors
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        rng = np.random.default_rng(self.seed)
+        if len(vectors) > max_samples:
+            vectors = vectors[rng.choice(len(vectors), max_samples, replace=False)]
+        if len(vectors) < max(self.num_lists, self.num_centroids):
+            raise ValueError(
+                f"Need at least {max(self.num_lists, self.num_centroids)} vectors to train (got {len(vectors)})"
+            )
+
+        coarse = kmeans(vectors, self.num_lists, iterations, self.seed)
+        sub_vectors = vectors.reshape(len(vectors), self.num_subspaces, self.subspace_dim)
+        codebooks = np.stack([
+            kmeans(sub_vectors[:, m, :], self.num_centroids, iterations, self.seed + m)
+            for m in range(self.num_subspaces)
+        ])
+
+        with self._lock:
+            self.coarse_centroids = coarse
+            self.codebooks = codebooks
+            if len(self._vectors):
+                self._lists = nearest_centroids(self._vectors, self.coarse_centroids)
+                self._codes = self._encode(self._vectors)
+            self._list_members = None
+
+    def _encode(self, vectors):
+        codes = np.empty((len(vectors), self.num_subspaces), dtype=np.uint8)
+        sub_vectors = vectors.reshape(len(vectors), self.num_subspaces, self.subspace_dim)
+        for m in range(self.num_subspaces):
+            codes[:, m] = nearest_centroids(np.ascontiguousarray(sub_vectors[:, m, :]), self.codebooks[m])
+        return codes
+
+    # ----- insert / delete -----
+    def add(self, labels, vectors):
+        """
+        Insert (or replace) vectors under the given labels
+
+        Args:
+            labels: hashable labels, one per vector
+            vectors: (n, dim) embeddings
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        labels = list(labels)
+        if len(labels) != len(vectors):
+            raise ValueError("One label per vector required")
+        with self._lock:
+            self._remove_locked(labels)
+            if self.is_trained:
+                lists = nearest_centroids(vectors, self.coarse_centroids)
+                codes = self._encode(vectors)
+            else:
+                lists = np.zeros(len(vectors), dtype=np.int64)
+                codes = np.zeros((len(vectors), self.num_subspaces), dtype=np.uint8)
+
+            slots = [self._free.pop() for _ in range(min(len(self._free), len(vectors)))]
+            extra = len(vectors) - len(slots)
+            if extra:
+                start = len(self._labels)
+                self._grow(start + extra)
+                slots += list(range(start, start + extra))
+                self._labels.extend([None] * extra)
+            slots = np.array(slots, dtype=np.int64)
+
+            self._vectors[slots] = vectors
+            self._codes[slots] = codes
+            self._lists[slots] = lists
+            self._alive[slots] = True
+            for slot, label in zip(slots, labels):
+                self._labels[slot] = label
+                self._slots[label] = int(slot)
+            self._list_members = None
+
+    def _grow(self, size):
+        capacity = len(self._vectors)
+        if size <= capacity:
+            return
+        new_capacity = max(size, 2 * capacity, 64)
+        grow = new_capacity - capacity
+        self._vectors = np.concatenate([self._vectors, np.zeros((grow, self.dim), np.float32)])
+        self._codes = np.concatenate([self._codes, np.zeros((grow, self.num_subspaces), np.uint8)])
+        self._lists = np.concatenate([self._lists, np.zeros(grow, np.int64)])
+        self._alive = np.concatenate([self._alive, np.zeros(grow, bool)])
+
+    def remove(self, labels):
+        """Delete vectors by label (unknown labels are ignored); returns how many were removed"""
+        with self._lock:
+            return self._remove_locked(labels)
+
+    def _remove_locked(self, labels):
+        removed = 0
+        for label in labels:
+            slot = self._slots.pop(label, None)
+            if slot is None:
+                continue
+            self._alive[slot] = False
+            self._labels[slot] = None
+            self._free.append(slot)
+            removed += 1
+        if removed:
+            self._list_members = None
+        return removed
+
+    def vectors(self):
+        """(labels, vectors) of every stored entry"""
+        with self._lock:
+            slots = np.flatnonzero(self._alive)
+            return [self._labels[s] for s in slots], self._vectors[slots].copy()
+
+    # ----- search -----
+    def _members(self):
+        if self._list_members is None:
+            alive = np.flatnonzero(self._alive)
+            order = np.argsort(self._lists[alive], kind="stable")
+            alive = alive[order]
+            bounds = np.searchsorted(self._lists[alive], np.arange(self.num_lists + 1))
+            self._list_members = [alive[bounds[i]:bounds[i + 1]] for i in range(self.num_lists)]
+        return self._list_members
+
+    def search(self, query, k=10, nprobe=None, rerank=None, exact=False):
+        """
+        Top-k labels by head score for one query embedding
+
+        Args:
+            query: (dim,) embedding
+            k: number of results
+            nprobe: lists to probe (default self.nprobe)
+            rerank: shortlist size re-scored exactly (default self.rerank)
+            exact: brute-force over every stored vector
+
+        Returns:
+            list: [(label, similarity score)] best first
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        nprobe = self.nprobe if nprobe is None else nprobe
+        rerank = max(k, self.rerank if rerank is None else rerank)
+
+        with self._lock:
+            if exact or not self.is_trained:
+                candidates = np.flatnonzero(self._alive)
+            else:
+                coarse_logits = np.abs(self.coarse_centroids - query[None, :]) @ self.kernel
+                probe = np.argsort(-coarse_logits)[:max(1, nprobe)]
+                members = self._members()
+                candidates = np.concatenate([members[i] for i in probe])
+                if len(candidates) > rerank:
+                    table = self._lookup_table(query)
+                    approx = table[np.arange(self.num_subspaces)[None, :], self._codes[candidates]].sum(axis=1)
+                    candidates = candidates[np.argpartition(-approx, rerank - 1)[:rerank]]
+
+            if len(candidates) == 0:
+                return []
+            logits = self.head_logits(query, self._vectors[candidates])
+            labels = [self._labels[s] for s in candidates]
+
+        top = np.argsort(-logits, kind="stable")[:k]
+        scores = 1.0 / (1.0 + np.exp(-logits[top]))
+        return [(labels[i], float(score)) for i, score in zip(top, scores)]
+
+    def stats(self):
+        with self._lock:
+            sizes = np.bincount(self._lists[self._alive], minlength=self.num_lists) if self.is_trained else None
+            return {
+                "vectors": len(self._slots),
+                "trained": self.is_trained,
+                "lists": self.num_lists,
+                "subspaces": self.num_subspaces,
+                "centroids": self.num_centroids,
+                "nprobe": self.nprobe,
+                "rerank": self.rerank,
+                "largest_list": int(sizes.max()) if sizes is not None and len(sizes) else None,
+                "code_bytes_per_vector": self.num_subspaces
+            }
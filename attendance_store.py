@@ -0,0 +1,536 @@
+"""
+Embedded attendance store (SQLite in WAL mode)
+
+Replaces the append-only class_attendance.csv and free-text
+scan_history.txt logs. Every verification is one row in `scans` (with
+optional per-frame rows in `frames`), indexed by student, session and
+timestamp so per-session and per-student reports are index range scans
+instead of whole-file rescans.
+
+Writes from the request path are queued and committed in batches by a
+single writer thread (one transaction per batch); readers use their own
+per-thread connections and, thanks to WAL, never block the writer.
+
+Legacy logs can be imported with import_legacy() or from the command line:
+    python attendance_store.py import --db attendance.db \\
+        --csv class_attendance.csv --history scan_history.txt
+"""
+import csv
+import io
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import time
+from datetime import datetime
+from threading import Thread, Lock, Event, local as threading_local
+
+logger = logging.getLogger("eduface.attendance")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    student_id TEXT NOT NULL,
+    student_name TEXT,
+    session_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    verified INTEGER NOT NULL,
+    confidence REAL,
+    timestamp REAL NOT NULL,
+    num_frames INTEGER,
+    source TEXT NOT NULL,
+    request_id TEXT,
+    details TEXT,
+    import_key TEXT UNIQUE
+);
+CREATE INDEX IF NOT EXISTS idx_scans_student ON scans (student_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_scans_session ON scans (session_id, student_id, verified, confidence, timestamp);
+CREATE INDEX IF NOT EXISTS idx_scans_timestamp ON scans (timestamp);
+CREATE TABLE IF NOT EXISTS frames (
+    scan_id INTEGER NOT NULL REFERENCES scans (id) ON DELETE CASCADE,
+    frame_index INTEGER NOT NULL,
+    filename TEXT,
+    num_scores INTEGER,
+    median REAL,
+    max REAL,
+    PRIMARY KEY (scan_id, frame_index)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS students (
+    student_id TEXT PRIMARY KEY,
+    student_name TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+SCAN_COLUMNS = (
+    "student_id", "student_name", "session_id", "status", "verified", "confidence",
+    "timestamp", "num_frames", "source", "request_id", "details", "import_key"
+)
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def default_session(timestamp):
+    """Session used when none is given: the local calendar day of the scan"""
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+
+def format_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime(TIMESTAMP_FORMAT) if timestamp is not None else None
+
+def normalize_status(status):
+    """Map legacy labels ("PRESENT ✅", "VERIFIED", ...) onto PRESENT / the upper-case code"""
+    code = re.sub(r"[^A-Z_]", "", str(status).upper().replace(" ", "_")).strip("_")
+    return "PRESENT" if code in ("PRESENT", "VERIFIED") else (code or "UNKNOWN")
+
+# ================================
+# STORE
+# ================================
+class AttendanceStore:
+    """
+    SQLite attendance store with a batched background writer
+
+    record() only enqueues; the writer thread commits up to `batch_size`
+    scans per transaction, at least every `flush_interval` seconds. When
+    the queue is full, record() drops the scan and counts it rather than
+    block a request. Query methods are safe from any thread.
+    """
+
+    def __init__(self, path, batch_size=256, flush_interval=0.5, max_queued=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._local = threading_local()
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._stop = Event()
+        self._stats_lock = Lock()
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failed = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self.connection()
+        connection.executescript(SCHEMA)
+        connection.commit()
+
+        self._writer = Thread(target=self._write_loop, name="attendance-writer", daemon=True)
+        self._writer.start()
+
+    def connection(self):
+        """This thread's connection (WAL, NORMAL sync, foreign keys on)"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+        return connection
+
+    # ----- writes -----
+    def record(self, scan):
+        """
+        Queue one scan for the batched writer
+
+        Args:
+            scan: dict with student_id, status, verified and optionally
+                student_name, session_id, confidence, timestamp, source,
+                request_id, details (dict) and frames (list of dicts with
+                frame_index, filename, num_scores, median, max)
+
+        Returns:
+            bool: False when the queue was full and the scan was dropped
+        """
+        scan.setdefault("timestamp", time.time())
+        try:
+            self._queue.put_nowait(scan)
+            return True
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            return False
+
+    def insert_scans(self, scans, upsert=False):
+        """
+        Insert scans (and their frames) in one transaction
+
+        With `upsert`, scans whose import_key already exists are updated
+        in place (fields that are None keep their stored value) and their
+        frames replaced, which makes re-importing legacy logs idempotent.
+
+        Returns:
+            int: number of scans written
+        """
+        connection = self.connection()
+        placeholders = ", ".join("?" * len(SCAN_COLUMNS))
+        sql = f"INSERT INTO scans ({', '.join(SCAN_COLUMNS)}) VALUES ({placeholders})"
+        if upsert:
+            updates = ", ".join(
+                f"{column} = COALESCE(excluded.{column}, {column})"
+                for column in SCAN_COLUMNS if column != "import_key"
+            )
+            sql += f" ON CONFLICT (import_key) DO UPDATE SET {updates}"
+        sql += " RETURNING id"
+
+        with connection:
+            names = {}
+            for scan in scans:
+                row = self._scan_row(scan)
+                scan_id = connection.execute(sql, row).fetchone()[0]
+                if row[1]:
+                    names[row[0]] = row[1]
+                frames = scan.get("frames")
+                if frames:
+                    if upsert:
+                        connection.execute("DELETE FROM frames WHERE scan_id = ?", (scan_id,))
+                    connection.executemany(
+                        "INSERT INTO frames (scan_id, frame_index, filename, num_scores, median, max) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        [(scan_id, frame["frame_index"], frame.get("filename"), frame.get("num_scores"),
+                          frame.get("median"), frame.get("max")) for frame in frames]
+                    )
+            if names:
+                connection.executemany(
+                    "INSERT INTO students (student_id, student_name) VALUES (?, ?) "
+                    "ON CONFLICT (student_id) DO UPDATE SET student_name = excluded.student_name",
+                    list(names.items())
+                )
+        return len(scans)
+
+    @staticmethod
+    def _scan_row(scan):
+        timestamp = scan.get("timestamp")
+        timestamp = time.time() if timestamp is None else float(timestamp)
+        details = scan.get("details")
+        frames = scan.get("frames")
+        return (
+            str(scan["student_id"]),
+            scan.get("student_name"),
+            scan.get("session_id") or default_session(timestamp),
+            scan["status"],
+            int(bool(scan["verified"])),
+            None if scan.get("confidence") is None else float(scan["confidence"]),
+            timestamp,
+            scan.get("num_frames", len(frames) if frames else None),
+            scan.get("source", "live"),
+            scan.get("request_id"),
+            json.dumps(details) if details is not None else None,
+            scan.get("import_key")
+        )
+
+    def _write_loop(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.insert_scans(batch)
+                with self._stats_lock:
+                    self.written += len(batch)
+                    self.batches += 1
+            except Exception as e:
+                with self._stats_lock:
+                    self.failed += len(batch)
+                logger.error("Attendance batch of %s not written: %s", len(batch), e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Block until every queued scan has been written"""
+        self._queue.join()
+
+    def close(self):
+        """Write what is queued, stop the writer and close this thread's connection"""
+        self._stop.set()
+        self._writer.join()
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    # ----- queries -----
+    def session_report(self, session_id):
+        """
+        Per-student summary of one session
+
+        Returns:
+            dict: session totals plus one row per student (scans, verified
+            scans, best confidence, first/last seen, present flag)
+        """
+        rows = self.connection().execute(
+            """
+            SELECT s.student_id, COUNT(*) AS scans, SUM(s.verified) AS verified_scans,
+                   MAX(s.confidence) AS best_confidence,
+                   MIN(s.timestamp) AS first_seen, MAX(s.timestamp) AS last_seen,
+                   n.student_name
+            FROM scans s LEFT JOIN students n ON n.student_id = s.student_id
+            WHERE s.session_id = ?
+            GROUP BY s.student_id ORDER BY s.student_id
+            """,
+            (session_id,)
+        ).fetchall()
+        students = [{
+            "student_id": row["student_id"],
+            "student_name": row["student_name"],
+            "present": row["verified_scans"] > 0,
+            "scans": row["scans"],
+            "verified_scans": row["verified_scans"],
+            "best_confidence": row["best_confidence"],
+            "first_seen": format_timestamp(row["first_seen"]),
+            "last_seen": format_timestamp(row["last_seen"])
+        } for row in rows]
+        return {
+            "session_id": session_id,
+            "students_seen": len(students),
+            "students_present": sum(student["present"] for student in students),
+            "scans": sum(student["scans"] for student in students),
+            "students": students
+        }
+
+    def student_report(self, student_id, since=None, until=None, limit=50):
+        """
+        Attendance history of one student
+
+        Args:
+            student_id: Student identifier
+            since, until: Optional unix-time bounds on scan timestamps
+            limit: Number of most recent scans returned in full
+
+        Returns:
+            dict: totals, per-session attendance and the latest scans
+        """
+        bounds, params = self._time_bounds(since, until)
+        connection = self.connection()
+        sessions = connection.execute(
+            f"""
+            SELECT session_id, COUNT(*) AS scans, SUM(verified) AS verified_scans,
+                   MAX(confidence) AS best_confidence, MIN(timestamp) AS first_seen
+            FROM scans WHERE student_id = ?{bounds}
+            GROUP BY session_id ORDER BY first_seen DESC
+            """,
+            (student_id, *params)
+        ).fetchall()
+        recent = self.scans(student_id=student_id, since=since, until=until, limit=limit)
+        name = connection.execute(
+            "SELECT student_name FROM students WHERE student_id = ?", (student_id,)
+        ).fetchone()
+        return {
+            "student_id": student_id,
+            "student_name": name[0] if name else None,
+            "scans": sum(row["scans"] for row in sessions),
+            "sessions_seen": len(sessions),
+            "sessions_present": sum(1 for row in sessions if row["verified_scans"]),
+            "sessions": [{
+                "session_id": row["session_id"],
+                "present": row["verified_scans"] > 0,
+                "scans": row["scans"],
+                "verified_scans": row["verified_scans"],
+                "best_confidence": row["best_confidence"],
+                "first_seen": format_timestamp(row["first_seen"])
+            } for row in sessions],
+            "recent_scans": recent
+        }
+
+    def scans(self, student_id=None, session_id=None, since=None, until=None, limit=100, frames=False):
+        """Most recent scans matching the filters, newest first"""
+        clauses, params = [], []
+        if student_id is not None:
+            clauses.append("student_id = ?")
+            params.append(student_id)
+        if session_id is not None:
+            clauses.append("session_id = ?")
+            params.append(session_id)
+        bounds, bound_params = self._time_bounds(since, until)
+        where = " AND ".join(clauses) or "1"
+        rows = self.connection().execute(
+            f"SELECT * FROM scans WHERE {where}{bounds} ORDER BY timestamp DESC LIMIT ?",
+            (*params, *bound_params, int(limit))
+        ).fetchall()
+        result = [self._scan_dict(row) for row in rows]
+        if frames and result:
+            by_id = {scan["id"]: scan for scan in result}
+            for scan in result:
+                scan["frames"] = []
+            frame_rows = self.connection().execute(
+                f"SELECT * FROM frames WHERE scan_id IN ({', '.join('?' * len(by_id))}) "
+                "ORDER BY scan_id, frame_index",
+                list(by_id)
+            ).fetchall()
+            for row in frame_rows:
+                frame = dict(row)
+                by_id[frame.pop("scan_id")]["frames"].append(frame)
+        return result
+
+    @staticmethod
+    def _time_bounds(since, until):
+        bounds, params = "", []
+        if since is not None:
+            bounds += " AND timestamp >= ?"
+            params.append(float(since))
+        if until is not None:
+            bounds += " AND timestamp < ?"
+            params.append(float(until))
+        return bounds, params
+
+    @staticmethod
+    def _scan_dict(row):
+        scan = dict(row)
+        scan["verified"] = bool(scan["verified"])
+        scan["details"] = json.loads(scan["details"]) if scan["details"] else None
+        scan["time"] = format_timestamp(scan["timestamp"])
+        scan.pop("import_key", None)
+        return scan
+
+    def stats(self):
+        count = self.connection().execute("SELECT MAX(id) FROM scans").fetchone()[0]
+        with self._stats_lock:
+            return {
+                "path": self.path,
+                "approx_scans": count or 0,
+                "queued": self._queue.qsize(),
+                "written": self.written,
+                "batches": self.batches,
+                "dropped": self.dropped,
+                "failed": self.failed
+            }
+
+# ================================
+# LEGACY IMPORT
+# ================================
+SUMMARY_PATTERN = re.compile(r"overall:\s*([0-9.]+)")
+
+def parse_timestamp(text):
+    return time.mktime(datetime.strptime(text.strip(), TIMESTAMP_FORMAT).timetuple())
+
+def parse_attendance_csv(text):
+    """
+    Scans from class_attendance.csv content
+
+    Handles both the 5-column rows (name, ID, status, confidence,
+    timestamp) and the 7-column rows that add NumFrames and the scan
+    summary.
+    """
+    scans = []
+    for row in csv.reader(io.StringIO(text)):
+        if not row or row[0] == "StudentName" or len(row) < 5:
+            continue
+        name, student_id, status, confidence, timestamp = (value.strip() for value in row[:5])
+        scan_time = parse_timestamp(timestamp)
+        status = normalize_status(status)
+        scan = {
+            "student_id": student_id,
+            "student_name": name or None,
+            "status": status,
+            "verified": status == "PRESENT",
+            "confidence": float(confidence) if confidence else None,
+            "timestamp": scan_time,
+            "source": "legacy",
+            "import_key": f"{student_id}@{scan_time:.0f}"
+        }
+        if len(row) >= 7 and row[5].strip():
+            scan["num_frames"] = int(row[5])
+            scan["details"] = {"summary": row[6].strip()}
+        scans.append(scan)
+    return scans
+
+def parse_scan_history(text):
+    """
+    Scans (with frames) from scan_history.txt content
+
+    Each block starts at "SCAN TIMESTAMP:" and lists the student, status,
+    frame count, summary line and one "Frame N: file / Scores / Median"
+    group per frame.
+    """
+    scans = []
+    for block in re.split(r"^SCAN TIMESTAMP:", text, flags=re.MULTILINE)[1:]:
+        lines = block.splitlines()
+        scan_time = parse_timestamp(lines[0])
+        header = {}
+        frames = []
+        for line in lines[1:]:
+            line = line.strip()
+            student = re.match(r"Student:\s*(.*?)\s*\(ID:\s*([^)]+)\)", line)
+            frame = re.match(r"Frame\s+(\d+):\s*(\S+)", line)
+            if student:
+                header["student_name"], header["student_id"] = student.group(1), student.group(2).strip()
+            elif frame:
+                frames.append({"frame_index": int(frame.group(1)), "filename": frame.group(2)})
+            elif line.startswith("Scores:") and frames:
+                frames[-1]["num_scores"] = int(line.split(":", 1)[1])
+            elif line.startswith("Median:") and frames:
+                frames[-1]["median"] = float(line.split(":", 1)[1])
+            elif ":" in line and not line.startswith(("=", "-")):
+                key, value = line.split(":", 1)
+                header[key.strip().lower()] = value.strip()
+        if "student_id" not in header:
+            continue
+        status = normalize_status(header.get("status", "UNKNOWN"))
+        summary = header.get("summary")
+        overall = SUMMARY_PATTERN.search(summary or "")
+        scans.append({
+            "student_id": header["student_id"],
+            "student_name": header.get("student_name"),
+            "status": status,
+            "verified": status == "PRESENT",
+            "confidence": float(overall.group(1)) if overall else None,
+            "timestamp": scan_time,
+            "num_frames": int(header["frames"]) if header.get("frames", "").isdigit() else len(frames),
+            "source": "legacy",
+            "details": {"summary": summary} if summary else None,
+            "frames": frames,
+            "import_key": f"{header['student_id']}@{scan_time:.0f}"
+        })
+    return scans
+
+def import_legacy(store, csv_text=None, history_text=None, session_id=None, batch_size=1000):
+    """
+    Import the legacy CSV and scan-history logs into the store
+
+    Both files describe the same scans, so rows are merged on
+    (student ID, timestamp): the history contributes frames, the CSV the
+    recorded attendance status. Re-importing the same files is a no-op.
+
+    Returns:
+        dict: scans read from each source
+    """
+    history = parse_scan_history(history_text) if history_text else []
+    attendance = parse_attendance_csv(csv_text) if csv_text else []
+    for scan in history + attendance:
+        if session_id:
+            scan["session_id"] = session_id
+    for scans in (history, attendance):
+        for start in range(0, len(scans), batch_size):
+            store.insert_scans(scans[start:start + batch_size], upsert=True)
+    return {"history_scans": len(history), "csv_scans": len(attendance)}
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="EduFace attendance store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="Import legacy CSV / scan history logs")
+    importer.add_argument("--db", default=os.getenv("ATTENDANCE_DB", "attendance.db"))
+    importer.add_argument("--csv", help="class_attendance.csv path")
+    importer.add_argument("--history", help="scan_history.txt path")
+    importer.add_argument("--session", help="Session ID for every imported scan (default: scan date)")
+    args = parser.parse_args()
+
+    def read_text(path):
+        if not path:
+            return None
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+    store = AttendanceStore(args.db)
+    counts = import_legacy(store, read_text(args.csv), read_text(args.history), args.session)
+    store.close()
+    print(f"Imported {counts['history_scans']} history scans and {counts['csv_scans']} CSV rows into {args.db}")
@@ -0,0 +1,111 @@
+"""
+Recall@k and latency of the IVF-PQ gallery index against brute force
+
+Uses synthetic embeddings shaped like the Siamese tower output (sigmoid
+activations in [0, 1]): one random centre per student, references and
+queries are noisy copies of it. The head kernel is random and signed.
+
+Usage:
+    python benchmarks/ann_benchmark.py --students 2000 --references 15
+    python benchmarks/ann_benchmark.py --output ann.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ann_index import IVFPQIndex
+
+def synthetic_gallery(num_students, references, dim, noise, rng):
+    centres = rng.beta(0.5, 0.5, size=(num_students, dim)).astype(np.float32)
+    owners = np.repeat(np.arange(num_students), references)
+    vectors = np.clip(centres[owners] + rng.normal(0, noise, (len(owners), dim)), 0, 1).astype(np.float32)
+    return centres, owners, vectors
+
+def percentile_ms(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 2)
+
+def main():
+    parser = argparse.ArgumentParser(description="IVF-PQ vs brute-force benchmark")
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--references", type=int, default=15)
+    parser.add_argument("--dim", type=int, default=4096)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--noise", type=float, default=0.15)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--lists", type=int, default=64)
+    parser.add_argument("--subspaces", type=int, default=64)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--rerank", type=int, default=128)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    centres, owners, vectors = synthetic_gallery(args.students, args.references, args.dim, args.noise, rng)
+    kernel = rng.normal(0, 1.0 / np.sqrt(args.dim), args.dim).astype(np.float32)
+    kernel -= np.abs(kernel).mean()  # mostly negative: larger L1 distance -> lower score
+    bias = np.float32(5.0)
+    query_owners = rng.integers(0, args.students, args.queries)
+    queries = np.clip(centres[query_owners] + rng.normal(0, args.noise, (args.queries, args.dim)), 0, 1).astype(np.float32)
+
+    print(f"Gallery: {len(vectors)} references ({args.students} students x {args.references}), dim {args.dim}")
+    index = IVFPQIndex(kernel, bias, num_lists=args.lists, num_subspaces=args.subspaces, rerank=args.rerank)
+    started = time.time()
+    index.train(vectors)
+    train_seconds = time.time() - started
+    started = time.time()
+    index.add(range(len(vectors)), vectors)
+    add_seconds = time.time() - started
+    print(f"Train: {train_seconds:.1f}s, add: {add_seconds:.1f}s")
+
+    # Brute-force ground truth (and its latency)
+    exact_results, exact_times = [], []
+    for query in queries:
+        started = time.time()
+        exact_results.append(index.search(query, args.k, exact=True))
+        exact_times.append(time.time() - started)
+
+    results = {
+        "config": vars(args),
+        "references": int(len(vectors)),
+        "train_seconds": round(train_seconds, 2),
+        "add_seconds": round(add_seconds, 2),
+        "brute_force": {"p50_ms": percentile_ms(exact_times, 50), "p95_ms": percentile_ms(exact_times, 95)},
+        "ann": []
+    }
+    print(f"Brute force: p50 {results['brute_force']['p50_ms']} ms, p95 {results['brute_force']['p95_ms']} ms")
+
+    for nprobe in args.nprobe:
+        recalls, top1_student, times = [], [], []
+        for query, owner, exact in zip(queries, query_owners, exact_results):
+            started = time.time()
+            found = index.search(query, args.k, nprobe=nprobe)
+            times.append(time.time() - started)
+            truth = {label for label, _ in exact}
+            recalls.append(len(truth & {label for label, _ in found}) / max(1, len(truth)))
+            top1_student.append(bool(found) and owners[found[0][0]] == owner)
+        row = {
+            "nprobe": nprobe,
+            f"recall_at_{args.k}": round(float(np.mean(recalls)), 4),
+            "top1_student_accuracy": round(float(np.mean(top1_student)), 4),
+            "p50_ms": percentile_ms(times, 50),
+            "p95_ms": percentile_ms(times, 95),
+            "speedup_p50": round(float(np.median(exact_times) / np.median(times)), 1)
+        }
+        results["ann"].append(row)
+        print(f"nprobe {nprobe:3d}: recall@{args.k} {row[f'recall_at_{args.k}']:.3f}, "
+              f"top-1 student {row['top1_student_accuracy']:.3f}, "
+              f"p50 {row['p50_ms']} ms, p95 {row['p95_ms']} ms ({row['speedup_p50']}x)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+"""
+End-to-end and micro benchmarks of siamese_api with a random-weight model
+
+Builds the exact serving architecture (make_siamese_model) with random
+weights inside a scratch directory, so no MODEL_URL download or release
+asset is needed, and loads it through the normal load_siamese_model()
+path (fast-load artifact, compiled inference, split head). Scores are
+meaningless but every shape, kernel and code path is the real one.
+
+Sections:
+    micro   preprocess_image (tf / pillow), single and batched embedding,
+            pair inference and head scoring
+    batch   /batch-verify at several anchors x negatives sizes through the
+            ASGI app, with a cold and a warm image cache
+    load    closed-loop concurrent load against /predict and /batch-verify
+            (the image cache is cleared before each level, then warms up)
+
+Requests are driven in-process through the ASGI interface (no server or
+HTTP client needed); multipart bodies are encoded with urllib3.
+
+Usage:
+    python benchmarks/api_benchmark.py
+    python benchmarks/api_benchmark.py --sections micro batch --sizes 5x15 10x50
+    python benchmarks/api_benchmark.py --output new.json --compare old.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# ================================
+# MEASUREMENT HELPERS
+# ================================
+def summarize(samples):
+    """Latency summary (milliseconds) of a list of durations in seconds"""
+    samples = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "n": int(len(samples)),
+        "mean_ms": round(float(samples.mean()), 3),
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples, 95)), 3),
+        "p99_ms": round(float(np.percentile(samples, 99)), 3),
+        "min_ms": round(float(samples.min()), 3)
+    }
+
+def measure(fn, repeat, warmup=2):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+# ================================
+# TEST IMAGES
+# ================================
+def sample_images(count, seed=0):
+    """
+    `count` distinct JPEGs: repo input_images when present, else synthetic
+
+    Every image has different bytes (a faint per-image noise pattern is
+    re-encoded in), so the content-addressed image cache never collapses
+    uploads that are meant to be distinct.
+    """
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    image_dir = os.path.join(REPO_DIR, "input_images")
+    bases = []
+    if os.path.isdir(image_dir):
+        for name in sorted(os.listdir(image_dir)):
+            if name.lower().endswith((".jpg", ".jpeg")):
+                with Image.open(os.path.join(image_dir, name)) as img:
+                    bases.append(np.asarray(img.convert("RGB")))
+    if not bases:
+        yy, xx = np.mgrid[0:480, 0:640]
+        for i in range(8):
+            gradient = ((xx * (i + 1) + yy) % 256)[..., None] * np.ones(3)
+            bases.append(np.clip(gradient + rng.normal(0, 20, gradient.shape), 0, 255).astype(np.uint8))
+
+    images = []
+    for i in range(count):
+        pixels = bases[i % len(bases)].astype(np.int16)
+        if i >= len(bases):
+            pixels = pixels + rng.integers(-3, 4, pixels.shape, dtype=np.int16)
+        buffer = io.BytesIO()
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format="JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+# ================================
+# RANDOM-WEIGHT MODEL
+# ================================
+def load_api(workdir, seed):
+    """
+    Import siamese_api inside `workdir` and load a random-weight model
+
+    MODEL_PATH, artifacts and the gallery are relative to the working
+    directory, so everything the service writes stays in the scratch dir.
+    """
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("PARITY_IMAGE_DIR", os.path.join(REPO_DIR, "input_images"))
+    os.environ["MODEL_SHA256"] = ""
+    os.chdir(workdir)
+
+    import siamese_api as api
+    import tensorflow as tf
+
+    tf.random.set_seed(seed)
+    api.make_siamese_model().save(api.MODEL_PATH)
+    started = time.time()
+    api.load_siamese_model()
+    if api.model is None:
+        raise RuntimeError(f"Model failed to load: {api.model_error}")
+    print(f"Random-weight model loaded in {time.time() - started:.1f}s")
+    return api
+
+# ================================
+# ASGI DRIVER
+# ================================
+async def asgi_request(app, method, path, body=b"", content_type=None, response_headers=None):
+    """
+    Send one HTTP request straight into the ASGI app; returns (status, body)
+    
+    `response_headers`, when given, is a dict filled with the response
+    headers (lower-case names).
+    """
+    headers = [(b"host", b"bench"), (b"content-length", str(len(body)).encode())]
+    if content_type:
+        headers.append((b"content-type", content_type.encode()))
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "", "headers": headers,
+        "client": ("127.0.0.1", 0), "server": ("bench", 80)
+    }
+    request_sent = False
+    disconnected = asyncio.Event()
+    response = {"status": None, "body": []}
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            if response_headers is not None:
+                response_headers.update(
+                    (name.decode("latin-1"), value.decode("latin-1")) for name, value in message.get("headers", [])
+                )
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+            if not message.get("more_body"):
+                disconnected.set()
+
+    await app(scope, receive, send)
+    return response["status"], b"".join(response["body"])
+
+def multipart(fields):
+    """Encode [(field, filename, bytes)] (+ plain (field, value)) as multipart/form-data"""
+    from urllib3.filepost import encode_multipart_formdata
+
+    encoded = []
+    for field in fields:
+        if len(field) == 3:
+            name, filename, data = field
+            encoded.append((name, (filename, data, "image/jpeg")))
+        else:
+            encoded.append(field)
+    return encode_multipart_formdata(encoded)
+
+def batch_verify_body(anchors, negatives, early_exit=False):
+    fields = [("anchors", f"anchor_{i}.jpg", data) for i, data in enumerate(anchors)]
+    fields += [("negatives", f"negative_{i}.jpg", data) for i, data in enumerate(negatives)]
+    if early_exit:
+        fields.append(("early_exit", "true"))
+    return multipart(fields)
+
+# ================================
+# SECTIONS
+# ================================
+def bench_micro(api, images, repeat):
+    results = {}
+    image = images[0]
+    results["preprocess_tf"] = measure(lambda: api.preprocess_image_tf(image), repeat)
+    results["preprocess_pillow"] = measure(lambda: api.preprocess_image_pillow(image), repeat)
+
+    batch, _ = api.preprocess_batch(images[:32])
+    results["embed_single"] = measure(lambda: api.embed_images(batch[:1]), repeat)
+    for size in (8, 32):
+        stats = measure(lambda: api.embed_images(batch[:size], batch_size=size), max(3, repeat // 4))
+        stats["per_image_ms"] = round(stats["p50_ms"] / size, 3)
+        results[f"embed_batch_{size}"] = stats
+
+    pair = [batch[:1], batch[1:2]]
+    results["pair_inference"] = measure(lambda: api.model.predict(pair, verbose=0), repeat)
+
+    embeddings = api.embed_images(batch)
+    results["head_scoring_5x15"] = measure(
+        lambda: api.score_embeddings(embeddings[:5], embeddings[5:20]), repeat
+    )
+    for name, stats in results.items():
+        print(f"  {name:<20} p50 {stats['p50_ms']:>9.2f}ms  p95 {stats['p95_ms']:>9.2f}ms")
+    return results
+
+async def bench_batch_verify(api, images, sizes, repeat):
+    results = []
+    for anchors, negatives in sizes:
+        needed = anchors + negatives
+        for cache in ("cold", "warm"):
+            samples = []
+            for i in range(repeat + 1):
+                if cache == "cold":
+                    api.image_cache.clear()
+                body, content_type = batch_verify_body(images[:anchors], images[anchors:needed])
+                start = time.perf_counter()
+                status, payload = await asgi_request(api.app, "POST", "/batch-verify", body, content_type)
+                elapsed = time.perf_counter() - start
+                if status != 200:
+                    raise RuntimeError(f"/batch-verify {anchors}x{negatives} returned {status}: {payload[:200]}")
+                if i:  # first request warms the code path
+                    samples.append(elapsed)
+            stats = summarize(samples)
+            stats.update({"anchors": anchors, "negatives": negatives, "cache": cache})
+            results.append(stats)
+            print(f"  {anchors:>3}x{negatives:<4} {cache:<4} p50 {stats['p50_ms']:>9.2f}ms  "
+                  f"p95 {stats['p95_ms']:>9.2f}ms")
+    return results
+
+async def bench_load(api, images, endpoint, concurrency, total_requests):
+    """Closed-loop load: `concurrency` clients issue `total_requests` requests back to back"""
+    if endpoint == "predict":
+        bodies = [
+            multipart([("file1", "a.jpg", images[i % len(images)]),
+                       ("file2", "b.jpg", images[(i + 1) % len(images)])])
+            for i in range(total_requests)
+        ]
+        path = "/predict"
+    else:
+        bodies = [
+            batch_verify_body(images[i % 4:i % 4 + 3], images[10:25])
+            for i in range(total_requests)
+        ]
+        path = "/batch-verify"
+
+    latencies, errors = [], 0
+    next_request = 0
+    api.image_cache.clear()
+
+    async def client():
+        nonlocal next_request, errors
+        while next_request < total_requests:
+            body, content_type = bodies[next_request]
+            next_request += 1
+            start = time.perf_counter()
+            status, _ = await asgi_request(api.app, "POST", path, body, content_type)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    stats = summarize(latencies)
+    stats.update({
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(total_requests / wall, 2)
+    })
+    print(f"  {endpoint:<13} c={concurrency:<3} {stats['throughput_rps']:>8.2f} req/s  "
+          f"p50 {stats['p50_ms']:>9.2f}ms  p99 {stats['p99_ms']:>9.2f}ms  errors {errors}")
+    return stats
+
+# ================================
+# COMPARISON
+# ================================
+def flatten(results):
+    """Metric name -> p50 latency for comparing two result files"""
+    flat = {}
+    for name, stats in results.get("micro", {}).items():
+        flat[f"micro/{name}"] = stats["p50_ms"]
+    for stats in results.get("batch_verify", []):
+        flat[f"batch_verify/{stats['anchors']}x{stats['negatives']}/{stats['cache']}"] = stats["p50_ms"]
+    for stats in results.get("load", []):
+        flat[f"load/{stats['endpoint']}/c{stats['concurrency']}"] = stats["p50_ms"]
+    return flat
+
+def compare(previous, current):
+    before, after = flatten(previous), flatten(current)
+    print(f"\n{'metric (p50 ms)':<36} {'before':>10} {'after':>10} {'change':>8}")
+    for name in sorted(set(before) & set(after)):
+        change = (after[name] - before[name]) / before[name] * 100 if before[name] else 0.0
+        print(f"{name:<36} {before[name]:>10.2f} {after[name]:>10.2f} {change:>+7.1f}%")
+
+# ================================
+# MAIN
+# ================================
+def parse_size(value):
+    anchors, negatives = value.lower().split("x")
+    return int(anchors), int(negatives)
+
+def main():
+    parser = argparse.ArgumentParser(description="siamese_api benchmarks with a random-weight model")
+    parser.add_argument("--sections", nargs="+", choices=["micro", "batch", "load"],
+                        default=["micro", "batch", "load"])
+    parser.add_argument("--repeat", type=int, default=20, help="Iterations per microbenchmark")
+    parser.add_argument("--sizes", type=parse_size, nargs="+",
+                        default=[(1, 15), (5, 15), (10, 50)],
+                        help="/batch-verify sizes as AxN (at least 15 negatives)")
+    parser.add_argument("--batch-repeat", type=int, default=5)
+    parser.add_argument("--endpoints", nargs="+", choices=["predict", "batch-verify"],
+                        default=["predict", "batch-verify"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=64, help="Requests per load level")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Scratch directory (default: a temporary one)")
+    parser.add_argument("--output", default="api_benchmark.json", help="Results JSON path")
+    parser.add_argument("--compare", help="Previous results JSON to diff against")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    previous_path = os.path.abspath(args.compare) if args.compare else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="eduface-bench-")
+    os.makedirs(workdir, exist_ok=True)
+
+    api = load_api(workdir, args.seed)
+    needed = max([a + n for a, n in args.sizes] + [32, 64])
+    images = sample_images(needed, args.seed)
+
+    import tensorflow as tf
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "tensorflow": tf.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": args.seed,
+            "config": {
+                "INFERENCE_BACKEND": api.INFERENCE_BACKEND,
+                "PREPROCESS_BACKEND": api.PREPROCESS_BACKEND,
+                "EMBED_BATCH_SIZE": api.EMBED_BATCH_SIZE,
+                "PAIR_BATCH_SIZE": api.PAIR_BATCH_SIZE,
+                "TF_INTRA_OP_THREADS": api.TF_INTRA_OP_THREADS
+            },
+            "load_phases": dict(api.load_phases)
+        }
+    }
+
+    if "micro" in args.sections:
+        print("\nMicrobenchmarks")
+        results["micro"] = bench_micro(api, images, args.repeat)
+
+    async def run_http():
+        if "batch" in args.sections:
+            print("\n/batch-verify")
+            results["batch_verify"] = await bench_batch_verify(api, images, args.sizes, args.batch_repeat)
+        if "load" in args.sections:
+            print("\nLoad")
+            results["load"] = [
+                await bench_load(api, images, endpoint, concurrency, args.requests)
+                for endpoint in args.endpoints
+                for concurrency in args.concurrency
+            ]
+    asyncio.run(run_http())
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if previous_path:
+        with open(previous_path) as f:
+            compare(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
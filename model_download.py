@@ -0,0 +1,360 @@
+"""
+Resumable model download over parallel HTTP range requests
+
+The release asset is fetched in fixed-size parts by several connections,
+each written at its offset of a preallocated partial file. Completed
+parts are recorded next to it, so an interrupted download resumes with
+the missing parts only; servers without usable range support get one
+stream that resumes from the partial file's length. Nothing is installed
+before the SHA-256 matches.
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import time
+from threading import Thread, Lock
+
+import requests
+
+logger = logging.getLogger("eduface.download")
+
+DOWNLOAD_BUFFER_BYTES = 1024 * 1024
+
+# The missing-digest warning is logged once per process, on the first download
+missing_sha256_warned = False
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# ================================
+# DOWNLOAD STATE
+# ================================
+class DownloadState:
+    """
+    Progress of a ranged download, persisted next to the partial file
+    
+    The partial file is preallocated to the full size and parts are
+    written at their offsets by several connections, so resuming needs the
+    set of completed parts rather than the partial file's length. The
+    state also pins the remote size/ETag, so a changed release asset
+    starts over instead of mixing bytes from two versions. A single-stream
+    download (part_size None) keeps only this identity: its partial file
+    is a prefix, resumed from its length.
+    """
+
+    def __init__(self, path, url, total_size, etag, part_size):
+        self.path = path
+        self.identity = {"url": url, "size": total_size, "etag": etag, "part_size": part_size}
+        self.done = set()
+        self.lock = Lock()
+
+    def load(self, part_path):
+        """Restore completed parts when the partial file matches this download"""
+        if not (os.path.exists(self.path) and os.path.exists(part_path)):
+            return False
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if saved.get("identity") != self.identity:
+            return False
+        if self.identity["part_size"] and os.path.getsize(part_path) != self.identity["size"]:
+            return False
+        self.done = set(saved.get("done", []))
+        return True
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"identity": self.identity, "done": sorted(self.done)}, f)
+        os.replace(tmp_path, self.path)
+
+    def mark_done(self, index):
+        with self.lock:
+            self.done.add(index)
+            self.save()
+
+# ================================
+# FETCHING
+# ================================
+def probe_download(session, url):
+    """
+    Returns:
+        tuple: (final URL after redirects, total size or 0, ETag, ranges supported)
+    """
+    response = session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=60, allow_redirects=True)
+    try:
+        response.raise_for_status()
+        etag = response.headers.get("ETag") or response.headers.get("Last-Modified")
+        content_range = response.headers.get("Content-Range", "")
+        if response.status_code == 206 and "/" in content_range and not content_range.endswith("/*"):
+            return response.url, int(content_range.rsplit("/", 1)[1]), etag, True
+        if response.status_code == 206:
+            # A range answer of unknown total: the size is not known up front
+            return response.url, 0, etag, False
+        return response.url, int(response.headers.get("content-length", 0)), etag, False
+    finally:
+        response.close()
+
+class URLExpired(IOError):
+    """A resolved download URL was refused (HTTP 403/410), e.g. an expired signature"""
+
+    def __init__(self, url, status_code):
+        super().__init__(f"Download URL refused with HTTP {status_code}")
+        self.url = url
+
+class ResolvedURL:
+    """
+    Download URL after redirects, re-resolved when it stops working
+    
+    Release assets redirect to short-lived signed URLs, so a long ranged
+    download can outlive the URL found by the first probe. When a range
+    request is refused, the original URL is probed again; the new target
+    must still report the same size and ETag.
+    """
+
+    def __init__(self, url, final_url, total_size, etag):
+        self.url = url
+        self.current = final_url
+        self.total_size = total_size
+        self.etag = etag
+        self.lock = Lock()
+
+    def refresh(self, session, stale):
+        """New final URL after `stale` was refused (once for all connections)"""
+        with self.lock:
+            if self.current == stale:
+                final_url, total_size, etag, _ = probe_download(session, self.url)
+                if (total_size, etag) != (self.total_size, self.etag):
+                    raise IOError("Remote file changed during download")
+                logger.info("Download URL re-resolved", extra={"fields": {"model_url": self.url}})
+                self.current = final_url
+            return self.current
+
+def fetch_range(session, url, fd, start, end):
+    """Write bytes [start, end] of `url` at the same offset of `fd`"""
+    response = session.get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True, timeout=600)
+    try:
+        if response.status_code in (403, 410):
+            raise URLExpired(url, response.status_code)
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise IOError(f"Server ignored range request (HTTP {response.status_code})")
+        offset = start
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_BUFFER_BYTES):
+            if chunk:
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+    finally:
+        response.close()
+    if offset != end + 1:
+        raise IOError(f"Short read for bytes {start}-{end}: got {offset - start}")
+
+def download_ranges(resolved, part_path, state, total_size, part_size, connections, retries):
+    """Fetch all missing parts of the file over parallel range requests"""
+    parts = [
+        (i, start, min(start + part_size, total_size) - 1)
+        for i, start in enumerate(range(0, total_size, part_size))
+    ]
+    pending = queue.Queue()
+    for part in parts:
+        if part[0] not in state.done:
+            pending.put(part)
+    resumed = len(parts) - pending.qsize()
+    if resumed:
+        logger.info("Resuming download", extra={"fields": {"parts_done": resumed, "parts_total": len(parts)}})
+    
+    failures = []
+    fd = os.open(part_path, os.O_RDWR)
+    
+    def worker():
+        session = requests.Session()
+        while not failures:
+            try:
+                index, start, end = pending.get_nowait()
+            except queue.Empty:
+                return
+            for attempt in range(1, retries + 1):
+                try:
+                    try:
+                        fetch_range(session, resolved.current, fd, start, end)
+                    except URLExpired as e:
+                        fetch_range(session, resolved.refresh(session, e.url), fd, start, end)
+                    state.mark_done(index)
+                    logger.debug("Download progress",
+                                 extra={"fields": {"parts_done": len(state.done), "parts_total": len(parts)}})
+                    break
+                except Exception as e:
+                    if attempt == retries:
+                        failures.append(f"bytes {start}-{end}: {e}")
+                    else:
+                        time.sleep(attempt)
+    
+    try:
+        threads = [Thread(target=worker, daemon=True) for _ in range(max(1, min(connections, len(parts))))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    if failures:
+        raise IOError(f"Download incomplete ({len(failures)} parts failed): {failures[0]}")
+
+def download_stream(session, resolved, part_path, retries):
+    """
+    Single-connection fallback for servers without usable range support
+    
+    Each attempt continues from the bytes already in the partial file with
+    `Range: bytes=<size>-` (guarded by If-Range when the server sent an
+    ETag). A 206 answer is appended; a 200 answer means the server ignored
+    the range or the file changed, and the partial file starts over.
+    """
+    for attempt in range(1, retries + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            if resolved.etag:
+                headers["If-Range"] = resolved.etag
+        try:
+            # The original URL, so every attempt follows fresh redirects
+            response = session.get(resolved.url, headers=headers, stream=True, timeout=600, allow_redirects=True)
+            try:
+                if response.status_code == 416 and offset and offset == resolved.total_size:
+                    return
+                if response.status_code == 416:
+                    os.remove(part_path)
+                    raise IOError(f"Partial file ({offset} bytes) does not match the remote file")
+                response.raise_for_status()
+                if offset and response.status_code == 206:
+                    logger.info("Resuming download", extra={"fields": {"offset": offset}})
+                with open(part_path, 'ab' if response.status_code == 206 else 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_BUFFER_BYTES):
+                        if chunk:
+                            f.write(chunk)
+                    f.flush()
+                    os.fsync(f.fileno())
+            finally:
+                response.close()
+            return
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(attempt)
+
+# ================================
+# DOWNLOAD
+# ================================
+def download_file(url, path, sha256="", connections=4, part_size=8 * 1024 * 1024, retries=3):
+    """
+    Download a release asset and install it atomically
+    
+    Bytes go to `path + ".part"` over parallel HTTP range requests (with
+    resume of completed parts after an interruption; a single resumable
+    stream when the server cannot serve ranges), are checked against
+    the expected SHA-256, and only then renamed to `path`. A truncated or
+    corrupted download therefore never appears under `path`.
+    
+    Args:
+        url: asset URL
+        path: install path
+        sha256: expected hex digest (empty skips the check, with a warning
+            on the first download of the process)
+        connections: parallel range requests
+        part_size: bytes per range request
+        retries: attempts per part (or per stream) before giving up
+        
+    Returns:
+        str: SHA-256 of the installed file, or None when an existing file
+        was accepted without hashing
+    """
+    sha256 = sha256.strip().lower()
+    part_path = path + ".part"
+    state_path = part_path + ".json"
+    
+    global missing_sha256_warned
+    if os.path.exists(path):
+        file_size = os.path.getsize(path) / (1024*1024)
+        if not sha256:
+            logger.info("Model file present", extra={"fields": {
+                "model_path": path, "size_mb": round(file_size, 2), "sha256_verified": False
+            }})
+            return None
+        checksum = file_sha256(path)
+        if checksum == sha256:
+            logger.info("Model file present", extra={"fields": {
+                "model_path": path, "size_mb": round(file_size, 2), "sha256_verified": True
+            }})
+            return checksum
+        logger.warning("Existing model fails checksum, re-downloading", extra={"fields": {
+            "model_path": path, "sha256": checksum, "expected_sha256": sha256
+        }})
+        os.remove(path)
+    
+    if not sha256 and not missing_sha256_warned:
+        missing_sha256_warned = True
+        logger.warning(
+            "No MODEL_SHA256 configured: the downloaded model will not be integrity-checked",
+            extra={"fields": {"model_url": url, "model_path": path}}
+        )
+    
+    try:
+        logger.info("Downloading model", extra={"fields": {"model_url": url, "model_path": path}})
+        download_start = time.time()
+        session = requests.Session()
+        final_url, total_size, etag, ranged = probe_download(session, url)
+        resolved = ResolvedURL(url, final_url, total_size, etag)
+        logger.info("Download size probed", extra={"fields": {
+            "size_mb": round(total_size / (1024*1024), 2), "ranges": ranged
+        }})
+        
+        if ranged and total_size > 0:
+            state = DownloadState(state_path, url, total_size, etag, part_size)
+            if not state.load(part_path):
+                with open(part_path, 'wb') as f:
+                    f.truncate(total_size)
+            download_ranges(resolved, part_path, state, total_size, part_size, connections, retries)
+        else:
+            state = DownloadState(state_path, url, total_size, etag, None)
+            if not state.load(part_path) and os.path.exists(part_path):
+                os.remove(part_path)
+            state.save()
+            download_stream(session, resolved, part_path, retries)
+        
+        downloaded_size = os.path.getsize(part_path)
+        if total_size and downloaded_size != total_size:
+            raise IOError(f"Size mismatch: expected {total_size} bytes, got {downloaded_size}")
+        
+        checksum = file_sha256(part_path)
+        if sha256 and checksum != sha256:
+            for stale in (part_path, state_path):
+                if os.path.exists(stale):
+                    os.remove(stale)
+            raise IOError(f"Checksum mismatch: expected {sha256}, got {checksum}")
+        
+        os.replace(part_path, path)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        
+        elapsed = time.time() - download_start
+        logger.info("Model downloaded", extra={"fields": {
+            "size_mb": round(downloaded_size / (1024*1024), 2),
+            "seconds": round(elapsed, 1),
+            "mb_per_second": round(downloaded_size / (1024*1024) / max(elapsed, 1e-6), 1),
+            "sha256": checksum,
+            "sha256_verified": bool(sha256)
+        }})
+        return checksum
+        
+    except Exception as e:
+        logger.error("Model download failed: %s", e, exc_info=True)
+        raise RuntimeError(f"Could not download model: {e}")
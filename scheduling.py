@@ -0,0 +1,456 @@
+"""
+Request scheduling: admission, a priority-aware thread pool and micro-batching
+
+Every request carries an Admission (request class, session queue and
+deadline) in a context variable. InferenceExecutor runs CPU-bound jobs on
+a bounded pool, serving the highest class first, sessions within a class
+by earliest deadline then in turns, and shedding jobs that cannot finish
+in time with a 503 and Retry-After. MicroBatcher coalesces concurrent
+small requests into one job on such a pool.
+"""
+import asyncio
+import contextvars
+import heapq
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from threading import Thread, Lock, Condition
+
+from fastapi import HTTPException
+
+# ================================
+# ADMISSION
+# ================================
+# Highest priority first
+REQUEST_CLASSES = ("critical", "interactive", "bulk", "background")
+DEFAULT_REQUEST_CLASS = os.getenv("DEFAULT_REQUEST_CLASS", "interactive")
+
+if DEFAULT_REQUEST_CLASS not in REQUEST_CLASSES:
+    raise ValueError(f"DEFAULT_REQUEST_CLASS must be one of {', '.join(REQUEST_CLASSES)}")
+
+class Admission:
+    """Scheduling attributes of one request: class, session queue and absolute deadline"""
+    __slots__ = ("request_class", "rank", "session", "deadline")
+
+    def __init__(self, request_class=DEFAULT_REQUEST_CLASS, session="-", deadline=None):
+        self.request_class = request_class
+        self.rank = REQUEST_CLASSES.index(request_class)
+        self.session = session
+        self.deadline = deadline   # time.monotonic() seconds, or None
+
+# Admission of the request being served (None outside requests, e.g. batcher tasks)
+admission_context = contextvars.ContextVar("admission_context", default=None)
+DEFAULT_ADMISSION = Admission()
+
+# ================================
+# EXECUTOR
+# ================================
+class InferenceExecutor:
+    """
+    Bounded, priority-aware thread pool for CPU-bound preprocessing and inference
+    
+    Keeps TensorFlow and NumPy work off the asyncio event loop so health
+    probes and uploads stay responsive. At most `num_threads` jobs run and
+    `max_queued` wait; beyond that callers get a fast 503 with Retry-After.
+    
+    Waiting jobs sit in one queue per (request class, session). Workers
+    take the highest class with work; within a class the session whose
+    next job has the earliest deadline goes first, and sessions without
+    deadlines take turns. A full pool makes room for a higher class by
+    evicting the newest-deadline job of the lowest queued class. Jobs whose
+    deadline can't be met, judged from the work queued ahead and the
+    smoothed service time of each job type, are refused on submission and
+    dropped on dequeue instead of running late.
+    """
+
+    def __init__(self, num_threads, max_queued, name="inference", retry_after_seconds=2,
+                 service_time_smoothing=0.2, shed_counter=None, wait_histogram=None):
+        self.name = name
+        self.num_threads = max(1, int(num_threads))
+        self.capacity = self.num_threads + max(0, int(max_queued))
+        self.retry_after_seconds = retry_after_seconds
+        self.service_time_smoothing = service_time_smoothing
+        # Optional metrics: shed_counter.inc(executor, class, reason), wait_histogram.observe(seconds, executor, class)
+        self.shed_counter = shed_counter
+        self.wait_histogram = wait_histogram
+        self._lock = Lock()
+        self._ready = Condition(self._lock)
+        # rank -> session -> [last served sequence, heap of jobs]
+        self._queues = [OrderedDict() for _ in REQUEST_CLASSES]
+        self._queued = 0
+        self._sequence = 0
+        self._running = {}   # job sequence -> (job type, started)
+        self._workers = []
+        self.service_time = {}   # job type -> smoothed seconds
+        self.wait_time = {cls: [0.0, 0] for cls in REQUEST_CLASSES}   # total seconds, jobs
+        self.shed = {}   # (class, reason) -> jobs
+        self.outstanding = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _ensure_workers(self):
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.num_threads):
+                worker = Thread(target=self._work, name=f"{self.name}-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _next_sequence(self):
+        self._sequence += 1
+        return self._sequence
+
+    def _pop(self):
+        """Next job by class, then earliest session deadline, then round-robin (lock held)"""
+        for sessions in self._queues:
+            if not sessions:
+                continue
+            session = min(sessions, key=lambda s: (sessions[s][1][0][0], sessions[s][0]))
+            entry = sessions[session]
+            job = heapq.heappop(entry[1])
+            entry[0] = self._next_sequence()
+            if not entry[1]:
+                del sessions[session]
+            self._queued -= 1
+            return job
+        return None
+
+    def _evict_below(self, rank):
+        """Remove a queued job of the lowest class below `rank`, or None (lock held)"""
+        for lower in range(len(REQUEST_CLASSES) - 1, rank, -1):
+            sessions = self._queues[lower]
+            if not sessions:
+                continue
+            # Take from the longest queue, latest deadline first
+            session = max(sessions, key=lambda s: len(sessions[s][1]))
+            heap = sessions[session][1]
+            job = max(heap)
+            heap.remove(job)
+            heapq.heapify(heap)
+            if not heap:
+                del sessions[session]
+            self._queued -= 1
+            self.outstanding -= 1
+            return job
+        return None
+
+    def _service_estimate(self, job_type):
+        return self.service_time.get(job_type, 0.0)
+
+    def _estimated_wait(self, rank, now):
+        """Seconds until a new job of class `rank` would start (lock held)"""
+        work = sum(
+            max(0.0, self._service_estimate(job_type) - (now - started))
+            for job_type, started in self._running.values()
+        )
+        for sessions in self._queues[:rank + 1]:
+            for _, heap in sessions.values():
+                work += sum(self._service_estimate(job[2]) for job in heap)
+        return work / self.num_threads
+
+    def _retry_after(self, rank, now):
+        """Retry-After seconds: the current queue wait for class `rank`, at least 1 (lock held)"""
+        return str(max(1, math.ceil(self._estimated_wait(rank, now))))
+
+    def _count_shed(self, request_class, reason):
+        key = (request_class, reason)
+        self.shed[key] = self.shed.get(key, 0) + 1
+        if self.shed_counter is not None:
+            self.shed_counter.inc(self.name, request_class, reason)
+
+    def _check_deadline(self, admission, job_type, now):
+        """Raise 503 when a job submitted now can't finish before the deadline (lock held)"""
+        if admission.deadline is None:
+            return
+        finish = now + self._estimated_wait(admission.rank, now) + self._service_estimate(job_type)
+        if finish > admission.deadline:
+            self._count_shed(admission.request_class, "deadline")
+            raise HTTPException(
+                status_code=503,
+                detail={
+                    "error": "Deadline cannot be met",
+                    "message": f"Estimated completion {(finish - now) * 1000:.0f} ms exceeds the "
+                               f"{max(0.0, admission.deadline - now) * 1000:.0f} ms left for this request",
+                    "request_class": admission.request_class
+                },
+                headers={"Retry-After": self._retry_after(admission.rank, now)}
+            )
+
+    def admit(self, fn, admission=None):
+        """Raise 503 now if fn couldn't start and finish within the request's deadline"""
+        admission = admission or admission_context.get() or DEFAULT_ADMISSION
+        with self._lock:
+            self._check_deadline(admission, getattr(fn, "__name__", "job"), time.monotonic())
+
+    def _work(self):
+        while True:
+            with self._ready:
+                while not self._queued:
+                    self._ready.wait()
+                job = self._pop()
+                started = time.monotonic()
+                self._running[job[1]] = (job[2], started)
+                _, sequence, job_type, fn, args, loop, future, context, admission, enqueued = job
+                waited = self.wait_time[admission.request_class]
+                waited[0] += started - enqueued
+                waited[1] += 1
+                expired = (
+                    admission.deadline is not None
+                    and started + self._service_estimate(job_type) > admission.deadline
+                )
+                if expired:
+                    self._count_shed(admission.request_class, "expired")
+                    retry_after = self._retry_after(admission.rank, started)
+            if self.wait_histogram is not None:
+                self.wait_histogram.observe(started - enqueued, self.name, admission.request_class)
+            ran = False
+            try:
+                if future.cancelled():
+                    continue
+                if expired:
+                    error = HTTPException(
+                        status_code=503,
+                        detail={
+                            "error": "Deadline exceeded",
+                            "message": f"Dropped after waiting {(started - enqueued) * 1000:.0f} ms in the "
+                                       f"{admission.request_class} queue; it could no longer finish in time",
+                            "request_class": admission.request_class
+                        },
+                        headers={"Retry-After": retry_after}
+                    )
+                    loop.call_soon_threadsafe(self._resolve, future, None, error)
+                    continue
+                ran = True
+                try:
+                    result = context.run(fn, *args)
+                except BaseException as e:
+                    loop.call_soon_threadsafe(self._resolve, future, None, e)
+                else:
+                    loop.call_soon_threadsafe(self._resolve, future, result, None)
+            finally:
+                with self._lock:
+                    del self._running[sequence]
+                    if ran:
+                        elapsed = time.monotonic() - started
+                        previous = self.service_time.get(job_type)
+                        self.service_time[job_type] = (
+                            elapsed if previous is None else previous + self.service_time_smoothing * (elapsed - previous)
+                        )
+                    self.outstanding -= 1
+                    self.completed += 1
+
+    @staticmethod
+    def _resolve(future, result, error):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _queue_full_error(self):
+        return HTTPException(
+            status_code=503,
+            detail={
+                "error": "Inference queue full",
+                "message": f"Server busy, retry in {self.retry_after_seconds}s"
+            },
+            headers={"Retry-After": str(self.retry_after_seconds)}
+        )
+
+    async def run(self, fn, *args):
+        """
+        Run fn(*args) on the pool under the current request's admission
+        
+        Raises 503 if the queue is full (and holds nothing of a lower class
+        to evict) or the request's deadline can't be met.
+        """
+        admission = admission_context.get() or DEFAULT_ADMISSION
+        job_type = getattr(fn, "__name__", "job")
+        with self._lock:
+            now = time.monotonic()
+            self._check_deadline(admission, job_type, now)
+            victim = None
+            if self.outstanding >= self.capacity:
+                victim = self._evict_below(admission.rank)
+                if victim is None:
+                    self.rejected += 1
+                    self._count_shed(admission.request_class, "queue_full")
+                    raise self._queue_full_error()
+                self._count_shed(victim[8].request_class, "evicted")
+            self.outstanding += 1
+        if victim is not None:
+            victim[5].call_soon_threadsafe(self._resolve, victim[6], None, self._queue_full_error())
+        self._ensure_workers()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._ready:
+            sequence = self._next_sequence()
+            deadline_key = admission.deadline if admission.deadline is not None else float("inf")
+            job = (deadline_key, sequence, job_type, fn, args, loop, future,
+                   contextvars.copy_context(), admission, now)
+            sessions = self._queues[admission.rank]
+            entry = sessions.get(admission.session)
+            if entry is None:
+                entry = sessions[admission.session] = [sequence, []]
+            heapq.heappush(entry[1], job)
+            self._queued += 1
+            self._ready.notify()
+        return await future
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "threads": self.num_threads,
+                "capacity": self.capacity,
+                "outstanding": self.outstanding,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "queued_by_class": {
+                    cls: sum(len(heap) for _, heap in sessions.values())
+                    for cls, sessions in zip(REQUEST_CLASSES, self._queues)
+                },
+                "sessions_by_class": {cls: len(sessions) for cls, sessions in zip(REQUEST_CLASSES, self._queues)},
+                # Per session queue: jobs waiting and how long the oldest has waited
+                "session_queues": [
+                    {
+                        "request_class": cls,
+                        "session": session,
+                        "queued": len(heap),
+                        "oldest_wait_ms": round((now - min(job[9] for job in heap)) * 1000, 2)
+                    }
+                    for cls, sessions in zip(REQUEST_CLASSES, self._queues)
+                    for session, (_, heap) in sessions.items()
+                ],
+                "mean_wait_ms_by_class": {
+                    cls: round(total / count * 1000, 2) if count else None
+                    for cls, (total, count) in self.wait_time.items()
+                },
+                "shed": {f"{cls}:{reason}": count for (cls, reason), count in sorted(self.shed.items())},
+                "service_time_ms": {job_type: round(seconds * 1000, 2)
+                                    for job_type, seconds in sorted(self.service_time.items())}
+            }
+
+# ================================
+# MICRO-BATCHING
+# ================================
+class MicroBatcher:
+    """
+    Coalesce concurrent requests into batched forward passes
+    
+    Pending items are gathered for up to `max_wait_ms` after the first one
+    arrives, or until `max_batch_size` are queued, then `process_fn` runs
+    once on the whole batch on `executor` (an InferenceExecutor) and each
+    awaiting request gets its own result.
+    A batch is scheduled at the highest class among its requests; requests
+    whose deadline can't be met are refused before joining a batch.
+    """
+
+    HISTOGRAM_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+    def __init__(self, process_fn, executor, max_batch_size, max_wait_ms):
+        self.process_fn = process_fn
+        self.executor = executor
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self._pending = deque()
+        self._wakeup = None
+        self._task = None
+        self.requests = 0
+        self.batches = 0
+        self.batch_size_histogram = {bucket: 0 for bucket in self.HISTOGRAM_BUCKETS}
+        self.batch_size_histogram["+Inf"] = 0
+
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    async def submit(self, item):
+        """Queue one item and wait for its result"""
+        admission = admission_context.get() or DEFAULT_ADMISSION
+        self.executor.admit(self.process_fn, admission)
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            # Batches serve many requests: run in an empty context so no
+            # request-scoped state of the one that started this task leaks in
+            self._task = loop.create_task(self._run(), context=contextvars.Context())
+        future = loop.create_future()
+        self._pending.append((item, future, admission))
+        self.requests += 1
+        self._wakeup.set()
+        return await future
+
+    def _record_batch(self, size):
+        self.batches += 1
+        for bucket in self.HISTOGRAM_BUCKETS:
+            if size <= bucket:
+                self.batch_size_histogram[bucket] += 1
+                return
+        self.batch_size_histogram["+Inf"] += 1
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._pending:
+                continue
+            
+            # Gather more items until the batch is full or the window closes
+            deadline = loop.time() + self.max_wait
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                self._wakeup.clear()
+            
+            batch = []
+            admissions = []
+            while self._pending and len(batch) < self.max_batch_size:
+                item, future, admission = self._pending.popleft()
+                if not future.cancelled():
+                    batch.append((item, future))
+                    admissions.append(admission)
+            if self._pending:
+                self._wakeup.set()
+            if not batch:
+                continue
+            
+            self._record_batch(len(batch))
+            try:
+                results = await self._process([item for item, _ in batch], admissions)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def _process(self, items, admissions):
+        request_class = REQUEST_CLASSES[min(admission.rank for admission in admissions)]
+        token = admission_context.set(Admission(request_class, "predict-batch"))
+        try:
+            return await self.executor.run(self.process_fn, items)
+        finally:
+            admission_context.reset(token)
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self.queue_depth,
+            "requests": self.requests,
+            "batches": self.batches,
+            "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else None,
+            "batch_size_histogram": {str(k): v for k, v in self.batch_size_histogram.items()}
+        }
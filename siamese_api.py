@@ -13,10 +13,12 @@ os.environ['TF_FORCE_GPU_ALLOW_GROWTH'] = 'true'
 # Block standalone Keras 3.x BEFORE any imports
 import importlib.util
 keras_spec = importlib.util.find_spec("keras")
+# Logged once logging is set up
+keras_blocked = False
 if keras_spec:
     spec_origin = getattr(keras_spec, 'origin', '')
     if spec_origin and 'site-packages/keras/' in spec_origin:
-        print("⚠️ Blocking standalone Keras 3.x")
+        keras_blocked = True
         # Prevent keras from being imported
         if 'keras' in sys.modules:
             del sys.modules['keras']
@@ -37,21 +39,43 @@ try:
 except:
     pass
 
-print(f"✅ Using TensorFlow: {tf.__version__}, Keras: {keras_version}")
 if not keras_version.startswith('2.'):
-    raise RuntimeError(f"❌ WRONG KERAS: {keras_version}. Need 2.x!")
+    raise RuntimeError(f"WRONG KERAS: {keras_version}. Need 2.x!")
 
 # ================================================
 # REST OF IMPORTS
 # ================================================
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from typing import Optional
+from fastapi import FastAPI, UploadFile, File, Form, Body, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse
 import numpy as np
+from PIL import Image
 import io
+import re
+import json
+import asyncio
+import hashlib
+import binascii
 import traceback
-import requests
 from threading import Thread, Lock
+import queue
+import argparse
+import multiprocessing
+from collections import OrderedDict
 import time
+import bisect
+import uuid
+import atexit
+import logging
+import logging.handlers
+import contextvars
+from ann_index import IVFPQIndex
+from attendance_store import AttendanceStore, import_legacy
+from model_download import download_file, file_sha256
+from quality_gate import QualityGate, image_sharpness
+from scheduling import (
+    REQUEST_CLASSES, DEFAULT_REQUEST_CLASS, Admission, InferenceExecutor, MicroBatcher, admission_context
+)
 
 # Initialize FastAPI
 app = FastAPI()
@@ -64,130 +88,500 @@ model_error = None
 model_lock = Lock()
 load_start_time = None
 
+# Split model components (embedding tower + L1 distance head)
+embedding_model = None
+head_kernel = None
+head_bias = None
+head_parity_error = None
+# "<model sha256>/<backend>" of the served embedding tower: embeddings
+# are only comparable within one space (gallery entries are keyed on it)
+embedding_space = None
+
 # ================================
 # MODEL CONFIGURATION
 # ================================
 MODEL_PATH = "siamese_model.h5"
 MODEL_URL = os.getenv("MODEL_URL", "https://github.com/mwangiiii/EduFace/releases/download/v0.2.0-alpha/siamese_model.h5")
+TF_INTRA_OP_THREADS = int(os.getenv("TF_INTRA_OP_THREADS", "2"))
 
 # ================================
-# MODEL DOWNLOAD
+# LOGGING
 # ================================
-def download_model():
-    """Download model from GitHub release"""
-    if os.path.exists(MODEL_PATH):
-        file_size = os.path.getsize(MODEL_PATH) / (1024*1024)
-        print(f"✅ Model exists: {MODEL_PATH} ({file_size:.2f}MB)")
-        return
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+logger = logging.getLogger("eduface")
+
+# Per-request fields merged into the request's access record
+request_context = contextvars.ContextVar("request_context", default=None)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, message + structured fields"""
+
+    def format(self, record):
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            payload.update(fields)
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks the caller
     
-    try:
-        print("=" * 60)
-        print("🔽 DOWNLOADING MODEL")
-        print(f"📍 URL: {MODEL_URL}")
-        print("=" * 60)
-        
-        response = requests.get(MODEL_URL, stream=True, timeout=600, allow_redirects=True)
-        response.raise_for_status()
-        
-        total_size = int(response.headers.get('content-length', 0))
-        downloaded = 0
+    Records are formatted (JSON) on the calling thread and written to
+    stdout by a QueueListener thread; if the queue is full the record is
+    dropped and counted instead of stalling a request.
+    """
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+def setup_logging():
+    """Route the "eduface" logger through a bounded queue to stdout"""
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.setFormatter(JsonFormatter())
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.handlers[:] = [handler]
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    return listener
+
+log_listener = setup_logging()
+logger.info("Using TensorFlow", extra={"fields": {
+    "tensorflow": tf.__version__, "keras": keras_version, "standalone_keras_blocked": keras_blocked
+}})
+
+def log_fields(**fields):
+    """Attach fields (IDs, decision, ...) to the current request's log record"""
+    context = request_context.get()
+    if context is not None:
+        context.update(fields)
+
+# ================================
+# METRICS
+# ================================
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    """
+    Minimal thread-safe Prometheus histogram (cumulative buckets per label set)
+    
+    Observation is a bisect plus three increments under a lock, so it can
+    sit on hot paths (per image, per batch).
+    """
+
+    def __init__(self, name, documentation, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, [list(s[0]), s[1], s[2]]) for labels, s in self._series.items())
+        for labels, (counts, total, count) in series:
+            base = format_labels(self.label_names, labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{format_labels(self.label_names + ("le",), labels + (le,))} {cumulative}')
+            lines.append(f"{self.name}_sum{base} {total}")
+            lines.append(f"{self.name}_count{base} {count}")
+        return lines
+
+class Counter:
+    """Minimal thread-safe Prometheus counter"""
+
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{format_labels(self.label_names, labels)} {value}")
+        return lines
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+def render_gauge(name, documentation, samples, label_names=()):
+    """Text lines for a gauge from [(label values tuple, value)]"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        if value is not None:
+            lines.append(f"{name}{format_labels(label_names, labels)} {float(value)}")
+    return lines
+
+STAGE_LATENCY = Histogram(
+    "eduface_stage_duration_seconds",
+    "Time spent per processing stage (upload_read, jpeg_validation, preprocess, quality, inference, scoring, decision)",
+    ["stage"]
+)
+REQUEST_LATENCY = Histogram(
+    "eduface_request_duration_seconds", "End-to-end HTTP request latency", ["endpoint", "status"]
+)
+REQUESTS_TOTAL = Counter("eduface_requests_total", "HTTP requests handled", ["endpoint", "status"])
+MODEL_UNAVAILABLE_TOTAL = Counter(
+    "eduface_model_unavailable_total", "503 responses because the model was not ready", ["reason"]
+)
+QUALITY_REJECTIONS = Counter(
+    "eduface_quality_rejections_total", "Frames dropped by the pre-inference quality gate", ["reason"]
+)
+ADMISSION_WAIT = Histogram(
+    "eduface_admission_wait_seconds", "Time jobs spent queued before an executor thread picked them up",
+    ["executor", "request_class"]
+)
+ADMISSION_SHED = Counter(
+    "eduface_admission_shed_total",
+    "Jobs refused or dropped by admission control (queue_full, deadline, expired, evicted)",
+    ["executor", "request_class", "reason"]
+)
+
+class observe_stage:
+    """Context manager recording the duration of one stage into STAGE_LATENCY"""
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_stage(self.stage, time.perf_counter() - self.started)
+        return False
+
+def record_stage(stage, seconds):
+    """Observe a stage duration (histogram + current request's timings)"""
+    STAGE_LATENCY.observe(seconds, stage)
+    context = request_context.get()
+    if context is not None:
+        with stage_context_lock:
+            stages = context.setdefault("stages_ms", {})
+            stages[stage] = round(stages.get(stage, 0.0) + seconds * 1000, 2)
+
+stage_context_lock = Lock()
+
+async def read_upload(upload):
+    """Read an UploadFile, recording the upload_read stage"""
+    started = time.perf_counter()
+    data = await upload.read()
+    record_stage("upload_read", time.perf_counter() - started)
+    return data
+
+QUIET_ENDPOINTS = {"health", "metrics", "root"}
+
+class RequestMiddleware:
+    """
+    ASGI middleware: request ID, latency metrics and one access record per request
+    
+    The request ID comes from X-Request-ID (or is generated) and is echoed
+    in the response; the admission headers (class, session, deadline) are
+    parsed into admission_context for the executors. Handlers add fields (decision, scores, ...) with
+    log_fields(); stage timings are collected automatically. Health and
+    metrics probes are logged at DEBUG only. With GALLERY_SYNC (pre-fork
+    workers) gallery and roster changes made by other workers are loaded
+    before the request is handled.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if GALLERY_SYNC and scope["type"] in ("http", "websocket"):
+            sync_gallery()
+        if scope["type"] == "websocket":
+            token = admission_context.set(parse_admission(scope))
+            try:
+                return await self.app(scope, receive, send)
+            finally:
+                admission_context.reset(token)
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = [500]
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+        request_id = request_id or uuid.uuid4().hex[:16]
+        admission = parse_admission(scope)
+        context = {"request_id": request_id, "request_class": admission.request_class}
+        token = request_context.set(context)
+        admission_token = admission_context.set(admission)
         
-        print(f"📊 Size: {total_size/(1024*1024):.2f}MB")
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", request_id.encode("latin-1"))
+                ]
+            await send(message)
         
-        with open(MODEL_PATH, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    if total_size > 0:
-                        percent = (downloaded / total_size) * 100
-                        print(f"⏳ Progress: {percent:.1f}%", end='\r')
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_context.reset(token)
+            admission_context.reset(admission_token)
+            elapsed = time.perf_counter() - started
+            endpoint = scope.get("endpoint")
+            name = getattr(endpoint, "__name__", "unmatched")
+            REQUEST_LATENCY.observe(elapsed, name, str(status[0]))
+            REQUESTS_TOTAL.inc(name, str(status[0]))
+            level = logging.DEBUG if name in QUIET_ENDPOINTS else logging.INFO
+            if logger.isEnabledFor(level):
+                fields = {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "endpoint": name,
+                    "status": status[0],
+                    "duration_ms": round(elapsed * 1000, 2)
+                }
+                fields.update(context)
+                logger.log(level, "request", extra={"fields": fields})
+
+app.add_middleware(RequestMiddleware)
+
+# ================================
+# MODEL DOWNLOAD
+# ================================
+MODEL_SHA256 = os.getenv("MODEL_SHA256", "").strip().lower()
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", "4"))
+DOWNLOAD_PART_MB = int(os.getenv("DOWNLOAD_PART_MB", "8"))
+DOWNLOAD_RETRIES = 3
+
+def download_model(url=None, path=None, sha256=None, connections=None):
+    """
+    Download the model release asset and install it atomically (download_file)
+    
+    Args:
+        url: asset URL (default MODEL_URL)
+        path: install path (default MODEL_PATH)
+        sha256: expected hex digest (default MODEL_SHA256; empty skips the check)
+        connections: parallel range requests (default DOWNLOAD_CONNECTIONS)
         
-        file_size = os.path.getsize(MODEL_PATH) / (1024*1024)
-        print(f"\n✅ Downloaded! Size: {file_size:.2f}MB")
-        print("=" * 60)
+    Returns:
+        str: SHA-256 of the installed file, or None when an existing file
+        was accepted without hashing
+    """
+    return download_file(
+        url or MODEL_URL,
+        path or MODEL_PATH,
+        sha256=MODEL_SHA256 if sha256 is None else sha256,
+        connections=connections or DOWNLOAD_CONNECTIONS,
+        part_size=DOWNLOAD_PART_MB * 1024 * 1024,
+        retries=DOWNLOAD_RETRIES
+    )
+
+# ================================
+# MODEL ARCHITECTURE
+# ================================
+class L1Dist(tf.keras.layers.Layer):
+    """Custom L1 Distance layer"""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    def call(self, input_embedding, validation_embedding):
+        return tf.math.abs(input_embedding - validation_embedding)
+
+    def get_config(self):
+        return super().get_config()
+
+def make_embedding():
+    inp = tf.keras.Input(shape=(100, 100, 3), name='input_image')
+    c1 = tf.keras.layers.Conv2D(64, (10,10), activation='relu')(inp)
+    m1 = tf.keras.layers.MaxPooling2D((2,2), padding='same')(c1)
+    c2 = tf.keras.layers.Conv2D(128, (7,7), activation='relu')(m1)
+    m2 = tf.keras.layers.MaxPooling2D((2,2), padding='same')(c2)
+    c3 = tf.keras.layers.Conv2D(128, (4,4), activation='relu')(m2)
+    m3 = tf.keras.layers.MaxPooling2D((2,2), padding='same')(c3)
+    c4 = tf.keras.layers.Conv2D(256, (4,4), activation='relu')(m3)
+    f1 = tf.keras.layers.Flatten()(c4)
+    d1 = tf.keras.layers.Dense(4096, activation='sigmoid')(f1)
+    return tf.keras.Model(inputs=inp, outputs=d1, name='embedding')
+
+def make_siamese_model():
+    input_image = tf.keras.Input(name='input_img', shape=(100,100,3))
+    validation_image = tf.keras.Input(name='validation_img', shape=(100,100,3))
+    embedding_model = make_embedding()
+    siamese_layer = L1Dist(name='distance')
+    distances = siamese_layer(embedding_model(input_image), embedding_model(validation_image))
+    classifier = tf.keras.layers.Dense(1, activation='sigmoid')(distances)
+    return tf.keras.Model(inputs=[input_image, validation_image], outputs=classifier, name='SiameseNetwork')
+
+# ================================
+# FAST-LOAD ARTIFACT
+# ================================
+MODEL_ARTIFACT_DIR = os.getenv("MODEL_ARTIFACT_DIR", os.path.dirname(os.path.abspath(MODEL_PATH)))
+
+# Cold-start timing breakdown (phase -> seconds), reported on /health
+load_phases = {}
+
+def record_load_phase(name, started):
+    load_phases[name] = round(time.time() - started, 3)
+
+def fast_artifact_path(model_checksum):
+    return os.path.join(MODEL_ARTIFACT_DIR, f"siamese_model.{model_checksum[:16]}.weights.bin")
+
+def export_fast_artifact(siamese_model, model_checksum):
+    """Persist the loaded weights as a flat file keyed by the .h5 checksum"""
+    path = fast_artifact_path(model_checksum)
+    export_shared_weights(siamese_model, path, metadata={"source_sha256": model_checksum})
+    
+    # Artifacts of earlier model versions are never read again
+    for name in os.listdir(MODEL_ARTIFACT_DIR):
+        stale = os.path.join(MODEL_ARTIFACT_DIR, name)
+        if name.startswith("siamese_model.") and ".weights.bin" in name and not stale.startswith(path):
+            os.remove(stale)
+
+def load_fast_artifact(model_checksum):
+    """
+    Rebuild the model from the known architecture plus the flat weights
+    
+    Skips the HDF5 loader cascade entirely. Returns None when there is no
+    artifact for this checksum or it cannot be used.
+    """
+    path = fast_artifact_path(model_checksum)
+    if not (os.path.exists(path) and os.path.exists(path + ".json")):
+        return None
+    try:
+        logger.info("Loading fast-load artifact", extra={"fields": {"path": path}})
+        weights, metadata = read_flat_weights(path)
+        if metadata.get("source_sha256") != model_checksum:
+            raise ValueError("Artifact checksum mismatch")
         
+        siamese_model = make_siamese_model()
+        embedding = siamese_model.get_layer('embedding')
+        conv_layers = [l for l in embedding.layers if isinstance(l, tf.keras.layers.Conv2D)]
+        for i, layer in enumerate(conv_layers):
+            layer.set_weights([weights[f"conv{i}/kernel"], weights[f"conv{i}/bias"]])
+        dense_layer = [l for l in embedding.layers if isinstance(l, tf.keras.layers.Dense)][0]
+        dense_layer.set_weights([weights["embedding/kernel"], weights["embedding/bias"]])
+        head_layer = [l for l in siamese_model.layers if isinstance(l, tf.keras.layers.Dense)][-1]
+        head_layer.set_weights([weights["head/kernel"].reshape(-1, 1), weights["head/bias"]])
+        return siamese_model
     except Exception as e:
-        print(f"❌ Download failed: {e}")
-        traceback.print_exc()
-        raise RuntimeError(f"Could not download model: {e}")
+        logger.warning("Fast-load artifact unusable, falling back to .h5: %s", e, extra={"fields": {"path": path}})
+        return None
 
 # ================================
 # MODEL LOADING
 # ================================
-# ... (keep all existing code up to load_siamese_model() )
-
 def load_siamese_model():
     """Load the Siamese model with custom L1Dist layer"""
     global model, model_loading, model_error, load_start_time
+    global embedding_model, head_kernel, head_bias, head_parity_error, quantized_parity, embedding_space
     with model_lock:
         if model is not None:
-            print("✅ Model already loaded")
+            logger.info("Model already loaded")
             return model
         if model_loading:
-            print("⏳ Model loading in progress")
+            logger.info("Model loading in progress")
             return None
         model_loading = True
         load_start_time = time.time()
 
     try:
-        print("=" * 60)
-        print("🚀 MODEL INITIALIZATION")
-        print("=" * 60)
+        logger.info("Model initialization started", extra={"fields": {"model_path": MODEL_PATH}})
+        load_phases.clear()
 
         # Download model
-        download_model()
+        phase_start = time.time()
+        downloaded_checksum = download_model()
+        record_load_phase("download", phase_start)
 
-        print("📦 Configuring TensorFlow...")
         try:
             tf.config.set_visible_devices([], 'GPU')
             tf.config.threading.set_inter_op_parallelism_threads(2)
-            tf.config.threading.set_intra_op_parallelism_threads(2)
+            tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
         except:
             pass
-        print(f"✅ TensorFlow configured")
-        print(f" TF version: {tf.__version__}")
+        logger.info("TensorFlow configured", extra={"fields": {
+            "tf_version": tf.__version__, "intra_op_threads": TF_INTRA_OP_THREADS
+        }})
 
         # Import Keras components (public for layers, internal for saving)
-        print("📦 Loading Keras modules...")
-        from tensorflow.keras.layers import Layer as TFLayer
         from tensorflow.keras.models import load_model as keras_load_model
-        print("✅ Keras modules loaded")
-
-        # Define custom L1 Distance layer
-        print("🔧 Defining L1Dist layer...")
-        class L1Dist(TFLayer):
-            def __init__(self, **kwargs):
-                super().__init__(**kwargs)
 
-            def call(self, input_embedding, validation_embedding):
-                return tf.math.abs(input_embedding - validation_embedding)
-
-            def get_config(self):
-                return super().get_config()
+        # Fast path: converted artifact for this exact model file
+        phase_start = time.time()
+        model_checksum = downloaded_checksum or file_sha256(MODEL_PATH)
+        record_load_phase("checksum", phase_start)
+        
+        phase_start = time.time()
+        loaded_model = load_fast_artifact(model_checksum)
+        loader = None
+        if loaded_model is not None:
+            record_load_phase("artifact_load", phase_start)
+            load_phases["source"] = "artifact"
+            loader = "fast-load artifact"
 
         # Load model using multiple approaches
-        print(f"📂 Loading model: {MODEL_PATH}...")
         load_start = time.time()
-        loaded_model = None
         errors = []
 
         # Approach 1: Standard keras load_model (public)
-        try:
-            print(" Attempt 1: Standard keras load_model...")
-            loaded_model = keras_load_model(
-                MODEL_PATH,
-                custom_objects={'L1Dist': L1Dist},
-                compile=False
-            )
-            print(" ✅ Success with standard loader")
-        except Exception as e1:
-            errors.append(f"Standard loader: {str(e1)[:200]}")
+        if loaded_model is None:
+            try:
+                logger.info("Trying model loader", extra={"fields": {"loader": "standard", "attempt": 1}})
+                loaded_model = keras_load_model(
+                    MODEL_PATH,
+                    custom_objects={'L1Dist': L1Dist},
+                    compile=False
+                )
+                loader = "standard"
+            except Exception as e1:
+                errors.append(f"Standard loader: {str(e1)[:200]}")
 
         # Approach 2: HDF5 format loader (internal import)
         if loaded_model is None:
             try:
-                print(" Attempt 2: HDF5 format loader...")
+                logger.info("Trying model loader", extra={"fields": {"loader": "hdf5", "attempt": 2}})
                 from tensorflow.python.keras.saving import hdf5_format  # Internal for legacy
                 import h5py
                 with h5py.File(MODEL_PATH, 'r') as f:
@@ -196,14 +590,14 @@ def load_siamese_model():
                         custom_objects={'L1Dist': L1Dist},
                         compile=False
                     )
-                print(" ✅ Success with HDF5 loader")
+                loader = "hdf5"
             except Exception as e2:
                 errors.append(f"HDF5 loader: {str(e2)[:200]}")
 
         # Approach 3: Manual H5 with batch_shape patch (internal model_from_json)
         if loaded_model is None:
             try:
-                print(" Attempt 3: Manual H5 reconstruction with patching...")
+                logger.info("Trying model loader", extra={"fields": {"loader": "patched config", "attempt": 3}})
                 from tensorflow.python.keras.models import model_from_json  # Internal for legacy
                 from tensorflow.python.keras.saving import hdf5_format  # Internal
                 import h5py
@@ -227,7 +621,9 @@ def load_siamese_model():
                                     input_shape = batch_shape[1:]
                                     config['input_shape'] = tuple(input_shape)
                                     del config['batch_shape']
-                                    print(f" 🔧 Patched: {batch_shape} -> {config['input_shape']}")
+                                    logger.debug("Patched batch_shape", extra={"fields": {
+                                        "batch_shape": batch_shape, "input_shape": config['input_shape']
+                                    }})
                                     patched = True
                             for key, value in list(config.items()):
                                 if isinstance(value, (dict, list)):
@@ -240,10 +636,8 @@ def load_siamese_model():
                         return patched
 
                     patched_any = patch_config(model_config)
-                    if patched_any:
-                        print(" ✅ Config patched")
-                    else:
-                        print(" ⚠️ No batch_shape")
+                    if not patched_any:
+                        logger.info("No batch_shape to patch in the model config")
 
                     patched_config_json = json.dumps(model_config)
                     loaded_model = model_from_json(
@@ -254,40 +648,18 @@ def load_siamese_model():
                     if 'model_weights' not in f:
                         raise ValueError("No model_weights")
                     hdf5_format.load_weights_from_hdf5_group(f['model_weights'], loaded_model.layers)
-                print(" ✅ Success with manual reconstruction")
+                loader = "patched config"
             except Exception as e3:
                 errors.append(f"Manual reconstruction: {str(e3)[:200]}")
 
         # Approach 4: Manual recreation (public tf.keras, internal hdf5_format)
         if loaded_model is None:
             try:
-                print(" Attempt 4: Manual recreation from notebook...")
+                logger.info("Trying model loader", extra={"fields": {"loader": "manual recreation", "attempt": 4}})
                 from tensorflow.python.keras.saving import hdf5_format  # Internal for weights
                 import h5py
 
                 # Recreate exact (public tf.keras)
-                def make_embedding():
-                    inp = tf.keras.Input(shape=(100, 100, 3), name='input_image')
-                    c1 = tf.keras.layers.Conv2D(64, (10,10), activation='relu')(inp)
-                    m1 = tf.keras.layers.MaxPooling2D((2,2), padding='same')(c1)
-                    c2 = tf.keras.layers.Conv2D(128, (7,7), activation='relu')(m1)
-                    m2 = tf.keras.layers.MaxPooling2D((2,2), padding='same')(c2)
-                    c3 = tf.keras.layers.Conv2D(128, (4,4), activation='relu')(m2)
-                    m3 = tf.keras.layers.MaxPooling2D((2,2), padding='same')(c3)
-                    c4 = tf.keras.layers.Conv2D(256, (4,4), activation='relu')(m3)
-                    f1 = tf.keras.layers.Flatten()(c4)
-                    d1 = tf.keras.layers.Dense(4096, activation='sigmoid')(f1)
-                    return tf.keras.Model(inputs=inp, outputs=d1, name='embedding')
-
-                def make_siamese_model():
-                    input_image = tf.keras.Input(name='input_img', shape=(100,100,3))
-                    validation_image = tf.keras.Input(name='validation_img', shape=(100,100,3))
-                    embedding_model = make_embedding()
-                    siamese_layer = L1Dist(name='distance')
-                    distances = siamese_layer(embedding_model(input_image), embedding_model(validation_image))
-                    classifier = tf.keras.layers.Dense(1, activation='sigmoid')(distances)
-                    return tf.keras.Model(inputs=[input_image, validation_image], outputs=classifier, name='SiameseNetwork')
-
                 siamese_model = make_siamese_model()
 
                 # Load weights (internal hdf5_format)
@@ -297,7 +669,7 @@ def load_siamese_model():
                     hdf5_format.load_weights_from_hdf5_group(f['model_weights'], siamese_model.layers)
 
                 loaded_model = siamese_model
-                print(" ✅ Success with manual recreation")
+                loader = "manual recreation"
             except Exception as e4:
                 errors.append(f"Manual recreation: {str(e4)[:200]}")
 
@@ -306,22 +678,116 @@ def load_siamese_model():
             raise RuntimeError(error_msg)
 
         load_time = time.time() - load_start
-        print(f"✅ Model loaded in {load_time:.1f}s")
+        if load_phases.get("source") != "artifact":
+            record_load_phase("keras_load", load_start)
+            load_phases["source"] = "h5"
+            phase_start = time.time()
+            try:
+                export_fast_artifact(loaded_model, model_checksum)
+            except Exception as e:
+                logger.warning("Could not write fast-load artifact: %s", e)
+            record_load_phase("artifact_export", phase_start)
+        logger.info("Model loaded", extra={"fields": {
+            "loader": loader, "seconds": round(time.time() - load_start, 1), "failed_loaders": len(errors)
+        }})
+
+        # Fixed-signature compiled inference (replaces Keras model.predict)
+        compiled_model = CompiledInference(loaded_model, num_inputs=2)
 
         # Test
-        print("🧪 Testing model...")
+        phase_start = time.time()
         test_input = np.random.rand(1, 100, 100, 3).astype(np.float32)
-        test_pred = loaded_model.predict([test_input, test_input], verbose=0)
-        print(f"✅ Test passed! Output: {test_pred[0][0]:.6f}")
+        test_pred = compiled_model.predict([test_input, test_input], verbose=0)
+        record_load_phase("self_test", phase_start)
+        logger.info("Model self-test passed", extra={"fields": {"output": round(float(test_pred[0][0]), 6)}})
 
-        total_time = time.time() - load_start_time
-        print("=" * 60)
-        print(f"🎉 MODEL READY! ({total_time:.1f}s total)")
-        print("=" * 60)
+        # Split into embedding tower + NumPy distance head
+        split_embedding, split_kernel, split_bias, parity_error = None, None, None, None
+        phase_start = time.time()
+        try:
+            keras_embedding, split_kernel, split_bias = extract_siamese_components(loaded_model)
+            split_embedding = CompiledInference(keras_embedding, num_inputs=1)
+            parity_input = np.random.rand(4, 100, 100, 3).astype(np.float32)
+            parity_pred = compiled_model.predict(
+                [parity_input, parity_input[::-1]], verbose=0
+            ).reshape(-1)
+            parity_embeddings = split_embedding.predict_on_batch(parity_input)
+            parity_scores = head_scores(
+                parity_embeddings, parity_embeddings[::-1], split_kernel, split_bias
+            ).diagonal()
+            parity_error = float(np.max(np.abs(parity_scores - parity_pred)))
+            if parity_error > HEAD_PARITY_TOLERANCE:
+                raise ValueError(f"Head scores differ from model.predict by {parity_error:.2e}")
+            logger.info("Split model ready", extra={"fields": {"max_score_error": parity_error}})
+        except Exception as e:
+            split_embedding, split_kernel, split_bias = None, None, None
+            logger.warning("Split model unavailable, using full pair scoring: %s", e)
+        record_load_phase("split_model", phase_start)
+
+        # Optional reduced-precision embedding tower, gated on score parity
+        parity_report = None
+        if INFERENCE_BACKEND in QUANTIZED_BACKENDS:
+            phase_start = time.time()
+            try:
+                if split_embedding is None:
+                    raise RuntimeError("split model unavailable")
+                quantized_embedding = load_quantized_embedding(keras_embedding, model_checksum, INFERENCE_BACKEND)
+                parity_report = check_quantized_parity(split_embedding, quantized_embedding, split_kernel, split_bias)
+                if parity_report["passed"]:
+                    split_embedding = quantized_embedding
+                    compiled_model = SplitSiamese(quantized_embedding, split_kernel, split_bias)
+                    logger.info("Serving quantized embedding", extra={"fields": {
+                        "backend": INFERENCE_BACKEND,
+                        "max_score_error": parity_report["max_score_error"],
+                        "speedup": parity_report["speedup"]
+                    }})
+                else:
+                    logger.warning("Quantized embedding failed parity or is not faster, serving float32",
+                                   extra={"fields": {"backend": INFERENCE_BACKEND, "parity": parity_report}})
+            except Exception as e:
+                parity_report = {"passed": False, "error": str(e)}
+                logger.warning("Quantized embedding unavailable, serving float32: %s", e,
+                               extra={"fields": {"backend": INFERENCE_BACKEND}})
+            parity_report["backend"] = INFERENCE_BACKEND
+            record_load_phase("quantize", phase_start)
+        elif INFERENCE_BACKEND != "float32":
+            logger.warning("Unknown INFERENCE_BACKEND, serving float32",
+                           extra={"fields": {"backend": INFERENCE_BACKEND}})
+
+        # Warm up every batch bucket so no request pays tracing cost
+        warmup_start = time.time()
+        compiled_model.warmup()
+        if split_embedding is not None:
+            split_embedding.warmup()
+        record_load_phase("warmup", warmup_start)
+        logger.info("Warm-up done", extra={"fields": {
+            "buckets": list(INFERENCE_BUCKETS), "xla": INFERENCE_XLA,
+            "seconds": round(time.time() - warmup_start, 1)
+        }})
+
+        # Cached embeddings belong to the previous model (if any)
+        image_cache.clear()
+
+        served_backend = INFERENCE_BACKEND if parity_report and parity_report["passed"] else "float32"
+        space = embedding_space_key(model_checksum, served_backend)
+        if split_embedding is not None:
+            reembed_gallery(split_embedding, space)
 
         with model_lock:
-            model = loaded_model
+            model = compiled_model
+            embedding_model = split_embedding
+            head_kernel = split_kernel
+            head_bias = split_bias
+            head_parity_error = parity_error
+            quantized_parity = parity_report
+            embedding_space = space
             model_loading = False
+        # Entries loaded while re-embedding above
+        reembed_gallery()
+        record_load_phase("total", load_start_time)
+        logger.info("Model ready", extra={"fields": {
+            "seconds": load_phases["total"], "embedding_space": space, "load_phases": dict(load_phases)
+        }})
         return loaded_model
 
     except Exception as e:
@@ -329,11 +795,531 @@ def load_siamese_model():
             model_error = str(e)
             model_loading = False
         elapsed = time.time() - load_start_time if load_start_time else 0
-        print(f"❌ Failed after {elapsed:.1f}s: {e}")
-        traceback.print_exc()
+        logger.error("Model load failed after %.1fs: %s", elapsed, e, exc_info=True)
         raise
+
+# ================================
+# MODEL COMPONENTS
+# ================================
+HEAD_PARITY_TOLERANCE = 1e-4
+
+def extract_siamese_components(siamese_model):
+    """
+    Split a loaded Siamese model into its embedding tower and distance head
+    
+    Args:
+        siamese_model: Keras model built by make_siamese_model()
+        
+    Returns:
+        tuple: (embedding sub-model, head kernel (4096,), head bias scalar)
+    """
+    embedding = None
+    for layer in siamese_model.layers:
+        if isinstance(layer, tf.keras.Model) and layer.name == 'embedding':
+            embedding = layer
+    if embedding is None:
+        raise ValueError("No 'embedding' sub-model found")
+    
+    # The classifier is the Dense(1) layer applied after L1Dist
+    dense_layers = [
+        layer for layer in siamese_model.layers
+        if isinstance(layer, tf.keras.layers.Dense)
+    ]
+    if not dense_layers:
+        raise ValueError("No Dense head found")
+    kernel, bias = dense_layers[-1].get_weights()
+    if kernel.shape != (embedding.output_shape[-1], 1):
+        raise ValueError(f"Unexpected head kernel shape: {kernel.shape}")
+    
+    return embedding, kernel.reshape(-1).astype(np.float32), np.float32(bias.reshape(-1)[0])
+
+# ================================
+# COMPILED INFERENCE
+# ================================
+INFERENCE_BUCKETS = tuple(sorted(int(b) for b in os.getenv("INFERENCE_BUCKETS", "1,4,16,64").split(",")))
+INFERENCE_XLA = os.getenv("INFERENCE_XLA", "0") == "1"
+
+def bucket_chunk(buckets, remaining):
+    """
+    (rows to take, bucket to run them in)
+    
+    Full largest buckets while at least that many rows remain, then
+    the whole tail zero-padded up to the smallest bucket that holds it
+    (15 rows run as one 16-row call, not 4+4+4+1+1+1).
+    """
+    largest = buckets[-1]
+    if remaining >= largest:
+        return largest, largest
+    return remaining, next(b for b in buckets if b >= remaining)
+
+def pad_rows(array, rows):
+    """Zero-pad `array` along the batch axis up to `rows`"""
+    if len(array) == rows:
+        return array
+    return np.concatenate([array, np.zeros((rows - len(array),) + array.shape[1:], np.float32)])
+
+class CompiledInference:
+    """
+    Fixed-signature tf.function around a Keras model
+    
+    Calls go straight to a concrete function with a (None, 100, 100, 3)
+    signature instead of model.predict, which rebuilds its data adapter
+    and callbacks on every call. Inputs are zero-padded up to a small set
+    of batch buckets so XLA (INFERENCE_XLA=1) compiles a bounded number of
+    shapes, and every bucket is warmed up at load time.
+    """
+
+    def __init__(self, keras_model, num_inputs, buckets=INFERENCE_BUCKETS, jit_compile=INFERENCE_XLA):
+        self.num_inputs = num_inputs
+        self.buckets = buckets
+        spec = [tf.TensorSpec((None, 100, 100, 3), tf.float32)] * num_inputs
+
+        @tf.function(input_signature=spec, jit_compile=jit_compile)
+        def forward(*inputs):
+            return keras_model(list(inputs) if num_inputs > 1 else inputs[0], training=False)
+
+        self._forward = forward
+
+    def _next_chunk(self, remaining):
+        return bucket_chunk(self.buckets, remaining)
+
+    def predict_on_batch(self, inputs):
+        arrays = list(inputs) if self.num_inputs > 1 else [inputs]
+        arrays = [np.asarray(a, dtype=np.float32) for a in arrays]
+        total = len(arrays[0])
+        outputs = []
+        start = 0
+        while start < total:
+            size, bucket = self._next_chunk(total - start)
+            chunk = [pad_rows(a[start:start + size], bucket) for a in arrays]
+            outputs.append(self._forward(*chunk).numpy()[:size])
+            start += size
+        return np.concatenate(outputs)
+
+    def predict(self, inputs, verbose=0):
+        return self.predict_on_batch(inputs)
+
+    def warmup(self):
+        for bucket in self.buckets:
+            zeros = np.zeros((bucket, 100, 100, 3), dtype=np.float32)
+            self._forward(*([zeros] * self.num_inputs))
+
+# ================================
+# QUANTIZED INFERENCE
+# ================================
+# "float32" (default), "tflite-fp16" or "tflite-int8" (dynamic-range int8 weights)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "float32")
+QUANTIZED_BACKENDS = ("tflite-fp16", "tflite-int8")
+QUANTIZED_PARITY_TOLERANCE = float(os.getenv("QUANTIZED_PARITY_TOLERANCE", "0.01"))
+# The quantized tower is only served when it beats float32 by at least this factor
+QUANTIZED_MIN_SPEEDUP = float(os.getenv("QUANTIZED_MIN_SPEEDUP", "1.0"))
+QUANTIZED_TIMING_RUNS = 3
+DECISION_THRESHOLDS = (0.8, 0.9)
+
+# Result of the last quantized-vs-float32 parity check, reported on /health
+quantized_parity = None
+
+class SplitSiamese:
+    """Two-input Siamese scorer over an embedding tower + NumPy head (predict-compatible)"""
+
+    def __init__(self, embedding, kernel, bias):
+        self.embedding = embedding
+        self.head_kernel = kernel
+        self.head_bias = bias
+
+    def predict_on_batch(self, inputs):
+        first, second = inputs
+        distances = np.abs(self.embedding.predict_on_batch(first) - self.embedding.predict_on_batch(second))
+        logits = distances @ self.head_kernel + self.head_bias
+        return (1.0 / (1.0 + np.exp(-logits))).reshape(-1, 1)
+
+    def predict(self, inputs, verbose=0):
+        return self.predict_on_batch(inputs)
+
+    def warmup(self):
+        if hasattr(self.embedding, "warmup"):
+            self.embedding.warmup()
+
+def tflite_artifact_path(model_checksum, backend):
+    return os.path.join(MODEL_ARTIFACT_DIR, f"siamese_model.{model_checksum[:16]}.{backend}.tflite")
+
+def convert_embedding_tflite(keras_embedding, backend):
+    """
+    Post-training quantization of the embedding tower
+
+    Args:
+        keras_embedding: Keras embedding sub-model
+        backend: "tflite-fp16" (float16 weights) or "tflite-int8"
+            (int8 weights, float activations; no calibration set needed)
+
+    Returns:
+        bytes: serialized TFLite flatbuffer
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_embedding)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if backend == "tflite-fp16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif backend != "tflite-int8":
+        raise ValueError(f"Unknown quantized backend: {backend}")
+    return converter.convert()
+
+def load_quantized_embedding(keras_embedding, model_checksum, backend):
+    """Load the converted tower from disk, converting (and caching) on a miss"""
+    path = tflite_artifact_path(model_checksum, backend)
+    if os.path.exists(path):
+        logger.info("Loading quantized embedding", extra={"fields": {"path": path, "backend": backend}})
+        with open(path, 'rb') as f:
+            return TFLiteEmbedding(f.read())
+
+    logger.info("Converting embedding tower", extra={"fields": {"backend": backend}})
+    content = convert_embedding_tflite(keras_embedding, backend)
+    try:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        for name in os.listdir(MODEL_ARTIFACT_DIR):
+            stale = os.path.join(MODEL_ARTIFACT_DIR, name)
+            if name.startswith("siamese_model.") and name.endswith(f".{backend}.tflite") and stale != path:
+                os.remove(stale)
+        logger.info("Quantized embedding written", extra={"fields": {
+            "path": path, "size_mb": round(len(content) / (1024*1024), 1)
+        }})
+    except OSError as e:
+        logger.warning("Could not cache quantized embedding: %s", e)
+    return TFLiteEmbedding(content)
+
+class TFLiteEmbedding:
+    """
+    Embedding tower served by the TFLite interpreter
+
+    Interpreters are not thread-safe, so each one is checked out of a
+    per-bucket pool for the duration of a call (all sharing the read-only
+    flatbuffer). Like CompiledInference, inputs are zero-padded up to the
+    INFERENCE_BUCKETS batch sizes, and every pooled interpreter is sized and
+    allocated once for its bucket. warmup() fills each bucket with one
+    interpreter per inference thread, so requests on any executor thread
+    never pay resize_tensor_input + allocate_tensors; only concurrency
+    beyond that grows the pool.
+    """
+
+    def __init__(self, model_content, num_threads=TF_INTRA_OP_THREADS, buckets=INFERENCE_BUCKETS):
+        self.model_content = model_content
+        self.num_threads = num_threads
+        self.buckets = buckets
+        self.size_bytes = len(model_content)
+        self._pool = {bucket: [] for bucket in buckets}
+        self._pool_lock = Lock()
+        self.interpreters_created = 0
+
+    def _new_interpreter(self, bucket):
+        interpreter = tf.lite.Interpreter(model_content=self.model_content, num_threads=self.num_threads)
+        input_index = interpreter.get_input_details()[0]["index"]
+        output_index = interpreter.get_output_details()[0]["index"]
+        interpreter.resize_tensor_input(input_index, [bucket, IMAGE_SIZE, IMAGE_SIZE, 3])
+        interpreter.allocate_tensors()
+        with self._pool_lock:
+            self.interpreters_created += 1
+        return interpreter, input_index, output_index
+
+    def _acquire(self, bucket):
+        with self._pool_lock:
+            if self._pool[bucket]:
+                return self._pool[bucket].pop()
+        return self._new_interpreter(bucket)
+
+    def _release(self, bucket, entry):
+        with self._pool_lock:
+            self._pool[bucket].append(entry)
+
+    def predict_on_batch(self, images):
+        images = np.asarray(images, dtype=np.float32)
+        outputs = []
+        start = 0
+        while start < len(images):
+            size, bucket = bucket_chunk(self.buckets, len(images) - start)
+            entry = self._acquire(bucket)
+            try:
+                interpreter, input_index, output_index = entry
+                interpreter.set_tensor(input_index, np.ascontiguousarray(pad_rows(images[start:start + size], bucket)))
+                interpreter.invoke()
+                outputs.append(interpreter.get_tensor(output_index)[:size].copy())
+            finally:
+                self._release(bucket, entry)
+            start += size
+        return np.concatenate(outputs)
+
+    def warmup(self, copies=None):
+        """Pool `copies` (default INFERENCE_THREADS) ready interpreters per bucket and run each once"""
+        copies = max(1, int(copies or INFERENCE_THREADS))
+        for bucket in self.buckets:
+            entries = [self._acquire(bucket) for _ in range(copies)]
+            zeros = np.zeros((bucket, IMAGE_SIZE, IMAGE_SIZE, 3), dtype=np.float32)
+            try:
+                for interpreter, input_index, _ in entries:
+                    interpreter.set_tensor(input_index, zeros)
+                    interpreter.invoke()
+            finally:
+                for entry in entries:
+                    self._release(bucket, entry)
+
+def check_quantized_parity(float_embedding, quantized_embedding, kernel, bias, images=None,
+                           tolerance=QUANTIZED_PARITY_TOLERANCE, thresholds=DECISION_THRESHOLDS,
+                           min_speedup=QUANTIZED_MIN_SPEEDUP):
+    """
+    Compare quantized and float32 scores and latency on a held-out pair set
+
+    Every pair (including self-pairs) of the parity samples is scored by
+    both towers through the same NumPy head. Latency is the best of
+    QUANTIZED_TIMING_RUNS warm calls per tower; the check only passes when
+    the quantized tower is also at least `min_speedup` times faster.
+
+    Args:
+        float_embedding: float32 embedding tower (predict_on_batch)
+        quantized_embedding: quantized embedding tower (predict_on_batch)
+        kernel, bias: distance head weights
+        images: JPEG bytes (defaults to parity_sample_images())
+        tolerance: max allowed absolute score difference
+        thresholds: decision thresholds that must not flip
+        min_speedup: required float32 / quantized latency ratio
+
+    Returns:
+        dict: score drift, decision flips per threshold, latency and "passed"
+    """
+    images = images if images is not None else parity_sample_images()
+    batch = np.stack([preprocess_image(b) for b in images])
+
+    def timed(embedding):
+        embeddings = np.asarray(embedding.predict_on_batch(batch))
+        best = float("inf")
+        for _ in range(QUANTIZED_TIMING_RUNS):
+            started = time.time()
+            embedding.predict_on_batch(batch)
+            best = min(best, (time.time() - started) * 1000)
+        return embeddings, best
+
+    float_embeddings, float_ms = timed(float_embedding)
+    quantized_embeddings, quantized_ms = timed(quantized_embedding)
+    speedup = float_ms / max(quantized_ms, 1e-6)
+
+    pairs = np.triu_indices(len(batch))
+    float_scores = head_scores(float_embeddings, float_embeddings, kernel, bias)[pairs]
+    quantized_scores = head_scores(quantized_embeddings, quantized_embeddings, kernel, bias)[pairs]
+    score_error = np.abs(float_scores - quantized_scores)
+    flips = {
+        str(t): int(np.sum((float_scores >= t) != (quantized_scores >= t)))
+        for t in thresholds
+    }
+    return {
+        "pairs": int(len(float_scores)),
+        "max_score_error": float(score_error.max()),
+        "mean_score_error": float(score_error.mean()),
+        "decision_flips": flips,
+        "tolerance": tolerance,
+        "float32_batch_ms": round(float_ms, 1),
+        "quantized_batch_ms": round(quantized_ms, 1),
+        "speedup": round(speedup, 2),
+        "min_speedup": min_speedup,
+        "quantized_size_mb": round(getattr(quantized_embedding, "size_bytes", 0) / (1024*1024), 1),
+        "passed": bool(score_error.max() <= tolerance and not any(flips.values()) and speedup >= min_speedup)
+    }
+
+# ================================
+# SHARED WEIGHTS (PRE-FORK MODE)
+# ================================
+SHARED_WEIGHTS_PATH = os.getenv("SHARED_WEIGHTS_PATH", "siamese_weights.bin")
+SHARED_WEIGHTS_ATTACH = os.getenv("SHARED_WEIGHTS_ATTACH", "0") == "1"
+WEIGHT_ALIGNMENT = 64
+
+def export_shared_weights(siamese_model, path=SHARED_WEIGHTS_PATH, metadata=None):
+    """
+    Write the model weights into one flat, aligned, memory-mappable file
+    
+    Layout: float32 tensors at 64-byte aligned offsets in `path`, with a
+    JSON index (name -> offset, shape) in `path + ".json"`.
+    """
+    embedding, kernel, bias = extract_siamese_components(siamese_model)
+    conv_layers = [l for l in embedding.layers if isinstance(l, tf.keras.layers.Conv2D)]
+    dense_layers = [l for l in embedding.layers if isinstance(l, tf.keras.layers.Dense)]
+    if len(conv_layers) != 4 or len(dense_layers) != 1:
+        raise ValueError("Embedding does not match make_embedding() architecture")
+    
+    tensors = []
+    for i, layer in enumerate(conv_layers):
+        conv_kernel, conv_bias = layer.get_weights()
+        tensors.append((f"conv{i}/kernel", conv_kernel))
+        tensors.append((f"conv{i}/bias", conv_bias))
+    dense_kernel, dense_bias = dense_layers[0].get_weights()
+    tensors.append(("embedding/kernel", dense_kernel))
+    tensors.append(("embedding/bias", dense_bias))
+    tensors.append(("head/kernel", kernel))
+    tensors.append(("head/bias", np.array([bias], dtype=np.float32)))
+    
+    index = {"format": 1, "metadata": metadata or {}, "tensors": {}}
+    offset = 0
+    with open(path + ".tmp", "wb") as f:
+        for name, array in tensors:
+            array = np.ascontiguousarray(array, dtype=np.float32)
+            padding = (-offset) % WEIGHT_ALIGNMENT
+            f.write(b"\0" * padding)
+            offset += padding
+            index["tensors"][name] = {"offset": offset, "shape": list(array.shape)}
+            f.write(array.tobytes())
+            offset += array.nbytes
+    with open(path + ".json.tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(path + ".tmp", path)
+    os.replace(path + ".json.tmp", path + ".json")
+    logger.info("Shared weights exported", extra={"fields": {"path": path, "size_mb": round(offset / (1024*1024), 2)}})
+
+def read_flat_weights(path):
+    """
+    Map a flat weights file read-only
+    
+    Returns:
+        tuple: (dict of name -> float32 array view, metadata dict)
+    """
+    with open(path + ".json") as f:
+        index = json.load(f)
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    weights = {
+        name: np.ndarray(tuple(spec["shape"]), dtype=np.float32, buffer=buffer, offset=spec["offset"])
+        for name, spec in index["tensors"].items()
+    }
+    return weights, index.get("metadata", {})
+
+class SharedEmbeddingTower:
+    """
+    Embedding tower served from a read-only memory-mapped weights file
+    
+    The conv layers (a few MB) run in TensorFlow. The Dense(4096) layer,
+    which holds almost all of the weights, runs in NumPy directly on the
+    mapped pages, so every worker process shares one physical copy.
+    """
+
+    def __init__(self, weights):
+        self.conv_weights = [
+            (tf.constant(weights[f"conv{i}/kernel"]), tf.constant(weights[f"conv{i}/bias"]))
+            for i in range(4)
+        ]
+        self.dense_kernel = weights["embedding/kernel"]
+        self.dense_bias = weights["embedding/bias"]
+        self._conv_features = tf.function(
+            self._conv_forward,
+            input_signature=[tf.TensorSpec((None, 100, 100, 3), tf.float32)]
+        )
+
+    def _conv_forward(self, images):
+        x = images
+        for i, (kernel, bias) in enumerate(self.conv_weights):
+            x = tf.nn.relu(tf.nn.conv2d(x, kernel, strides=1, padding='VALID') + bias)
+            if i < len(self.conv_weights) - 1:
+                x = tf.nn.max_pool2d(x, ksize=2, strides=2, padding='SAME')
+        return tf.reshape(x, (tf.shape(x)[0], -1))
+
+    def predict_on_batch(self, images):
+        features = self._conv_features(tf.convert_to_tensor(images, dtype=tf.float32)).numpy()
+        logits = features @ self.dense_kernel + self.dense_bias
+        return (1.0 / (1.0 + np.exp(-logits))).astype(np.float32, copy=False)
+
+class SharedWeightsSiamese(SplitSiamese):
+    """Two-input Siamese scorer over a SharedEmbeddingTower (predict-compatible)"""
+
+    def __init__(self, path):
+        weights, self.metadata = read_flat_weights(path)
+        super().__init__(
+            SharedEmbeddingTower(weights),
+            weights["head/kernel"].reshape(-1),
+            np.float32(weights["head/bias"][0])
+        )
+
+def attach_shared_weights(path=SHARED_WEIGHTS_PATH):
+    """Attach to weights exported by the pre-fork parent (worker side)"""
+    global model, model_loading, model_error, load_start_time
+    global embedding_model, head_kernel, head_bias, embedding_space
+    with model_lock:
+        if model is not None:
+            return model
+        if model_loading:
+            return None
+        model_loading = True
+        load_start_time = time.time()
+
+    try:
+        logger.info("Attaching shared weights", extra={"fields": {"path": path}})
+        load_phases.clear()
+        load_phases["source"] = "shared_weights"
+        shared_model = SharedWeightsSiamese(path)
+        record_load_phase("attach", load_start_time)
+        
+        # Self-test also traces the conv tower before the first request
+        phase_start = time.time()
+        test_input = np.random.rand(1, 100, 100, 3).astype(np.float32)
+        test_pred = shared_model.predict([test_input, test_input], verbose=0)
+        record_load_phase("self_test", phase_start)
+        record_load_phase("total", load_start_time)
+        logger.info("Shared model ready", extra={"fields": {
+            "seconds": round(time.time() - load_start_time, 1), "output": round(float(test_pred[0][0]), 6)
+        }})
         
-# ... (keep all remaining code unchanged)
+        space = embedding_space_key(shared_model.metadata.get("source_sha256", "unknown"), "float32")
+        reembed_gallery(shared_model.embedding, space)
+        with model_lock:
+            model = shared_model
+            embedding_model = shared_model.embedding
+            head_kernel = shared_model.head_kernel
+            head_bias = shared_model.head_bias
+            embedding_space = space
+            model_loading = False
+        reembed_gallery()
+        return shared_model
+    
+    except Exception as e:
+        with model_lock:
+            model_error = str(e)
+            model_loading = False
+        logger.error("Failed to attach shared weights: %s", e, exc_info=True)
+        raise
+
+def prepare_shared_weights():
+    """Load the model once and export it for the workers (loader process)"""
+    siamese_model = load_siamese_model()
+    export_shared_weights(siamese_model, metadata={"source_sha256": embedding_space.split("/")[0]})
+
+def serve_prefork(workers, host, port):
+    """
+    Pre-fork serving: load the weights once, then start attached workers
+    
+    The full load cascade runs once, in a short-lived loader process, so
+    the supervisor itself never holds the Keras model. Workers only map
+    the exported file read-only and trace the small conv tower.
+    
+    Workers serve SharedWeightsSiamese: the conv tower as a plain
+    tf.function and the Dense layer in NumPy. CompiledInference batch
+    buckets, XLA (INFERENCE_XLA) and the quantized tower
+    (INFERENCE_BACKEND=tflite-*) are not used in this mode. Each worker
+    keeps its own in-memory gallery, rosters and ANN index. The files
+    under GALLERY_DIR are the shared state, and GALLERY_SYNC re-reads
+    them when another worker changes them.
+    """
+    logger.info("Pre-fork mode", extra={"fields": {"workers": workers, "host": host, "port": port}})
+    if INFERENCE_BACKEND != "float32" or INFERENCE_XLA:
+        logger.warning("Pre-fork workers serve float32 shared weights: INFERENCE_BACKEND and INFERENCE_XLA are ignored",
+                       extra={"fields": {"backend": INFERENCE_BACKEND, "xla": INFERENCE_XLA}})
+    
+    loader = multiprocessing.get_context("spawn").Process(target=prepare_shared_weights, name="weights-loader")
+    loader.start()
+    loader.join()
+    if loader.exitcode != 0:
+        raise RuntimeError(f"Weights loader failed (exit code {loader.exitcode})")
+    
+    os.environ["SHARED_WEIGHTS_ATTACH"] = "1"
+    os.environ["SHARED_WEIGHTS_PATH"] = os.path.abspath(SHARED_WEIGHTS_PATH)
+    os.environ.setdefault("GALLERY_SYNC", "1")
+    
+    import uvicorn
+    uvicorn.run("siamese_api:app", host=host, port=port, workers=workers, timeout_keep_alive=300)
+
 # ================================
 # BACKGROUND MODEL LOADER
 # ================================
@@ -346,8 +1332,10 @@ def trigger_model_load_background():
             return
         model_load_started = True
     
-    print("🔄 Starting background model load...")
-    thread = Thread(target=load_siamese_model, daemon=True)
+    logger.info("Starting background model load",
+                extra={"fields": {"source": "shared_weights" if SHARED_WEIGHTS_ATTACH else "model_file"}})
+    target = attach_shared_weights if SHARED_WEIGHTS_ATTACH else load_siamese_model
+    thread = Thread(target=target, daemon=True)
     thread.start()
 
 # ================================
@@ -356,27 +1344,48 @@ def trigger_model_load_background():
 @app.on_event("startup")
 async def startup_event():
     """Initialize on server startup"""
-    print("=" * 60)
-    print("🚀 FastAPI Starting")
-    print("=" * 60)
-    print(f"Python: {sys.version.split()[0]}")
-    print(f"TensorFlow: {tf.__version__}")
-    print(f"Keras: {keras_version}")
-    print(f"Working dir: {os.getcwd()}")
-    print(f"Model URL: {MODEL_URL}")
+    logger.info("Server starting", extra={"fields": {
+        "python": sys.version.split()[0],
+        "tensorflow": tf.__version__,
+        "keras": keras_version,
+        "working_dir": os.getcwd(),
+        "model_url": MODEL_URL
+    }})
     
     trigger_model_load_background()
     
-    print("✅ Server ready")
-    print("⏳ Model loading in background (check /health)")
-    print("=" * 60)
+    load_gallery()
+    load_rosters()
+    store = open_attendance_store()
+    
+    logger.info("Server ready; model loading in background (check /health)", extra={"fields": {
+        "enrolled_students": len(enrollment_gallery),
+        "gallery_dir": GALLERY_DIR,
+        "rosters": len(rosters),
+        "roster_dir": ROSTER_DIR,
+        "attendance_db": ATTENDANCE_DB if store is not None else None
+    }})
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """Flush queued attendance records before exiting"""
+    if attendance_store is not None:
+        attendance_store.close()
 
 # ================================
 # IMAGE PREPROCESSING
 # ================================
-def preprocess_image(image_bytes):
+IMAGE_SIZE = 100
+PREPROCESS_BACKEND = os.getenv("PREPROCESS_BACKEND", "tf").lower()  # "tf" or "pillow"
+PREPROCESS_PARITY_TOLERANCE = float(os.getenv("PREPROCESS_PARITY_TOLERANCE", "0.02"))
+# Single pixels differ more than the mean (chroma rounding at block edges)
+PREPROCESS_MAX_PIXEL_TOLERANCE = float(os.getenv("PREPROCESS_MAX_PIXEL_TOLERANCE", "0.15"))
+PARITY_IMAGE_DIR = os.getenv("PARITY_IMAGE_DIR", "input_images")
+PILLOW_DRAFT_FACTOR = int(os.getenv("PILLOW_DRAFT_FACTOR", "2"))  # decode to >= 2x target
+
+def preprocess_image_tf(image_bytes):
     """
-    Preprocess image to match training format
+    Preprocess image to match training format (TensorFlow decode + resize)
     
     Args:
         image_bytes: Raw JPEG bytes
@@ -409,21 +1418,1991 @@ def preprocess_image(image_bytes):
     except Exception as e:
         raise ValueError(f"Preprocessing failed: {e}")
 
-# ================================
-# API ENDPOINTS
-# ================================
-
-@app.get("/")
-def root():
-    """Root endpoint - health check"""
-    elapsed = None
-    if load_start_time:
-        elapsed = time.time() - load_start_time
+def resize_bilinear(pixels, size=IMAGE_SIZE):
+    """
+    Bilinear resize matching tf.image.resize (half-pixel centers, no antialias)
     
-    status = (
-        "ready" if model is not None else
-        "loading" if model_loading else
-        "not_started" if not model_load_started else
+    Args:
+        pixels: (h, w, 3) uint8 array
+        size: Output height and width
+        
+    Returns:
+        numpy array: (size, size, 3) float32 in [0, 255]
+    """
+    def axis_weights(length):
+        source = np.maximum((np.arange(size) + 0.5) * (length / size) - 0.5, 0)
+        low = np.minimum(np.floor(source).astype(np.intp), length - 1)
+        high = np.minimum(low + 1, length - 1)
+        return low, high, (source - low).astype(np.float32)
+    
+    y_low, y_high, y_frac = axis_weights(pixels.shape[0])
+    x_low, x_high, x_frac = axis_weights(pixels.shape[1])
+    x_frac = x_frac[None, :, None]
+    rows_low = pixels[y_low].astype(np.float32)
+    rows_high = pixels[y_high].astype(np.float32)
+    top = rows_low[:, x_low] * (1 - x_frac) + rows_low[:, x_high] * x_frac
+    bottom = rows_high[:, x_low] * (1 - x_frac) + rows_high[:, x_high] * x_frac
+    y_frac = y_frac[:, None, None]
+    return top * (1 - y_frac) + bottom * y_frac
+
+def preprocess_image_pillow(image_bytes, out=None):
+    """
+    Preprocess image with a reduced-size JPEG decode (Pillow draft mode)
+    
+    Large frames are decoded at a reduced DCT scale (1/2, 1/4 or 1/8) that
+    still covers PILLOW_DRAFT_FACTOR x the target size, so most of a
+    multi-megapixel frame is never decoded. The resize then matches
+    tf.image.resize, keeping scores close to the TensorFlow path.
+    
+    Args:
+        image_bytes: Raw JPEG bytes
+        out: Optional preallocated (100, 100, 3) float32 array to fill
+        
+    Returns:
+        numpy array: (100, 100, 3) normalized to [0, 1]
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            draft_size = IMAGE_SIZE * PILLOW_DRAFT_FACTOR
+            img.draft('RGB', (draft_size, draft_size))
+            pixels = np.asarray(img.convert('RGB'), dtype=np.uint8)
+        
+        if pixels.ndim != 3 or pixels.shape[2] != 3:
+            raise ValueError(f"Wrong shape: {pixels.shape}")
+        
+        if out is None:
+            out = np.empty((IMAGE_SIZE, IMAGE_SIZE, 3), dtype=np.float32)
+        np.multiply(resize_bilinear(pixels), np.float32(1.0 / 255.0), out=out)
+        return out
+    
+    except Exception as e:
+        raise ValueError(f"Preprocessing failed: {e}")
+
+PREPROCESS_BACKENDS = {
+    "tf": preprocess_image_tf,
+    "pillow": preprocess_image_pillow
+}
+if PREPROCESS_BACKEND not in PREPROCESS_BACKENDS:
+    raise RuntimeError(f"Unknown PREPROCESS_BACKEND: {PREPROCESS_BACKEND}")
+
+def preprocess_image(image_bytes):
+    """Preprocess one image with the configured backend"""
+    with observe_stage("preprocess"):
+        return PREPROCESS_BACKENDS[PREPROCESS_BACKEND](image_bytes)
+
+def preprocess_batch(images):
+    """
+    Preprocess many images into one preallocated float32 array
+    
+    Returns:
+        tuple: (array (n, 100, 100, 3), dict of failed index -> error)
+    """
+    batch = np.zeros((len(images), IMAGE_SIZE, IMAGE_SIZE, 3), dtype=np.float32)
+    errors = {}
+    for i, image_bytes in enumerate(images):
+        try:
+            with observe_stage("preprocess"):
+                if PREPROCESS_BACKEND == "pillow":
+                    preprocess_image_pillow(image_bytes, out=batch[i])
+                else:
+                    batch[i] = preprocess_image_tf(image_bytes)
+        except Exception as e:
+            errors[i] = e
+    return batch, errors
+
+def parity_sample_images(limit=16):
+    """
+    JPEG samples for parity checks
+    
+    Uses up to `limit` images from PARITY_IMAGE_DIR when present, otherwise
+    synthesizes phone-sized frames with texture and gradients.
+    """
+    samples = []
+    if os.path.isdir(PARITY_IMAGE_DIR):
+        for name in sorted(os.listdir(PARITY_IMAGE_DIR)):
+            if name.lower().endswith(('.jpg', '.jpeg')):
+                with open(os.path.join(PARITY_IMAGE_DIR, name), 'rb') as f:
+                    samples.append(f.read())
+                if len(samples) >= limit:
+                    break
+    if not samples:
+        rng = np.random.default_rng(0)
+        yy, xx = np.mgrid[0:480, 0:640]
+        for i in range(min(limit, 8)):
+            base = np.stack([xx * (i + 1) % 256, yy * (i + 2) % 256, (xx + yy) % 256], axis=-1)
+            noise = rng.integers(0, 48, size=base.shape)
+            pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+            samples.append(tf.io.encode_jpeg(pixels, quality=90).numpy())
+    return samples
+
+def check_preprocess_parity(images=None, tolerance=PREPROCESS_PARITY_TOLERANCE,
+                            max_pixel_tolerance=PREPROCESS_MAX_PIXEL_TOLERANCE):
+    """
+    Compare the Pillow backend against the TensorFlow path
+    
+    Reports pixel differences and, when the model is loaded, the drift in
+    similarity scores for consecutive image pairs. "passed" requires the
+    mean pixel error and the score drift within `tolerance` and every
+    pixel within `max_pixel_tolerance`; without a model only the pixel
+    checks apply.
+    """
+    images = images if images is not None else parity_sample_images()
+    tf_batch = np.stack([preprocess_image_tf(b) for b in images])
+    pillow_batch = np.stack([preprocess_image_pillow(b) for b in images])
+    pixel_error = np.abs(tf_batch - pillow_batch)
+    
+    result = {
+        "images": len(images),
+        "mean_pixel_error": float(pixel_error.mean()),
+        "max_pixel_error": float(pixel_error.max()),
+        "tolerance": tolerance,
+        "max_pixel_tolerance": max_pixel_tolerance,
+        "max_score_drift": None
+    }
+    passed = result["mean_pixel_error"] <= tolerance and result["max_pixel_error"] <= max_pixel_tolerance
+    if model is not None and len(images) >= 2:
+        tf_scores = score_pairs(tf_batch[:-1], tf_batch[1:])
+        pillow_scores = score_pairs(pillow_batch[:-1], pillow_batch[1:])
+        result["max_score_drift"] = float(np.max(np.abs(tf_scores - pillow_scores)))
+        passed = passed and result["max_score_drift"] <= tolerance
+    result["passed"] = bool(passed)
+    return result
+
+# ================================
+# IMAGE CACHE
+# ================================
+IMAGE_CACHE_MAX_MB = float(os.getenv("IMAGE_CACHE_MAX_MB", "256"))
+
+class ImageCache:
+    """
+    Content-addressed LRU cache of preprocessed images and embeddings
+    
+    Entries are keyed by the SHA-256 of the raw image bytes, so repeat
+    uploads of the same reference skip JPEG decode, resize and (once
+    embedded) the conv tower. Eviction is least-recently-used, bounded by
+    the total bytes of the cached arrays.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self._entries = OrderedDict()  # key -> [image_array, embedding]
+        self._lock = Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.embedding_hits = 0
+        self.embedding_misses = 0
+
+    @staticmethod
+    def key_for(image_bytes):
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    @staticmethod
+    def _nbytes(entry):
+        return sum(a.nbytes for a in entry if a is not None)
+
+    def _store(self, key, slot, value):
+        if self.max_bytes <= 0:
+            return
+        value = np.array(value, dtype=np.float32)
+        value.setflags(write=False)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = [None, None]
+                self._entries[key] = entry
+            else:
+                self.current_bytes -= self._nbytes(entry)
+            entry[slot] = value
+            self.current_bytes += self._nbytes(entry)
+            self._entries.move_to_end(key)
+            while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= self._nbytes(evicted)
+                self.evictions += 1
+
+    def _lookup(self, key, slot):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[slot] is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[slot]
+
+    def get_image(self, key):
+        value = self._lookup(key, 0)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put_image(self, key, image_array):
+        self._store(key, 0, image_array)
+
+    def get_embedding(self, key):
+        value = self._lookup(key, 1)
+        with self._lock:
+            if value is None:
+                self.embedding_misses += 1
+            else:
+                self.embedding_hits += 1
+        return value
+
+    def put_embedding(self, key, embedding):
+        self._store(key, 1, embedding)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_mb": round(self.current_bytes / (1024*1024), 2),
+                "max_size_mb": round(self.max_bytes / (1024*1024), 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "embedding_hits": self.embedding_hits,
+                "embedding_misses": self.embedding_misses
+            }
+
+image_cache = ImageCache(IMAGE_CACHE_MAX_MB * 1024 * 1024)
+
+def cached_preprocess(image_bytes):
+    """
+    Preprocess an image through the content-addressed cache
+    
+    Returns:
+        tuple: (cache key, (100, 100, 3) preprocessed array)
+    """
+    key = ImageCache.key_for(image_bytes)
+    img_array = image_cache.get_image(key)
+    if img_array is None:
+        img_array = preprocess_image(image_bytes)
+        image_cache.put_image(key, img_array)
+    return key, img_array
+
+def preprocess_uploads(images, label, log_every=1):
+    """
+    Preprocess a list of raw uploads, skipping the ones that fail
+    
+    Args:
+        images: List of raw image bytes
+        label: Name used in log lines ("Anchor", "Negative", ...)
+        log_every: Log every n-th successful image
+        
+    Returns:
+        tuple: (list of preprocessed arrays, list of cache keys)
+    """
+    all_keys = [ImageCache.key_for(img_bytes) for img_bytes in images]
+    all_arrays = [image_cache.get_image(key) for key in all_keys]
+    
+    # Decode every cache miss into one preallocated batch
+    errors = {}
+    missing = [i for i, img_array in enumerate(all_arrays) if img_array is None]
+    if missing:
+        batch, batch_errors = preprocess_batch([images[i] for i in missing])
+        for j, i in enumerate(missing):
+            if j in batch_errors:
+                errors[i] = batch_errors[j]
+            else:
+                all_arrays[i] = batch[j]
+                image_cache.put_image(all_keys[i], batch[j])
+    
+    arrays = []
+    keys = []
+    for i in range(len(images)):
+        if i in errors:
+            logger.warning("%s %s failed: %s", label, i+1, errors[i])
+            continue
+        arrays.append(all_arrays[i])
+        keys.append(all_keys[i])
+        if (i + 1) % log_every == 0:
+            logger.debug("%s %s/%s decoded", label, i+1, len(images))
+    return arrays, keys
+
+# ================================
+# BATCHED SCORING
+# ================================
+PAIR_BATCH_SIZE = int(os.getenv("PAIR_BATCH_SIZE", "64"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+HEAD_CHUNK_ELEMENTS = 1 << 22  # Bound |a-b| temporaries to ~16MB of float32
+
+def embed_images(image_arrays, batch_size=EMBED_BATCH_SIZE, embedder=None):
+    """
+    Run the embedding tower exactly once per image
+    
+    Args:
+        image_arrays: List (or array) of preprocessed (100, 100, 3) images
+        batch_size: Maximum number of images per forward pass
+        embedder: tower to use (default the served embedding_model)
+        
+    Returns:
+        numpy array: (num_images, embedding_dim) float32 embeddings
+    """
+    images = np.asarray(np.stack(image_arrays), dtype=np.float32)
+    batch_size = max(1, int(batch_size))
+    embedder = embedder or embedding_model
+    with observe_stage("inference"):
+        embeddings = [
+            np.asarray(embedder.predict_on_batch(images[start:start + batch_size]))
+            for start in range(0, len(images), batch_size)
+        ]
+    return np.concatenate(embeddings).astype(np.float32, copy=False)
+
+def embed_with_cache(image_arrays, keys=None):
+    """
+    Embed images, reusing cached embeddings for known image keys
+    
+    Only the cache misses go through the tower, in one batched call.
+    """
+    if keys is None:
+        return embed_images(image_arrays)
+    
+    embeddings = [image_cache.get_embedding(key) for key in keys]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        computed = embed_images([image_arrays[i] for i in missing])
+        for i, embedding in zip(missing, computed):
+            image_cache.put_embedding(keys[i], embedding)
+            embeddings[i] = embedding
+    return np.stack(embeddings).astype(np.float32, copy=False)
+
+def head_scores(anchor_embeddings, reference_embeddings, kernel, bias):
+    """
+    Apply the L1Dist + Dense(1) head to every anchor x reference pair
+    
+    Computes sigmoid(w . |a - b| + bias) as one broadcast, chunked over
+    anchors (and references, for large galleries) so the |a - b|
+    temporary stays bounded.
+    
+    Returns:
+        numpy array: (num_anchors, num_references) similarity scores
+    """
+    anchor_embeddings = np.asarray(anchor_embeddings, dtype=np.float32)
+    reference_embeddings = np.asarray(reference_embeddings, dtype=np.float32)
+    num_references, dim = reference_embeddings.shape
+    cols_per_chunk = max(1, min(num_references, HEAD_CHUNK_ELEMENTS // max(1, dim)))
+    rows_per_chunk = max(1, HEAD_CHUNK_ELEMENTS // max(1, cols_per_chunk * dim))
+    
+    logits = np.empty((len(anchor_embeddings), num_references), dtype=np.float32)
+    for start in range(0, len(anchor_embeddings), rows_per_chunk):
+        chunk = anchor_embeddings[start:start + rows_per_chunk]
+        for col in range(0, num_references, cols_per_chunk):
+            references = reference_embeddings[col:col + cols_per_chunk]
+            distances = np.abs(chunk[:, None, :] - references[None, :, :])
+            logits[start:start + len(chunk), col:col + len(references)] = distances @ kernel + bias
+    
+    return 1.0 / (1.0 + np.exp(-logits))
+
+def score_embeddings(anchor_embeddings, reference_embeddings):
+    """Score embeddings with the loaded model's distance head"""
+    with observe_stage("scoring"):
+        return head_scores(anchor_embeddings, reference_embeddings, head_kernel, head_bias)
+
+
+def score_pair_grid(anchor_arrays, negative_arrays, batch_size=PAIR_BATCH_SIZE):
+    """
+    Score every anchor against every negative in batched forward passes
+    
+    The full anchor x negative pair grid is scored in chunks of at most
+    `batch_size` pairs, so memory stays bounded while avoiding one
+    model call per pair.
+    
+    Args:
+        anchor_arrays: List of preprocessed (100, 100, 3) anchor images
+        negative_arrays: List of preprocessed (100, 100, 3) reference images
+        batch_size: Maximum number of pairs per forward pass
+        
+    Returns:
+        numpy array: (num_anchors, num_negatives) similarity scores
+    """
+    anchors = np.stack(anchor_arrays).astype(np.float32)
+    negatives = np.stack(negative_arrays).astype(np.float32)
+    num_anchors, num_negatives = len(anchors), len(negatives)
+    total_pairs = num_anchors * num_negatives
+    batch_size = max(1, int(batch_size))
+    
+    scores = np.empty(total_pairs, dtype=np.float32)
+    for start in range(0, total_pairs, batch_size):
+        pair_index = np.arange(start, min(start + batch_size, total_pairs))
+        anchor_batch = anchors[pair_index // num_negatives]
+        negative_batch = negatives[pair_index % num_negatives]
+        with observe_stage("inference"):
+            prediction = model.predict_on_batch([anchor_batch, negative_batch])
+        scores[start:start + len(pair_index)] = np.asarray(prediction).reshape(-1)
+    
+    return scores.reshape(num_anchors, num_negatives)
+
+def score_anchor_grid(anchor_arrays, negative_arrays, anchor_keys=None, negative_keys=None):
+    """
+    Score every anchor against every negative
+    
+    Uses the split model when available (N + M tower passes plus a NumPy
+    head), otherwise falls back to scoring the full pair grid. When image
+    cache keys are given, cached embeddings are reused.
+    
+    Returns:
+        numpy array: (num_anchors, num_negatives) similarity scores
+    """
+    if embedding_model is None:
+        return score_pair_grid(anchor_arrays, negative_arrays)
+    
+    keys = None
+    if anchor_keys is not None and negative_keys is not None:
+        keys = list(anchor_keys) + list(negative_keys)
+    embeddings = embed_with_cache(list(anchor_arrays) + list(negative_arrays), keys)
+    num_anchors = len(anchor_arrays)
+    return score_embeddings(embeddings[:num_anchors], embeddings[num_anchors:])
+
+def score_pairs(first_arrays, second_arrays, first_keys=None, second_keys=None):
+    """
+    Score aligned pairs (first[i] vs second[i]) in one batched pass
+    
+    Returns:
+        numpy array: (num_pairs,) similarity scores
+    """
+    num_pairs = len(first_arrays)
+    if embedding_model is None:
+        with observe_stage("inference"):
+            prediction = model.predict_on_batch([
+                np.stack(first_arrays).astype(np.float32),
+                np.stack(second_arrays).astype(np.float32)
+            ])
+        return np.asarray(prediction).reshape(-1)
+    
+    keys = None
+    if first_keys is not None and second_keys is not None:
+        keys = list(first_keys) + list(second_keys)
+    embeddings = embed_with_cache(list(first_arrays) + list(second_arrays), keys)
+    with observe_stage("scoring"):
+        distances = np.abs(embeddings[:num_pairs] - embeddings[num_pairs:])
+        return 1.0 / (1.0 + np.exp(-(distances @ head_kernel + head_bias)))
+
+# Strict verification thresholds
+PRIMARY_THRESHOLD = 0.90    # Much higher threshold
+SECONDARY_THRESHOLD = 0.85  # For consistency check
+MIN_MATCH_RATIO = 0.3       # At least 30% of comparisons should be decent
+MIN_PASSED_CHECKS = 5       # Checks (out of 6) needed to verify
+
+def build_verification_result(score_matrix):
+    """
+    Apply the strict verification logic to an anchor x negative score grid
+    
+    Args:
+        score_matrix: numpy array (num_anchors, num_negatives) of scores
+        
+    Returns:
+        dict: verification decision and detailed metrics
+    """
+    decision_start = time.perf_counter()
+    
+    # === CALCULATE METRICS ===
+    if score_matrix.size == 0:
+        raise HTTPException(status_code=500, detail="No predictions generated")
+    
+    num_anchors, num_negatives = score_matrix.shape
+    total_comparisons = int(score_matrix.size)
+    all_scores_array = score_matrix.reshape(-1).astype(np.float64)
+    per_anchor_max_array = score_matrix.max(axis=1).astype(np.float64)
+    
+    max_similarity = float(np.max(all_scores_array))
+    avg_similarity = float(np.mean(all_scores_array))
+    min_similarity = float(np.min(all_scores_array))
+    std_similarity = float(np.std(all_scores_array))
+    
+    # === STRICT VERIFICATION LOGIC ===
+    
+    # 1. Count matches above thresholds
+    matches_above_primary = int(np.sum(all_scores_array >= PRIMARY_THRESHOLD))
+    matches_above_secondary = int(np.sum(all_scores_array >= SECONDARY_THRESHOLD))
+    
+    # 2. Check if MULTIPLE anchors match consistently (not just one outlier)
+    anchors_with_good_match = int(np.sum(per_anchor_max_array >= PRIMARY_THRESHOLD))
+    
+    # 3. Calculate match ratio (what % of comparisons are decent?)
+    match_ratio = matches_above_secondary / total_comparisons
+    
+    # 4. Statistical outlier detection: Is max score an outlier?
+    # If max score is more than 3 std deviations above mean, it's suspicious
+    z_score = (max_similarity - avg_similarity) / (std_similarity + 1e-10)
+    is_outlier = z_score > 3.0
+    
+    # 5. Distribution check: Good matches should be clustered, not isolated
+    top_5_percent_threshold = float(np.percentile(all_scores_array, 95))
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Strict analysis", extra={"fields": {
+            "max_similarity": max_similarity,
+            "avg_similarity": avg_similarity,
+            "std_similarity": std_similarity,
+            "matches_above_primary": matches_above_primary,
+            "matches_above_secondary": matches_above_secondary,
+            "total_comparisons": total_comparisons,
+            "anchors_with_good_match": anchors_with_good_match,
+            "num_anchors": num_anchors,
+            "match_ratio": match_ratio,
+            "z_score": z_score,
+            "is_outlier": is_outlier,
+            "percentile_95": top_5_percent_threshold
+        }})
+    
+    # === VERIFICATION DECISION (STRICT) ===
+    verification_checks = {
+        "max_score_check": max_similarity >= PRIMARY_THRESHOLD,
+        "multiple_matches_check": matches_above_primary >= 2,  # At least 2 strong matches
+        "consistency_check": anchors_with_good_match >= max(1, num_anchors // 2),  # At least half anchors match
+        "ratio_check": match_ratio >= MIN_MATCH_RATIO,
+        "not_outlier_check": not is_outlier,
+        "distribution_check": top_5_percent_threshold >= SECONDARY_THRESHOLD
+    }
+    
+    # ALL checks must pass for verification
+    # verified = all(verification_checks.values())
+    
+    # Alternative: Require at least 5 out of 6 checks (more lenient)
+    verified = sum(verification_checks.values()) >= MIN_PASSED_CHECKS
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Verification checks", extra={"fields": {
+            "checks": verification_checks, "verified": verified
+        }})
+    
+    # Determine confidence level
+    if max_similarity >= 0.95 and verified:
+        confidence = "very_high"
+    elif max_similarity >= 0.90 and verified:
+        confidence = "high"
+    elif max_similarity >= 0.85:
+        confidence = "medium"
+    else:
+        confidence = "low"
+    
+    # Detailed reason for rejection
+    rejection_reasons = []
+    if not verified:
+        if not verification_checks["max_score_check"]:
+            rejection_reasons.append(f"Max score too low ({max_similarity:.4f} < {PRIMARY_THRESHOLD})")
+        if not verification_checks["multiple_matches_check"]:
+            rejection_reasons.append(f"Too few strong matches ({matches_above_primary} < 2)")
+        if not verification_checks["consistency_check"]:
+            rejection_reasons.append(f"Inconsistent anchor matches ({anchors_with_good_match}/{num_anchors})")
+        if not verification_checks["ratio_check"]:
+            rejection_reasons.append(f"Low overall match ratio ({match_ratio:.1%} < {MIN_MATCH_RATIO:.0%})")
+        if not verification_checks["not_outlier_check"]:
+            rejection_reasons.append(f"Max score is outlier (z-score: {z_score:.2f})")
+        if not verification_checks["distribution_check"]:
+            rejection_reasons.append(f"Poor score distribution (95th percentile: {top_5_percent_threshold:.4f})")
+    
+    result = {
+        "verified": verified,
+        "confidence": max_similarity,
+        "max_similarity": max_similarity,
+        "avg_similarity": avg_similarity,
+        "min_similarity": min_similarity,
+        "std_similarity": std_similarity,
+        "z_score": float(z_score),
+        "is_outlier": bool(is_outlier),
+        "match_count_primary": matches_above_primary,
+        "match_count_secondary": matches_above_secondary,
+        "match_ratio": match_ratio,
+        "anchors_with_good_match": anchors_with_good_match,
+        "total_comparisons": total_comparisons,
+        "primary_threshold": PRIMARY_THRESHOLD,
+        "secondary_threshold": SECONDARY_THRESHOLD,
+        "confidence_level": confidence,
+        "anchors_processed": num_anchors,
+        "negatives_processed": num_negatives,
+        "verification_checks": verification_checks,
+        "rejection_reasons": rejection_reasons,
+        "message": f"{'Verification successful' if verified else 'Verification failed: ' + '; '.join(rejection_reasons)}",
+        "all_scores_summary": {
+            "percentile_95": float(np.percentile(all_scores_array, 95)),
+            "percentile_75": float(np.percentile(all_scores_array, 75)),
+            "percentile_50": float(np.percentile(all_scores_array, 50)),
+            "percentile_25": float(np.percentile(all_scores_array, 25))
+        },
+        "per_anchor_max_scores": [float(s) for s in per_anchor_max_array]
+    }
+
+    record_stage("decision", time.perf_counter() - decision_start)
+    return result
+
+# ================================
+# SEQUENTIAL VERIFICATION
+# ================================
+EARLY_EXIT_CHUNK = int(os.getenv("EARLY_EXIT_CHUNK", "4"))
+
+class SequentialVerifier:
+    """
+    Incremental form of the strict verification decision
+    
+    Reference columns of the anchor x reference grid are added as they are
+    scored. For every check the verifier tracks whether it passes or fails
+    for *any* values the unscored comparisons could still take (scores lie
+    in [0, 1]), so the verdict is known as soon as MIN_PASSED_CHECKS checks
+    certainly pass or enough certainly fail. The z-score outlier check
+    depends on every score and is only decided once the grid is complete.
+    
+    build_verification_result() on the scored columns agrees with the
+    certain verdict: each certainly-decided check has the same outcome on
+    the partial grid.
+    """
+
+    def __init__(self, num_anchors, num_references):
+        self.num_anchors = num_anchors
+        self.num_references = num_references
+        self.total = num_anchors * num_references
+        self.columns = []
+        self.reference_indices = []
+        self.primary_count = 0
+        self.secondary_count = 0
+        self.anchor_max = np.zeros(num_anchors, dtype=np.float64)
+
+    @property
+    def scored(self):
+        return self.num_anchors * len(self.reference_indices)
+
+    @property
+    def complete(self):
+        return self.scored >= self.total
+
+    def add(self, scores, reference_indices=None):
+        """
+        Add scores for newly compared references
+        
+        Args:
+            scores: (num_anchors, k) similarity scores
+            reference_indices: the k reference indices (default: next k)
+        """
+        scores = np.asarray(scores, dtype=np.float64).reshape(self.num_anchors, -1)
+        if reference_indices is None:
+            start = len(self.reference_indices)
+            reference_indices = range(start, start + scores.shape[1])
+        self.columns.append(scores)
+        self.reference_indices.extend(int(i) for i in reference_indices)
+        self.primary_count += int(np.sum(scores >= PRIMARY_THRESHOLD))
+        self.secondary_count += int(np.sum(scores >= SECONDARY_THRESHOLD))
+        self.anchor_max = np.maximum(self.anchor_max, scores.max(axis=1))
+
+    def score_matrix(self):
+        """Scores so far, columns in the order references were added"""
+        if not self.columns:
+            return np.empty((self.num_anchors, 0))
+        return np.concatenate(self.columns, axis=1)
+
+    def check_bounds(self):
+        """
+        Returns:
+            dict: check name -> True (certain pass), False (certain fail)
+            or None (still depends on unscored comparisons)
+        """
+        unscored = self.total - self.scored
+        good_anchors = int(np.sum(self.anchor_max >= PRIMARY_THRESHOLD))
+        possible_anchors = self.possible_anchors(good_anchors, unscored)
+        needed_anchors = max(1, self.num_anchors // 2)
+        needed_ratio = MIN_MATCH_RATIO * self.total
+        
+        # 95th percentile (linear interpolation) is >= SECONDARY_THRESHOLD for
+        # sure once enough values are above it, and < for sure once too few can be
+        position = 0.95 * (self.total - 1)
+        needed_low, needed_high = self.total - int(np.floor(position)), self.total - int(np.ceil(position))
+        
+        def bound(certain_pass, certain_fail):
+            return True if certain_pass else False if certain_fail else None
+        
+        checks = {
+            "max_score_check": bound(good_anchors > 0, unscored == 0),
+            "multiple_matches_check": bound(self.primary_count >= 2, self.primary_count + unscored < 2),
+            "consistency_check": bound(good_anchors >= needed_anchors, possible_anchors < needed_anchors),
+            "ratio_check": bound(self.secondary_count >= needed_ratio, self.secondary_count + unscored < needed_ratio),
+            "not_outlier_check": None,
+            "distribution_check": bound(
+                self.secondary_count >= needed_low, self.secondary_count + unscored < needed_high
+            )
+        }
+        if unscored == 0 and self.total > 0:
+            scores = self.score_matrix().reshape(-1)
+            z_score = (scores.max() - scores.mean()) / (scores.std() + 1e-10)
+            checks["not_outlier_check"] = bool(z_score <= 3.0)
+            checks["distribution_check"] = bool(np.percentile(scores, 95) >= SECONDARY_THRESHOLD)
+        return checks
+
+    def possible_anchors(self, good_anchors, unscored):
+        """Most anchors that could still reach PRIMARY_THRESHOLD"""
+        return self.num_anchors if unscored else good_anchors
+
+    def verdict(self):
+        """True / False once the decision is certain, otherwise None"""
+        checks = self.check_bounds().values()
+        if sum(c is True for c in checks) >= MIN_PASSED_CHECKS:
+            return True
+        if sum(c is False for c in checks) > len(checks) - MIN_PASSED_CHECKS:
+            return False
+        return None
+
+    def report(self):
+        return {
+            "comparisons_spent": self.scored,
+            "comparisons_total": self.total,
+            "references_scored": len(self.reference_indices),
+            "stopped_early": not self.complete,
+            "decided_checks": {
+                name: "pass" if c is True else "fail" if c is False else "undecided"
+                for name, c in self.check_bounds().items()
+            }
+        }
+
+def sequential_verify(anchor_arrays, reference_arrays, anchor_keys=None, reference_keys=None,
+                      chunk_size=EARLY_EXIT_CHUNK):
+    """
+    Score references in descending sharpness order until the verdict is fixed
+    
+    Anchors are embedded once; references are embedded and scored
+    `chunk_size` at a time, so an early exit also skips their tower passes.
+    
+    Returns:
+        SequentialVerifier: with the scored columns and early-exit report
+    """
+    order = np.argsort(-image_sharpness(np.stack(reference_arrays)), kind="stable")
+    verifier = SequentialVerifier(len(anchor_arrays), len(reference_arrays))
+    chunk_size = max(1, int(chunk_size))
+    if embedding_model is not None:
+        anchor_embeddings = embed_with_cache(anchor_arrays, anchor_keys)
+    
+    for start in range(0, len(order), chunk_size):
+        indices = order[start:start + chunk_size]
+        chunk_arrays = [reference_arrays[i] for i in indices]
+        if embedding_model is not None:
+            chunk_keys = [reference_keys[i] for i in indices] if reference_keys is not None else None
+            scores = score_embeddings(anchor_embeddings, embed_with_cache(chunk_arrays, chunk_keys))
+        else:
+            scores = score_pair_grid(anchor_arrays, chunk_arrays)
+        verifier.add(scores, indices)
+        if verifier.verdict() is not None:
+            break
+    
+    report = verifier.report()
+    logger.debug("Early exit: %s/%s comparisons (%s/%s references)", report['comparisons_spent'],
+                 report['comparisons_total'], report['references_scored'], len(reference_arrays))
+    return verifier
+
+class FrameStreamVerifier(SequentialVerifier):
+    """
+    Row-wise SequentialVerifier: anchor frames arrive one at a time
+    
+    Each frame is scored against every reference, so a frame's row is
+    complete once added; only frames not yet received are unknown (and
+    each of those could still become a good anchor).
+    """
+
+    def __init__(self, num_frames, num_references):
+        super().__init__(num_frames, num_references)
+        self.frames_scored = 0
+
+    @property
+    def scored(self):
+        return self.frames_scored * self.num_references
+
+    def add_frame(self, scores):
+        """Add one frame's (num_references,) scores"""
+        scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+        self.columns.append(scores[None, :])
+        self.primary_count += int(np.sum(scores >= PRIMARY_THRESHOLD))
+        self.secondary_count += int(np.sum(scores >= SECONDARY_THRESHOLD))
+        self.anchor_max[self.frames_scored] = scores.max()
+        self.frames_scored += 1
+
+    def score_matrix(self):
+        """(frames_scored, num_references) scores so far"""
+        if not self.columns:
+            return np.empty((0, self.num_references))
+        return np.concatenate(self.columns, axis=0)
+
+    def possible_anchors(self, good_anchors, unscored):
+        return good_anchors + (self.num_anchors - self.frames_scored)
+
+    def report(self):
+        report = super().report()
+        del report["references_scored"]
+        report["frames_scored"] = self.frames_scored
+        report["frames_expected"] = self.num_anchors
+        return report
+
+# ================================
+# ADMISSION CONTROL
+# ================================
+# Class used when a request doesn't send X-Request-Class (first matching path prefix)
+ROUTE_REQUEST_CLASSES = (
+    ("/test", "background"),
+    ("/sessions/", "bulk"),
+    ("/attendance/import", "bulk"),
+    ("/enroll/", "bulk"),
+)
+MAX_DEADLINE_MS = float(os.getenv("MAX_DEADLINE_MS", "120000"))
+SERVICE_TIME_SMOOTHING = float(os.getenv("SERVICE_TIME_SMOOTHING", "0.2"))
+SESSION_PATH_PATTERN = re.compile(r"^/sessions/([^/]+)/")
+
+def parse_admission(scope):
+    """
+    Admission for an ASGI scope from its headers
+    
+    X-Request-Class picks one of REQUEST_CLASSES (default by route),
+    X-Session-ID the queue within the class (default the session in a
+    /sessions/{id}/ path, else the client address, so each lecture-hall
+    device gets its own queue) and X-Deadline-Ms the time budget from now.
+    Malformed values fall back to the defaults rather than failing the
+    request.
+    
+    Returns:
+        Admission
+    """
+    headers = {}
+    for name, value in scope.get("headers", []):
+        if name in (b"x-request-class", b"x-session-id", b"x-deadline-ms"):
+            headers[name] = value.decode("latin-1").strip()
+    path = scope.get("path", "")
+    
+    request_class = headers.get(b"x-request-class", "").lower()
+    if request_class not in REQUEST_CLASSES:
+        request_class = next(
+            (cls for prefix, cls in ROUTE_REQUEST_CLASSES if path.startswith(prefix)), DEFAULT_REQUEST_CLASS
+        )
+    
+    session = headers.get(b"x-session-id", "")[:64]
+    if not session:
+        match = SESSION_PATH_PATTERN.match(path)
+        client = scope.get("client")
+        session = match.group(1)[:64] if match else client[0] if client else "-"
+    
+    deadline = None
+    try:
+        budget_ms = float(headers.get(b"x-deadline-ms", ""))
+    except ValueError:
+        budget_ms = None
+    if budget_ms is not None and budget_ms > 0:
+        deadline = time.monotonic() + min(budget_ms, MAX_DEADLINE_MS) / 1000.0
+    return Admission(request_class, session, deadline)
+
+# ================================
+# INFERENCE EXECUTOR
+# ================================
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", str(TF_INTRA_OP_THREADS)))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "32"))
+INFERENCE_RETRY_AFTER_SECONDS = int(os.getenv("INFERENCE_RETRY_AFTER_SECONDS", "2"))
+
+inference_executor = InferenceExecutor(
+    INFERENCE_THREADS, INFERENCE_QUEUE_SIZE,
+    retry_after_seconds=INFERENCE_RETRY_AFTER_SECONDS,
+    service_time_smoothing=SERVICE_TIME_SMOOTHING,
+    shed_counter=ADMISSION_SHED,
+    wait_histogram=ADMISSION_WAIT
+)
+
+# ================================
+# MICRO-BATCHING
+# ================================
+PREDICT_BATCHING = os.getenv("PREDICT_BATCHING", "1") == "1"
+PREDICT_BATCH_MAX_SIZE = int(os.getenv("PREDICT_BATCH_MAX_SIZE", "32"))
+PREDICT_BATCH_MAX_WAIT_MS = float(os.getenv("PREDICT_BATCH_MAX_WAIT_MS", "5"))
+
+def score_predict_batch(items):
+    """Score a batch of (img1, img2, key1, key2) /predict pairs"""
+    first, second, first_keys, second_keys = zip(*items)
+    return [float(score) for score in score_pairs(first, second, first_keys, second_keys)]
+
+predict_batcher = MicroBatcher(
+    score_predict_batch, inference_executor, PREDICT_BATCH_MAX_SIZE, PREDICT_BATCH_MAX_WAIT_MS
+)
+
+# ================================
+# QUALITY GATE
+# ================================
+# Off by default: dropping frames changes verdicts (fewer anchors count toward the checks).
+# When on it applies to every verification path: /batch-verify, /verify, sessions and the stream.
+QUALITY_GATE = os.getenv("QUALITY_GATE", "0") == "1"
+# Thresholds on the preprocessed 100x100 array (grayscale in [0, 1]), set from input_images/:
+# real faces have sharpness >= 0.0024, brightness 0.16-0.68, contrast >= 0.11; blurred,
+# darkened and flattened copies of them sit near 0.0002, 0.06 and 0.02. A re-encoded
+# resubmission is ~0.001 from its original, the closest distinct pair ~0.012.
+QUALITY_MIN_SHARPNESS = float(os.getenv("QUALITY_MIN_SHARPNESS", "0.0008"))
+QUALITY_MIN_BRIGHTNESS = float(os.getenv("QUALITY_MIN_BRIGHTNESS", "0.08"))
+QUALITY_MAX_BRIGHTNESS = float(os.getenv("QUALITY_MAX_BRIGHTNESS", "0.92"))
+QUALITY_MAX_CLIPPED = float(os.getenv("QUALITY_MAX_CLIPPED", "0.5"))
+QUALITY_MIN_CONTRAST = float(os.getenv("QUALITY_MIN_CONTRAST", "0.04"))
+QUALITY_DUPLICATE_DISTANCE = float(os.getenv("QUALITY_DUPLICATE_DISTANCE", "0.005"))
+
+quality_gate = QualityGate(
+    min_sharpness=QUALITY_MIN_SHARPNESS,
+    min_brightness=QUALITY_MIN_BRIGHTNESS,
+    max_brightness=QUALITY_MAX_BRIGHTNESS,
+    max_clipped=QUALITY_MAX_CLIPPED,
+    min_contrast=QUALITY_MIN_CONTRAST,
+    duplicate_distance=QUALITY_DUPLICATE_DISTANCE
+)
+
+def quality_report(assessments, indices=None, filenames=None):
+    """
+    Response block for the quality gate
+    
+    Args:
+        assessments: quality_gate.frame_quality() results, in upload order
+        indices: upload index of each assessment (default 0..n-1)
+        filenames: upload file names by upload index (optional)
+    """
+    indices = list(range(len(assessments))) if indices is None else indices
+    rejected = []
+    for index, assessment in zip(indices, assessments):
+        if not assessment["reasons"]:
+            continue
+        entry = {"index": index, "reasons": assessment["reasons"], "metrics": assessment["metrics"]}
+        if filenames is not None and index < len(filenames):
+            entry["filename"] = filenames[index]
+        rejected.append(entry)
+        for reason in assessment["reasons"]:
+            QUALITY_REJECTIONS.inc(reason)
+    return {
+        "enabled": QUALITY_GATE,
+        "frames_assessed": len(assessments),
+        "frames_used": len(assessments) - len(rejected),
+        "rejected": rejected
+    }
+
+def assess_frames(image_arrays):
+    """quality_gate.frame_quality() plus near-duplicate marking for frames already in memory"""
+    started = time.perf_counter()
+    assessments = quality_gate.mark_near_duplicates(quality_gate.frame_quality(image_arrays))
+    record_stage("quality", time.perf_counter() - started)
+    return assessments
+
+def no_usable_frames(report):
+    """400 listing why every frame was rejected"""
+    return HTTPException(
+        status_code=400,
+        detail={
+            "error": "No usable anchor images",
+            "message": "Every frame failed the quality gate; recapture and retry",
+            "quality_gate": report
+        }
+    )
+
+def preprocess_and_assess(image_bytes):
+    """cached_preprocess plus the per-frame quality checks (decode pool job)"""
+    key, array = cached_preprocess(image_bytes)
+    started = time.perf_counter()
+    assessment = quality_gate.frame_quality(array[None])[0]
+    record_stage("quality", time.perf_counter() - started)
+    return key, array, assessment
+
+# ================================
+# UPLOAD PIPELINE
+# ================================
+DECODE_THREADS = int(os.getenv("DECODE_THREADS", "2"))
+DECODE_QUEUE_SIZE = int(os.getenv("DECODE_QUEUE_SIZE", "256"))
+PIPELINE_BATCH_SIZE = int(os.getenv("PIPELINE_BATCH_SIZE", "8"))
+# Decodes one pipeline may have on the decode pool at once (the rest wait their turn)
+PIPELINE_MAX_DECODES = int(os.getenv("PIPELINE_MAX_DECODES", str(DECODE_THREADS * 4)))
+
+decode_executor = InferenceExecutor(
+    DECODE_THREADS, DECODE_QUEUE_SIZE, name="decode",
+    retry_after_seconds=INFERENCE_RETRY_AFTER_SECONDS,
+    service_time_smoothing=SERVICE_TIME_SMOOTHING,
+    shed_counter=ADMISSION_SHED,
+    wait_histogram=ADMISSION_WAIT
+)
+
+class UploadPipeline:
+    """
+    Overlapping read -> decode -> embed pipeline for a set of uploads
+    
+    Each upload is handed to the decode pool as soon as it has been read,
+    and decoded images are embedded in small batches on the inference
+    executor while later uploads are still being read and decoded.
+    For UploadFile inputs, Starlette has already received and spooled the
+    whole multipart body before the endpoint runs, so "read" is a read of
+    a spooled file: decoding and embedding overlap with each other, not
+    with the network transfer. Only bodies fed to add() from
+    request.stream() (NDJSON /sessions) overlap with the upload itself.
+    Images that fail to decode are skipped (and logged), as before. At
+    most `max_decodes` images are on the decode pool at a time, so a
+    large upload (a bulk session) waits its turn instead of overflowing
+    the pool's queue with 503s.
+    Labels listed in `gate` go through the quality gate as they decode:
+    unusable frames are never embedded and are reported by finish().
+    
+    Usage:
+        pipeline = UploadPipeline()
+        await pipeline.feed("Anchor", anchors)
+        await pipeline.feed("Negative", negatives, log_every=5)
+        results = await pipeline.finish()
+    """
+
+    def __init__(self, embed=True, batch_size=PIPELINE_BATCH_SIZE, gate=(), max_decodes=PIPELINE_MAX_DECODES):
+        self.embed = embed
+        self._decode_slots = asyncio.Semaphore(max(1, int(max_decodes)))
+        self.gate = set(gate) if QUALITY_GATE else set()
+        self.batch_size = max(1, int(batch_size))
+        self.items = {}
+        self._pending = []
+        self._decode_tasks = []
+        self._decoding_done = False
+        self._wakeup = asyncio.Event()
+        self._embedder = asyncio.ensure_future(self._embed_worker()) if embed else None
+
+    async def feed(self, label, uploads, log_every=1):
+        """Read uploads in order, starting each decode as soon as its bytes are in"""
+        try:
+            for upload in uploads:
+                self.add(label, await read_upload(upload), len(uploads), log_every)
+        except BaseException:
+            self.cancel()
+            raise
+
+    def add(self, label, data, total=None, log_every=1):
+        """Start decoding one image that is already in memory"""
+        items = self.items.setdefault(label, [])
+        item = {"index": len(items), "total": total, "key": None, "array": None,
+                "embedding": None, "error": None, "quality": None, "log_every": log_every}
+        items.append(item)
+        self._decode_tasks.append(asyncio.ensure_future(self._decode(label, item, data)))
+
+    def cancel(self):
+        for task in self._decode_tasks + ([self._embedder] if self._embedder else []):
+            task.cancel()
+
+    async def _decode(self, label, item, data):
+        try:
+            async with self._decode_slots:
+                if label in self.gate:
+                    item["key"], item["array"], item["quality"] = await decode_executor.run(
+                        preprocess_and_assess, data
+                    )
+                else:
+                    item["key"], item["array"] = await decode_executor.run(cached_preprocess, data)
+        except HTTPException:
+            raise
+        except Exception as e:
+            item["error"] = e
+            logger.warning("%s %s failed: %s", label, item['index']+1, e)
+            return
+        if (item["index"] + 1) % item["log_every"] == 0:
+            logger.debug("%s %s/%s decoded", label, item['index']+1, item['total'] or '?')
+        if item["quality"] is not None and self._rejected(label, item):
+            logger.debug("%s %s rejected: %s", label, item['index']+1, ', '.join(item['quality']['reasons']))
+            return
+        if not self.embed:
+            return
+        item["embedding"] = image_cache.get_embedding(item["key"])
+        if item["embedding"] is None:
+            self._pending.append(item)
+            self._wakeup.set()
+
+    def _rejected(self, label, item):
+        """Quality verdict at decode time; duplicates of frames decoded so far are caught here"""
+        quality = item["quality"]
+        if quality["reasons"]:
+            return True
+        earlier = [
+            other["quality"]["signature"] for other in self.items[label][:item["index"]]
+            if other["quality"] is not None and not set(other["quality"]["reasons"]) - {"near_duplicate"}
+        ]
+        if quality_gate.is_near_duplicate(quality["signature"], earlier):
+            quality["reasons"].append("near_duplicate")
+            return True
+        return False
+
+    async def _embed_worker(self):
+        """
+        Embed decoded images while decoding continues
+        
+        The first batch starts once `batch_size` images are decoded; each
+        following batch takes everything decoded during the previous one,
+        so batches grow when inference is the bottleneck.
+        """
+        while True:
+            if not self._pending or (len(self._pending) < self.batch_size and not self._decoding_done):
+                if self._decoding_done:
+                    return
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            batch, self._pending = self._pending, []
+            embeddings = await inference_executor.run(
+                embed_with_cache, [item["array"] for item in batch], [item["key"] for item in batch]
+            )
+            for item, embedding in zip(batch, embeddings):
+                item["embedding"] = embedding
+
+    async def finish(self):
+        """
+        Wait for every decode and embedding batch
+        
+        Returns:
+            dict: label -> {"arrays", "keys", "embeddings" (None without embed),
+            "indices"} for the uploads that decoded successfully (and passed
+            the quality gate), in upload order, plus "quality"
+            (quality_report, None for labels without the gate)
+        """
+        try:
+            await asyncio.gather(*self._decode_tasks)
+            self._decoding_done = True
+            self._wakeup.set()
+            if self._embedder:
+                await self._embedder
+        except BaseException:
+            self.cancel()
+            raise
+        
+        results = {}
+        for label, items in self.items.items():
+            decoded = [item for item in items if item["error"] is None]
+            quality = None
+            if label in self.gate:
+                # Decodes finish out of order: settle duplicates in upload order (a superset
+                # of the ones caught at decode time, so every kept frame is already embedded)
+                for item in decoded:
+                    if "near_duplicate" in item["quality"]["reasons"]:
+                        item["quality"]["reasons"].remove("near_duplicate")
+                assessments = quality_gate.mark_near_duplicates([item["quality"] for item in decoded])
+                quality = quality_report(assessments, [item["index"] for item in decoded])
+            ok = [item for item in decoded if item["quality"] is None or not item["quality"]["reasons"]]
+            results[label] = {
+                "arrays": [item["array"] for item in ok],
+                "keys": [item["key"] for item in ok],
+                "embeddings": np.stack([item["embedding"] for item in ok]) if self.embed and ok else None,
+                "indices": [item["index"] for item in ok],
+                "quality": quality
+            }
+        return results
+
+# ================================
+# ENROLLMENT GALLERY
+# ================================
+GALLERY_DIR = os.getenv("GALLERY_DIR", "gallery")
+MIN_GALLERY_REFERENCES = int(os.getenv("MIN_GALLERY_REFERENCES", "15"))
+STUDENT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+# Keep the preprocessed reference images (8-bit, ~30 KB each) next to the
+# embeddings so entries can be re-embedded when the model or backend changes;
+# without them such entries are dropped and the students must enroll again
+GALLERY_STORE_REFERENCES = os.getenv("GALLERY_STORE_REFERENCES", "1") == "1"
+
+# student_id -> {"embeddings", "reference_ids", "enrolled_at", "updated_at", "embedding_space"}
+enrollment_gallery = {}
+gallery_lock = Lock()
+# Bumped on every gallery/roster change (invalidates roster matrices)
+gallery_version = 0
+# Pre-fork workers each hold their own copy of the gallery; the files in
+# GALLERY_DIR/ROSTER_DIR are the shared state, re-read when they change
+GALLERY_SYNC = os.getenv("GALLERY_SYNC", "1" if SHARED_WEIGHTS_ATTACH else "0") == "1"
+# Directory mtimes have clock-tick granularity: keep rescanning this long after a change
+GALLERY_SYNC_SETTLE_NS = int(float(os.getenv("GALLERY_SYNC_SETTLE_MS", "1000")) * 1e6)
+# file name -> (inode, mtime) of the version held in memory
+gallery_file_stamps = {}
+
+def reference_id_for(cache_key):
+    """Content-addressed ID for a reference image (image cache key prefix)"""
+    return cache_key[:16]
+
+def validate_student_id(student_id):
+    """Reject IDs that are not safe to use as gallery file names"""
+    if not STUDENT_ID_PATTERN.match(student_id or ""):
+        raise HTTPException(status_code=400, detail=f"Invalid student ID: {student_id!r}")
+
+def gallery_file(student_id):
+    return os.path.join(GALLERY_DIR, f"{student_id}.npz")
+
+def embedding_space_key(model_checksum, backend):
+    return f"{model_checksum}/{backend}"
+
+def reference_pixels(image_arrays):
+    """Preprocessed [0, 1] images as stored in the gallery (uint8)"""
+    return np.rint(np.clip(np.asarray(image_arrays, dtype=np.float32), 0.0, 1.0) * 255).astype(np.uint8)
+
+def save_gallery_entry(student_id, entry, references=None):
+    """
+    Persist one student's reference embeddings (atomic replace)
+    
+    Args:
+        student_id: Student identifier
+        entry: gallery entry; stored under its embedding_space (default
+            the served one)
+        references: reference_pixels() per reference ID, kept for
+            re-embedding when GALLERY_STORE_REFERENCES is on
+    """
+    os.makedirs(GALLERY_DIR, exist_ok=True)
+    path = gallery_file(student_id)
+    tmp_path = path + ".tmp.npz"
+    extra = {}
+    if references is not None and GALLERY_STORE_REFERENCES:
+        extra["references"] = references
+    np.savez(
+        tmp_path,
+        embeddings=entry["embeddings"],
+        reference_ids=np.array(entry["reference_ids"]),
+        enrolled_at=entry["enrolled_at"],
+        updated_at=entry["updated_at"],
+        embedding_space=entry.get("embedding_space") or embedding_space or "",
+        **extra
+    )
+    os.replace(tmp_path, path)
+
+def stored_references(student_id):
+    """
+    Returns:
+        numpy array: the stored reference_pixels() of a student, or None
+    """
+    try:
+        with np.load(gallery_file(student_id)) as data:
+            return data["references"] if "references" in data.files else None
+    except (OSError, ValueError):
+        return None
+
+def reembed_gallery(embedder=None, space=None):
+    """
+    Bring every gallery entry into one embedding space
+    
+    Entries enrolled under another model file or backend are re-embedded
+    from their stored reference images and rewritten. Entries without
+    stored references (GALLERY_STORE_REFERENCES=0, or files written before
+    references were kept) cannot be, so they are dropped from the gallery
+    with a warning; their files stay until the student enrolls again.
+    
+    Args:
+        embedder: embedding tower (default the served embedding_model)
+        space: its embedding_space key (default the served one)
+        
+    Returns:
+        int: entries re-embedded or dropped
+    """
+    global gallery_version
+    embedder = embedder or embedding_model
+    space = space or embedding_space
+    if embedder is None or space is None:
+        return 0
+    with gallery_lock:
+        stale = [sid for sid, entry in enrollment_gallery.items() if entry["embedding_space"] != space]
+    for student_id in stale:
+        references = stored_references(student_id)
+        with gallery_lock:
+            entry = enrollment_gallery.get(student_id)
+        if entry is None:
+            continue
+        if references is None or len(references) != len(entry["reference_ids"]):
+            logger.warning(
+                "Dropping gallery entry enrolled under another model: no stored references to re-embed",
+                extra={"fields": {"student_id": student_id, "embedding_space": entry["embedding_space"],
+                                  "served_embedding_space": space}}
+            )
+            with gallery_lock:
+                enrollment_gallery.pop(student_id, None)
+                gallery_version += 1
+            update_gallery_index(student_id, None)
+            continue
+        entry = dict(
+            entry,
+            embeddings=embed_images(references.astype(np.float32) / 255.0, embedder=embedder),
+            embedding_space=space
+        )
+        with gallery_lock:
+            enrollment_gallery[student_id] = entry
+            gallery_version += 1
+        save_gallery_entry(student_id, entry, references)
+        update_gallery_index(student_id, entry)
+    if stale:
+        logger.info("Gallery moved to a new embedding space",
+                    extra={"fields": {"embedding_space": space, "entries": len(stale)}})
+    return len(stale)
+
+def changed_files(directory, suffix, stamps, exclude=None):
+    """
+    Files in `directory` that differ from the versions recorded in `stamps`
+    
+    Returns:
+        tuple: ({name: (inode, mtime_ns)} new or replaced, [names] removed)
+    """
+    current = {}
+    if os.path.isdir(directory):
+        for item in os.scandir(directory):
+            if not item.name.endswith(suffix) or (exclude and item.name.endswith(exclude)):
+                continue
+            try:
+                stat = item.stat()
+            except FileNotFoundError:
+                continue
+            current[item.name] = (stat.st_ino, stat.st_mtime_ns)
+    changed = {name: stamp for name, stamp in current.items() if stamps.get(name) != stamp}
+    return changed, [name for name in stamps if name not in current]
+
+def load_gallery():
+    """
+    Load persisted reference embeddings from GALLERY_DIR
+    
+    Only files added or replaced since the last call are read, and
+    students whose file is gone are dropped, so repeated calls pick up
+    enrollments made by other worker processes (sync_gallery). Entries
+    from another embedding space go through reembed_gallery().
+    
+    Returns:
+        int: students added, updated or removed
+    """
+    global gallery_version
+    changed, removed = changed_files(GALLERY_DIR, ".npz", gallery_file_stamps, exclude=".tmp.npz")
+    loaded = {}
+    for name, stamp in changed.items():
+        gallery_file_stamps[name] = stamp
+        student_id = name[:-len(".npz")]
+        try:
+            with np.load(os.path.join(GALLERY_DIR, name)) as data:
+                loaded[student_id] = {
+                    "embeddings": data["embeddings"].astype(np.float32),
+                    "reference_ids": [str(r) for r in data["reference_ids"]],
+                    "enrolled_at": float(data["enrolled_at"]),
+                    "updated_at": float(data["updated_at"]),
+                    # Files from before the key was stored only had the model URL
+                    "embedding_space": str(data["embedding_space"]) if "embedding_space" in data.files else ""
+                }
+        except Exception as e:
+            logger.warning("Could not load gallery entry %s: %s", name, e)
+    deleted = []
+    for name in removed:
+        del gallery_file_stamps[name]
+        deleted.append(name[:-len(".npz")])
+    if not loaded and not deleted:
+        return 0
+    with gallery_lock:
+        enrollment_gallery.update(loaded)
+        for student_id in deleted:
+            enrollment_gallery.pop(student_id, None)
+        gallery_version += 1
+    for student_id, entry in loaded.items():
+        update_gallery_index(student_id, entry)
+    for student_id in deleted:
+        update_gallery_index(student_id, None)
+    if any(entry["embedding_space"] != embedding_space for entry in loaded.values()):
+        reembed_gallery()
+    return len(loaded) + len(deleted)
+
+def get_gallery_entry(student_id):
+    """Return the enrolled entry for a student or raise 404"""
+    with gallery_lock:
+        entry = enrollment_gallery.get(student_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Student {student_id} is not enrolled")
+    return entry
+
+# ================================
+# ROSTERS (1:N IDENTIFICATION)
+# ================================
+ROSTER_DIR = os.getenv("ROSTER_DIR", os.path.join(GALLERY_DIR, "rosters"))
+IDENTIFY_TOP_K = int(os.getenv("IDENTIFY_TOP_K", "5"))
+
+# roster_id -> {"student_ids", "updated_at"}
+rosters = {}
+# roster_id -> (gallery_version, RosterMatrix)
+roster_matrices = {}
+# file name -> (inode, mtime) of the version held in memory
+roster_file_stamps = {}
+# (GALLERY_DIR, ROSTER_DIR) mtimes at the last sync_gallery()
+gallery_dir_stamps = None
+
+class RosterMatrix:
+    """
+    All reference embeddings of a roster in one contiguous matrix
+    
+    Rows are grouped by student, so per-student reductions over a score
+    matrix are a single np.maximum.reduceat over column segments.
+    """
+
+    def __init__(self, student_ids, entries):
+        self.student_ids = [sid for sid in student_ids if sid in entries and entries[sid]["reference_ids"]]
+        counts = [len(entries[sid]["reference_ids"]) for sid in self.student_ids]
+        self.counts = np.array(counts, dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)[:-1]]).astype(np.int64)
+        if self.student_ids:
+            self.embeddings = np.ascontiguousarray(
+                np.concatenate([entries[sid]["embeddings"] for sid in self.student_ids]), dtype=np.float32
+            )
+        else:
+            self.embeddings = np.empty((0, 0), dtype=np.float32)
+
+    def score(self, anchor_embeddings):
+        """
+        Score anchors against every roster reference in one head pass
+        
+        Returns:
+            tuple: (per-student score, per-student best score, per-student
+            fraction of comparisons >= SECONDARY_THRESHOLD)
+        """
+        scores = score_embeddings(anchor_embeddings, self.embeddings)
+        # Per anchor, best reference of each student; then average over anchors
+        per_anchor_best = np.maximum.reduceat(scores, self.offsets, axis=1)
+        student_scores = per_anchor_best.mean(axis=0)
+        best_scores = per_anchor_best.max(axis=0)
+        secondary = np.add.reduceat((scores >= SECONDARY_THRESHOLD).astype(np.int64), self.offsets, axis=1).sum(axis=0)
+        match_ratios = secondary / (self.counts * len(scores))
+        return student_scores, best_scores, match_ratios
+
+def validate_session_id(session_id):
+    if not STUDENT_ID_PATTERN.match(session_id or ""):
+        raise HTTPException(status_code=400, detail=f"Invalid session ID: {session_id!r}")
+
+def validate_roster_id(roster_id):
+    if not STUDENT_ID_PATTERN.match(roster_id or ""):
+        raise HTTPException(status_code=400, detail=f"Invalid roster ID: {roster_id!r}")
+
+def roster_file(roster_id):
+    return os.path.join(ROSTER_DIR, f"{roster_id}.json")
+
+def save_roster(roster_id, roster):
+    """Persist a roster's student list (atomic replace)"""
+    os.makedirs(ROSTER_DIR, exist_ok=True)
+    path = roster_file(roster_id)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(roster, f)
+    os.replace(tmp_path, path)
+
+def load_rosters():
+    """
+    Load persisted rosters from ROSTER_DIR (changed files only, like load_gallery)
+    
+    Returns:
+        int: rosters added, updated or removed
+    """
+    global gallery_version
+    changed, removed = changed_files(ROSTER_DIR, ".json", roster_file_stamps)
+    loaded = {}
+    for name, stamp in changed.items():
+        roster_file_stamps[name] = stamp
+        try:
+            with open(os.path.join(ROSTER_DIR, name)) as f:
+                roster = json.load(f)
+            loaded[name[:-len(".json")]] = {
+                "student_ids": [str(sid) for sid in roster["student_ids"]],
+                "updated_at": float(roster["updated_at"])
+            }
+        except Exception as e:
+            logger.warning("Could not load roster %s: %s", name, e)
+    deleted = []
+    for name in removed:
+        del roster_file_stamps[name]
+        deleted.append(name[:-len(".json")])
+    if not loaded and not deleted:
+        return 0
+    with gallery_lock:
+        rosters.update(loaded)
+        for roster_id in deleted:
+            rosters.pop(roster_id, None)
+            roster_matrices.pop(roster_id, None)
+        gallery_version += 1
+    return len(loaded) + len(deleted)
+
+def directory_stamp(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def sync_gallery():
+    """
+    Pick up enrollments and rosters written by other worker processes
+    
+    Costs two stat() calls while neither directory changed; otherwise
+    re-reads just the files that were added, replaced or removed.
+    
+    Returns:
+        int: gallery entries and rosters changed
+    """
+    global gallery_dir_stamps
+    stamps = (directory_stamp(GALLERY_DIR), directory_stamp(ROSTER_DIR))
+    now = time.time_ns()
+    settled = all(stamp is None or now - stamp > GALLERY_SYNC_SETTLE_NS for stamp in stamps)
+    if stamps == gallery_dir_stamps and settled:
+        return 0
+    gallery_dir_stamps = stamps
+    return load_gallery() + load_rosters()
+
+def get_roster_matrix(roster_id):
+    """Return the (cached) contiguous embedding matrix for a roster or raise 404"""
+    with gallery_lock:
+        roster = rosters.get(roster_id)
+        if roster is None:
+            raise HTTPException(status_code=404, detail=f"Roster {roster_id} not found")
+        cached = roster_matrices.get(roster_id)
+        if cached is not None and cached[0] == gallery_version:
+            return cached[1]
+        version = gallery_version
+        entries = {sid: enrollment_gallery[sid] for sid in roster["student_ids"] if sid in enrollment_gallery}
+    
+    matrix = RosterMatrix(roster["student_ids"], entries)
+    with gallery_lock:
+        roster_matrices[roster_id] = (version, matrix)
+    return matrix
+
+def identify_in_roster(roster_id, anchor_arrays, anchor_keys, top_k):
+    """Embed the live frames and rank every enrolled roster student"""
+    matrix = get_roster_matrix(roster_id)
+    if not matrix.student_ids:
+        raise HTTPException(status_code=400, detail=f"No enrolled students in roster {roster_id}")
+    
+    anchor_embeddings = embed_with_cache(anchor_arrays, anchor_keys)
+    student_scores, best_scores, match_ratios = matrix.score(anchor_embeddings)
+    top = np.argsort(-student_scores, kind="stable")[:max(1, top_k)]
+    candidates = [
+        {
+            "student_id": matrix.student_ids[i],
+            "score": float(student_scores[i]),
+            "best_score": float(best_scores[i]),
+            "match_ratio": float(match_ratios[i]),
+            "references": int(matrix.counts[i])
+        }
+        for i in top
+    ]
+    return matrix, candidates
+
+# ================================
+# GALLERY INDEX (CAMPUS-WIDE IDENTIFICATION)
+# ================================
+ANN_MIN_TRAIN_VECTORS = int(os.getenv("ANN_MIN_TRAIN_VECTORS", "4096"))
+ANN_LISTS = int(os.getenv("ANN_LISTS", "64"))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+ANN_RERANK = int(os.getenv("ANN_RERANK", "128"))
+
+gallery_index = None
+gallery_index_training = False
+gallery_index_lock = Lock()
+# student_id -> index labels currently stored for that student
+indexed_references = {}
+
+def get_gallery_index():
+    """
+    Return the gallery ANN index, building it from the gallery on first use
+    
+    Until the gallery holds ANN_MIN_TRAIN_VECTORS references the index
+    answers with exact brute-force search; once that size is reached it
+    is trained in a background thread (searches stay exact meanwhile).
+    """
+    global gallery_index, gallery_index_training
+    with gallery_index_lock:
+        if gallery_index is None:
+            index = IVFPQIndex(head_kernel, head_bias, num_lists=ANN_LISTS, nprobe=ANN_NPROBE, rerank=ANN_RERANK)
+            with gallery_lock:
+                entries = dict(enrollment_gallery)
+            for student_id, entry in entries.items():
+                labels = [(student_id, ref_id) for ref_id in entry["reference_ids"]]
+                index.add(labels, entry["embeddings"])
+                indexed_references[student_id] = labels
+            gallery_index = index
+        index = gallery_index
+        if not index.is_trained and not gallery_index_training and len(index) >= ANN_MIN_TRAIN_VECTORS:
+            gallery_index_training = True
+            Thread(target=train_gallery_index, args=(index,), daemon=True).start()
+    return index
+
+def train_gallery_index(index):
+    """Fit the index partitions/codebooks on the current gallery (background)"""
+    global gallery_index_training
+    try:
+        logger.info("Training gallery index on %s references...", len(index))
+        started = time.time()
+        index.train(index.vectors()[1])
+        logger.info("Gallery index trained in %.1fs", time.time() - started)
+    except Exception as e:
+        logger.error("Gallery index training failed, staying exact: %s", e, exc_info=True)
+    finally:
+        with gallery_index_lock:
+            gallery_index_training = False
+
+def update_gallery_index(student_id, entry):
+    """Mirror an enrollment change into the index (entry None = deleted)"""
+    with gallery_index_lock:
+        if gallery_index is None:
+            return
+        gallery_index.remove(indexed_references.pop(student_id, []))
+        if entry is not None:
+            labels = [(student_id, ref_id) for ref_id in entry["reference_ids"]]
+            gallery_index.add(labels, entry["embeddings"])
+            indexed_references[student_id] = labels
+
+def identify_in_gallery(anchor_arrays, anchor_keys, top_k):
+    """
+    Rank enrolled students for live frames through the ANN index
+    
+    Each anchor retrieves its best references (exact head re-rank of the
+    index shortlist); a student's score is its best reference score per
+    anchor, averaged over anchors (0 when not retrieved for an anchor).
+    """
+    index = get_gallery_index()
+    if len(index) == 0:
+        raise HTTPException(status_code=400, detail="No enrolled students")
+    
+    anchor_embeddings = embed_with_cache(anchor_arrays, anchor_keys)
+    best = {}
+    with observe_stage("scoring"):
+        for a, embedding in enumerate(anchor_embeddings):
+            for (student_id, _), score in index.search(embedding, k=ANN_RERANK):
+                scores = best.setdefault(student_id, np.zeros(len(anchor_embeddings)))
+                scores[a] = max(scores[a], score)
+    
+    ranked = sorted(best.items(), key=lambda item: -item[1].mean())[:max(1, top_k)]
+    return index, [
+        {
+            "student_id": student_id,
+            "score": float(scores.mean()),
+            "best_score": float(scores.max())
+        }
+        for student_id, scores in ranked
+    ]
+
+# ================================
+# ATTENDANCE STORE
+# ================================
+ATTENDANCE_DB = os.getenv("ATTENDANCE_DB", "attendance.db")  # empty disables recording
+ATTENDANCE_BATCH_SIZE = int(os.getenv("ATTENDANCE_BATCH_SIZE", "256"))
+ATTENDANCE_FLUSH_SECONDS = float(os.getenv("ATTENDANCE_FLUSH_SECONDS", "0.5"))
+
+attendance_store = None
+
+def open_attendance_store():
+    """Open the SQLite store and start its batched writer (once)"""
+    global attendance_store
+    if ATTENDANCE_DB and attendance_store is None:
+        attendance_store = AttendanceStore(
+            ATTENDANCE_DB, batch_size=ATTENDANCE_BATCH_SIZE, flush_interval=ATTENDANCE_FLUSH_SECONDS
+        )
+    return attendance_store
+
+def ensure_attendance_store():
+    if attendance_store is None:
+        raise HTTPException(status_code=503, detail="Attendance store is disabled (ATTENDANCE_DB is empty)")
+    return attendance_store
+
+def record_attendance(student_id, result, score_matrix, session_id=None, filenames=None, source="verify"):
+    """
+    Queue a verification outcome for the attendance store
+    
+    One scan row per request plus one frame row per anchor (median and
+    max of its reference scores, like the legacy scan history). Never
+    blocks: the store's writer thread commits in batches.
+    """
+    if attendance_store is None:
+        return
+    if filenames is not None and len(filenames) != len(score_matrix):
+        filenames = None  # some uploads failed to decode; rows no longer line up
+    context = request_context.get()
+    attendance_store.record({
+        "student_id": student_id,
+        "session_id": session_id,
+        "status": "PRESENT" if result["verified"] else "REJECTED",
+        "verified": result["verified"],
+        "confidence": result["confidence"],
+        "source": source,
+        "request_id": context["request_id"] if context else None,
+        "details": {
+            "match_ratio": result["match_ratio"],
+            "negatives_processed": result["negatives_processed"],
+            "rejection_reasons": result["rejection_reasons"]
+        },
+        "frames": [
+            {
+                "frame_index": i + 1,
+                "filename": filenames[i] if filenames else None,
+                "num_scores": int(score_matrix.shape[1]),
+                "median": float(np.median(row)),
+                "max": float(row.max())
+            }
+            for i, row in enumerate(score_matrix)
+        ]
+    })
+
+# ================================
+# BULK SESSION VERIFICATION
+# ================================
+BULK_MAX_IMAGES = int(os.getenv("BULK_MAX_IMAGES", "2000"))
+BULK_EMBED_BATCH_SIZE = int(os.getenv("BULK_EMBED_BATCH_SIZE", str(EMBED_BATCH_SIZE)))
+BULK_MIN_REFERENCES = 15  # same floor as /batch-verify for uploaded references
+
+class BulkSession:
+    """
+    Collects a session's (student ID, frames[, references]) entries
+    
+    Every image goes straight into one shared UploadPipeline. For NDJSON
+    bodies, decoding and large-batch embedding overlap with receiving the
+    body; request.form() parses and spools a multipart body in full first,
+    so there they only overlap with each other.
+    Labels are "frames:<student>" and "references:<student>".
+    """
+
+    def __init__(self):
+        self.pipeline = UploadPipeline(batch_size=BULK_EMBED_BATCH_SIZE)
+        self.students = {}   # student_id -> {"frames": [filenames], "references": count}
+        self.images = 0
+
+    def add(self, student_id, kind, data, filename=None):
+        if kind not in ("frames", "references"):
+            raise HTTPException(status_code=400, detail=f"Unknown entry kind {kind!r} (frames or references)")
+        validate_student_id(student_id)
+        self.images += 1
+        if self.images > BULK_MAX_IMAGES:
+            raise HTTPException(status_code=413, detail=f"More than {BULK_MAX_IMAGES} images in one session")
+        student = self.students.setdefault(student_id, {"frames": [], "references": 0})
+        if kind == "frames":
+            student["frames"].append(filename)
+            if QUALITY_GATE:
+                self.pipeline.gate.add(f"frames:{student_id}")
+        else:
+            student["references"] += 1
+        self.pipeline.add(f"{kind}:{student_id}", data)
+
+    def add_ndjson_line(self, line, line_number):
+        """One {"student_id", "frames": [base64], "references": [base64]} object"""
+        try:
+            entry = json.loads(line)
+            student_id = entry["student_id"]
+            images = {kind: [decode_base64_image(item, kind) for item in entry.get(kind) or []]
+                      for kind in ("frames", "references")}
+        except (ValueError, KeyError, TypeError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid NDJSON entry on line {line_number}: {e}")
+        for kind, items in images.items():
+            for data in items:
+                self.add(str(student_id), kind, data)
+
+    async def read_ndjson(self, request):
+        """Stream the body, starting work on each line as soon as it is complete"""
+        pending = bytearray()
+        line_number = 0
+        async for chunk in request.stream():
+            start = 0
+            while True:
+                end = chunk.find(b"\n", start)
+                if end < 0:
+                    pending += chunk[start:]
+                    break
+                pending += chunk[start:end]
+                start = end + 1
+                line_number += 1
+                if pending.strip():
+                    self.add_ndjson_line(bytes(pending), line_number)
+                pending.clear()
+        if pending.strip():
+            self.add_ndjson_line(bytes(pending), line_number + 1)
+
+    async def read_multipart(self, request):
+        """File fields named frames.<student_id> or references.<student_id>"""
+        async with request.form(max_files=BULK_MAX_IMAGES + 1, max_fields=100) as form:
+            for name, value in form.multi_items():
+                if isinstance(value, str):
+                    continue
+                kind, _, student_id = name.partition(".")
+                self.add(student_id, kind, await read_upload(value), value.filename)
+
+def score_bulk_session(students, processed):
+    """
+    Per-student verdicts (same shape as /batch-verify) for a bulk session
+    
+    References are the uploaded ones when given, otherwise the student's
+    enrolled gallery embeddings. Problems with one student (no decodable
+    frames, too few references, not enrolled) are reported on that
+    student's entry instead of failing the session.
+    
+    Returns:
+        list: per student, an error dict or (result, score matrix, file
+        names of the frames that decoded -- one per score row)
+    """
+    empty = {"embeddings": None, "indices": [], "quality": None}
+    results = []
+    for student_id, student in students.items():
+        frame_set = processed.get(f"frames:{student_id}", empty)
+        frames = frame_set["embeddings"]
+        references = processed.get(f"references:{student_id}", empty)["embeddings"]
+        quality = frame_set["quality"]
+        if quality is not None:
+            for rejected in quality["rejected"]:
+                rejected["filename"] = student["frames"][rejected["index"]]
+        source = "upload"
+        error = None
+        if frames is None:
+            error = "No usable frames (quality gate)" if quality is not None and quality["rejected"] else "No valid frames"
+        elif student["references"]:
+            if references is None or len(references) < BULK_MIN_REFERENCES:
+                got = 0 if references is None else len(references)
+                error = f"Not enough valid reference images ({got}/{BULK_MIN_REFERENCES})"
+        else:
+            source = "gallery"
+            with gallery_lock:
+                entry = enrollment_gallery.get(student_id)
+            if entry is None:
+                error = "Not enrolled and no references uploaded"
+            elif len(entry["reference_ids"]) < MIN_GALLERY_REFERENCES:
+                error = f"Not enough enrolled references ({len(entry['reference_ids'])}/{MIN_GALLERY_REFERENCES})"
+            else:
+                references = entry["embeddings"]
+        
+        if error:
+            entry = {"student_id": student_id, "verified": False, "error": error}
+            if quality is not None:
+                entry["quality_gate"] = quality
+            results.append(entry)
+            continue
+        score_matrix = score_embeddings(frames, references)
+        result = build_verification_result(score_matrix)
+        result["student_id"] = student_id
+        result["references_source"] = source
+        if quality is not None:
+            result["quality_gate"] = quality
+        result["comparisons_spent"] = int(score_matrix.size)
+        filenames = [student["frames"][i] for i in frame_set["indices"]]
+        results.append((result, score_matrix, filenames))
+    return results
+
+# ================================
+# JSON INGESTION
+# ================================
+HEX_KEY_PATTERN = re.compile(r"^[0-9a-f]{16}([0-9a-f]{48})?$")
+
+# (gallery_version, {reference_id: (student_id, row)})
+gallery_reference_map = (None, {})
+
+def decode_base64_image(value, field="image"):
+    """
+    Base64 (optionally a data: URL) -> raw image bytes
+    
+    binascii decodes straight from the JSON string in C; the only other
+    copy is dropping a data-URL prefix. Strict mode rejects any character
+    outside the base64 alphabet (including line breaks) and bad padding,
+    so a corrupted payload is a 400 here rather than garbage bytes that
+    fail later as an unreadable image.
+    
+    Raises:
+        ValueError: "<field>: invalid base64 (...)" (callers answer 400)
+    """
+    if not isinstance(value, str) or not value:
+        raise ValueError(f"{field} must be a non-empty base64 string")
+    if value.startswith("data:"):
+        comma = value.find(",", 0, 256)
+        if comma < 0:
+            raise ValueError(f"{field} is a data URL without a payload")
+        value = value[comma + 1:]
+    try:
+        return binascii.a2b_base64(value, strict_mode=True)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"{field}: invalid base64 ({e})")
+
+async def read_json_body(request):
+    """Parse a JSON object body, recording the upload_read stage"""
+    started = time.perf_counter()
+    body = await request.body()
+    record_stage("upload_read", time.perf_counter() - started)
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="JSON body must be an object")
+    return payload
+
+def decode_base64_list(payload, field, required=True):
+    values = payload.get(field)
+    if values is None and not required:
+        return []
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail=f"{field} must be a list of base64 images")
+    try:
+        return [decode_base64_image(value, f"{field}[{i}]") for i, value in enumerate(values)]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def resolve_reference_embeddings(reference_ids):
+    """
+    Embeddings for reference IDs instead of uploaded bytes
+    
+    A 16-hex ID is an enrolled reference (as returned by /enroll); a
+    64-hex ID is an image cache key (SHA-256 of the image bytes) whose
+    embedding or decoded image is still cached.
+    
+    Returns:
+        numpy array: (len(reference_ids), embedding_dim)
+    """
+    global gallery_reference_map
+    for ref_id in reference_ids:
+        if not isinstance(ref_id, str) or not HEX_KEY_PATTERN.match(ref_id):
+            raise HTTPException(status_code=400, detail=f"Invalid reference ID: {ref_id!r}")
+    with gallery_lock:
+        version, mapping = gallery_reference_map
+        if version != gallery_version:
+            mapping = {
+                ref_id: (student_id, row)
+                for student_id, entry in enrollment_gallery.items()
+                for row, ref_id in enumerate(entry["reference_ids"])
+            }
+            gallery_reference_map = (gallery_version, mapping)
+        located = {ref_id: mapping.get(ref_id) for ref_id in reference_ids}
+        entries = {sid: enrollment_gallery[sid] for sid, _ in filter(None, located.values())}
+    
+    embeddings = []
+    for ref_id in reference_ids:
+        if located[ref_id] is not None:
+            student_id, row = located[ref_id]
+            embeddings.append(entries[student_id]["embeddings"][row])
+            continue
+        embedding = image_cache.get_embedding(ref_id) if len(ref_id) == 64 else None
+        if embedding is None and len(ref_id) == 64:
+            image = image_cache.get_image(ref_id)
+            if image is not None:
+                embedding = embed_with_cache([image], [ref_id])[0]
+        if embedding is None:
+            raise HTTPException(status_code=404, detail=f"Unknown reference ID: {ref_id}")
+        embeddings.append(embedding)
+    return np.stack(embeddings).astype(np.float32, copy=False)
+
+# ================================
+# API ENDPOINTS
+# ================================
+
+def ensure_model_ready():
+    """Raise 503 unless the model is loaded"""
+    if model_loading:
+        MODEL_UNAVAILABLE_TOTAL.inc("loading")
+        elapsed = time.time() - load_start_time if load_start_time else 0
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "error": "Model still loading",
+                "loading_time_seconds": round(elapsed, 1),
+                "message": "Please wait and check /health"
+            }
+        )
+    
+    if model is None:
+        MODEL_UNAVAILABLE_TOTAL.inc("error" if model_error else "not_loaded")
+        error_msg = f"Model failed: {model_error}" if model_error else "Model not loaded"
+        raise HTTPException(status_code=503, detail=error_msg)
+
+def ensure_gallery_ready():
+    """Raise 503 unless gallery scoring (split model) is available"""
+    ensure_model_ready()
+    if embedding_model is None:
+        raise HTTPException(status_code=503, detail="Gallery scoring requires the split embedding model")
+
+@app.get("/")
+def root():
+    """Root endpoint - health check"""
+    elapsed = None
+    if load_start_time:
+        elapsed = time.time() - load_start_time
+    
+    status = (
+        "ready" if model is not None else
+        "loading" if model_loading else
+        "not_started" if not model_load_started else
         "error"
     )
     
@@ -462,9 +3441,104 @@ def health():
         "error": model_error,
         "tensorflow_version": tf.__version__,
         "keras_version": keras_version,
-        "preprocessing": "TensorFlow (tf.io.decode_jpeg + tf.image.resize)"
+        "preprocessing": (
+            "Pillow (draft-mode JPEG decode + bilinear resize)" if PREPROCESS_BACKEND == "pillow" else
+            "TensorFlow (tf.io.decode_jpeg + tf.image.resize)"
+        ),
+        "scoring_path": "embedding tower + NumPy head" if embedding_model is not None else "full pair grid",
+        "head_parity_error": head_parity_error,
+        "inference_backend": (
+            quantized_parity["backend"] if quantized_parity and quantized_parity["passed"] else "float32"
+        ),
+        "quantized_parity": quantized_parity,
+        "serving_mode": "shared_weights" if SHARED_WEIGHTS_ATTACH else "single_process",
+        "cold_start": {
+            "source": load_phases.get("source"),
+            "phases_seconds": {k: v for k, v in load_phases.items() if k != "source"}
+        },
+        "quality_gate": QUALITY_GATE,
+        "inference_buckets": list(INFERENCE_BUCKETS),
+        "inference_xla": INFERENCE_XLA,
+        "worker_pid": os.getpid(),
+        "gallery_students": len(enrollment_gallery),
+        "rosters": len(rosters),
+        "gallery_index": gallery_index.stats() if gallery_index is not None else None,
+        "attendance_store": attendance_store.stats() if attendance_store is not None else None,
+        "image_cache": image_cache.stats(),
+        "predict_batcher": {"enabled": PREDICT_BATCHING, **predict_batcher.stats()},
+        "inference_executor": inference_executor.stats(),
+        "decode_executor": decode_executor.stats()
     }
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus text-format metrics (stage latency, requests, model load, queues)"""
+    lines = []
+    lines += STAGE_LATENCY.render()
+    lines += REQUEST_LATENCY.render()
+    lines += REQUESTS_TOTAL.render()
+    lines += MODEL_UNAVAILABLE_TOTAL.render()
+    lines += QUALITY_REJECTIONS.render()
+    
+    lines += render_gauge("eduface_model_loaded", "1 when the model is ready", [((), model is not None)])
+    lines += render_gauge("eduface_model_loading", "1 while the model is loading", [((), model_loading)])
+    lines += render_gauge(
+        "eduface_model_load_phase_seconds", "Duration of each phase of the last model load",
+        [((phase,), seconds) for phase, seconds in load_phases.items() if phase != "source"],
+        ["phase"]
+    )
+    
+    executors = [(executor.name, executor.stats()) for executor in (inference_executor, decode_executor)]
+    lines += render_gauge(
+        "eduface_executor_outstanding", "Jobs running or queued per executor",
+        [((name,), stats["outstanding"]) for name, stats in executors], ["executor"]
+    )
+    lines += render_gauge(
+        "eduface_executor_capacity", "Maximum running + queued jobs per executor",
+        [((name,), stats["capacity"]) for name, stats in executors], ["executor"]
+    )
+    lines += ["# HELP eduface_executor_rejected_total Jobs rejected with 503 (queue full)",
+              "# TYPE eduface_executor_rejected_total counter"]
+    lines += [f'eduface_executor_rejected_total{{executor="{name}"}} {stats["rejected"]}' for name, stats in executors]
+    lines += render_gauge(
+        "eduface_executor_queued", "Jobs waiting per executor and request class",
+        [((name, cls), queued) for name, stats in executors for cls, queued in stats["queued_by_class"].items()],
+        ["executor", "request_class"]
+    )
+    lines += render_gauge(
+        "eduface_executor_session_oldest_wait_seconds",
+        "Wait of the oldest queued job per session queue (sessions with queued jobs only)",
+        [((name, queue["request_class"], queue["session"]), queue["oldest_wait_ms"] / 1000)
+         for name, stats in executors for queue in stats["session_queues"]],
+        ["executor", "request_class", "session"]
+    )
+    lines += ADMISSION_WAIT.render()
+    lines += ADMISSION_SHED.render()
+    
+    cache = image_cache.stats()
+    lines += ["# HELP eduface_image_cache_lookups_total Image cache lookups by result",
+              "# TYPE eduface_image_cache_lookups_total counter",
+              f'eduface_image_cache_lookups_total{{result="hit"}} {cache["hits"]}',
+              f'eduface_image_cache_lookups_total{{result="miss"}} {cache["misses"]}']
+    lines += render_gauge("eduface_image_cache_bytes", "Bytes held by the image cache",
+                          [((), cache["size_mb"] * 1024 * 1024)])
+    lines += render_gauge("eduface_predict_batcher_queue_depth", "Pairs waiting in the /predict micro-batcher",
+                          [((), predict_batcher.stats()["queue_depth"])])
+    lines += render_gauge("eduface_gallery_students", "Enrolled students", [((), len(enrollment_gallery))])
+    if attendance_store is not None:
+        attendance = attendance_store.stats()
+        lines += render_gauge("eduface_attendance_queue_depth", "Scans waiting for the attendance writer",
+                              [((), attendance["queued"])])
+        lines += ["# HELP eduface_attendance_scans_total Scans handled by the attendance writer",
+                  "# TYPE eduface_attendance_scans_total counter"]
+        lines += [f'eduface_attendance_scans_total{{result="{result}"}} {attendance[result]}'
+                  for result in ("written", "dropped", "failed")]
+    lines += ["# HELP eduface_log_records_dropped_total Log records dropped because the log queue was full",
+              "# TYPE eduface_log_records_dropped_total counter",
+              f"eduface_log_records_dropped_total {NonBlockingQueueHandler.dropped}"]
+    
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
 @app.post("/predict")
 async def predict(file1: UploadFile = File(...), file2: UploadFile = File(...)):
     """
@@ -479,71 +3553,94 @@ async def predict(file1: UploadFile = File(...), file2: UploadFile = File(...)):
     """
     
     # Check model status
-    if model_loading:
-        elapsed = time.time() - load_start_time if load_start_time else 0
-        raise HTTPException(
-            status_code=503,
-            detail={
-                "error": "Model still loading",
-                "loading_time_seconds": round(elapsed, 1),
-                "message": "Please wait and check /health"
-            }
-        )
+    ensure_model_ready()
     
-    if model is None:
-        error_msg = f"Model failed: {model_error}" if model_error else "Model not loaded"
-        raise HTTPException(status_code=503, detail=error_msg)
+    # Read files
+    img1_bytes = await read_upload(file1)
+    img2_bytes = await read_upload(file2)
     
+    logger.debug("Files: %s (%sb), %s (%sb)", file1.filename, len(img1_bytes), file2.filename, len(img2_bytes))
+    return await compare_images(img1_bytes, img2_bytes)
+
+@app.post("/predict/json")
+async def predict_json(request: Request):
+    """
+    Compare two face images sent as base64 JSON
+    
+    Body: {"image1": base64, "image2": base64}, or
+    {"image1": base64, "reference_id": id} to compare against an enrolled
+    reference (ID from /enroll) or a cached image (SHA-256 of its bytes)
+    without sending it again. Base64 may be a data: URL.
+    
+    Returns:
+        Same JSON as /predict
+    """
+    ensure_model_ready()
+    payload = await read_json_body(request)
     try:
-        print("\n" + "="*60)
-        print("🔍 PREDICTION REQUEST")
-        print("="*60)
-        
-        # Read files
-        img1_bytes = await file1.read()
-        img2_bytes = await file2.read()
-        
-        print(f"📥 Files: {file1.filename} ({len(img1_bytes)}b), {file2.filename} ({len(img2_bytes)}b)")
-        
-        # Validate not empty
-        if not img1_bytes or not img2_bytes:
-            raise HTTPException(status_code=400, detail="Empty file(s)")
-        
-        # Validate JPEG magic bytes (FF D8 FF)
-        if len(img1_bytes) < 3 or len(img2_bytes) < 3:
-            raise HTTPException(status_code=400, detail="Files too small")
+        img1_bytes = decode_base64_image(payload.get("image1"), "image1")
+        reference_id = payload.get("reference_id")
+        if reference_id is None:
+            img2_bytes = decode_base64_image(payload.get("image2"), "image2")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if reference_id is None:
+        return await compare_images(img1_bytes, img2_bytes)
+    ensure_gallery_ready()
+    reference = await inference_executor.run(resolve_reference_embeddings, [reference_id])
+    return await compare_images(img1_bytes, reference_embedding=reference)
+
+async def compare_images(img1_bytes, img2_bytes=None, reference_embedding=None):
+    """
+    Shared /predict logic: validate, preprocess and score one pair
+    
+    The second side is either raw image bytes or an already computed
+    (1, embedding_dim) reference embedding.
+    """
+    try:
+        logger.debug("PREDICTION REQUEST")
+        images = [img1_bytes] if img2_bytes is None else [img1_bytes, img2_bytes]
         
-        magic1 = f"{img1_bytes[0]:02x}{img1_bytes[1]:02x}{img1_bytes[2]:02x}"
-        magic2 = f"{img2_bytes[0]:02x}{img2_bytes[1]:02x}{img2_bytes[2]:02x}"
+        with observe_stage("jpeg_validation"):
+            # Validate not empty
+            if not all(images):
+                raise HTTPException(status_code=400, detail="Empty file(s)")
+            
+            # Validate JPEG magic bytes (FF D8 FF)
+            if any(len(image) < 3 for image in images):
+                raise HTTPException(status_code=400, detail="Files too small")
+            
+            magics = [f"{image[0]:02x}{image[1]:02x}{image[2]:02x}" for image in images]
         
-        print(f"🔍 Magic bytes: {magic1}, {magic2}")
+        logger.debug("Magic bytes: %s", ', '.join(magics))
         
-        if not (magic1.startswith('ffd8ff') and magic2.startswith('ffd8ff')):
+        if not all(magic.startswith('ffd8ff') for magic in magics):
             return JSONResponse({
                 "error": "Invalid JPEG format",
-                "file1_magic": magic1,
-                "file2_magic": magic2,
+                **{f"file{i + 1}_magic": magic for i, magic in enumerate(magics)},
                 "similarity_score": 0,
                 "verified": False
             }, status_code=400)
         
         # Preprocess
-        print("🔧 Preprocessing...")
-        img1 = preprocess_image(img1_bytes)
-        img2 = preprocess_image(img2_bytes)
-        
-        # Add batch dimension
-        img1_batch = np.expand_dims(img1, axis=0)
-        img2_batch = np.expand_dims(img2, axis=0)
-        
-        print(f"📊 Input shapes: {img1_batch.shape}, {img2_batch.shape}")
+        logger.debug("Preprocessing...")
+        key1, img1 = await inference_executor.run(cached_preprocess, img1_bytes)
         
         # Predict
-        print("🤖 Predicting...")
-        prediction = model.predict([img1_batch, img2_batch], verbose=0)
-        similarity = float(prediction[0][0])
+        logger.debug("Predicting...")
+        if reference_embedding is not None:
+            embedding = await inference_executor.run(embed_with_cache, [img1], [key1])
+            similarity = float(score_embeddings(embedding, reference_embedding)[0, 0])
+        else:
+            key2, img2 = await inference_executor.run(cached_preprocess, img2_bytes)
+            if PREDICT_BATCHING:
+                similarity = await predict_batcher.submit((img1, img2, key1, key2))
+            else:
+                scores = await inference_executor.run(score_anchor_grid, [img1], [img2], [key1], [key2])
+                similarity = float(scores[0, 0])
         
-        print(f"✅ Similarity: {similarity:.6f}")
+        logger.debug("Similarity: %.6f", similarity)
         
         # Determine match
         threshold = 0.8
@@ -561,17 +3658,18 @@ async def predict(file1: UploadFile = File(...), file2: UploadFile = File(...)):
             "message": f"{'Match' if is_similar else 'No match'} (score: {similarity:.4f})"
         }
         
-        print(f"📤 Result: {result['decision']}")
-        print("="*60 + "\n")
+        logger.debug("Result: %s", result['decision'])
+        log_fields(similarity=round(similarity, 4), decision=result["decision"])
         
         return JSONResponse(result)
     
+    except HTTPException:
+        raise
     except ValueError as e:
-        print(f"❌ Validation error: {e}")
+        logger.warning("Validation error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"❌ Prediction error: {e}")
-        traceback.print_exc()
+        logger.error("Prediction error: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
     
 
@@ -580,7 +3678,10 @@ async def predict(file1: UploadFile = File(...), file2: UploadFile = File(...)):
 @app.post("/batch-verify")
 async def batch_verify(
     anchors: list[UploadFile] = File(...),
-    negatives: list[UploadFile] = File(...)
+    negatives: list[UploadFile] = File(...),
+    early_exit: bool = Form(False),
+    student_id: Optional[str] = Form(None),
+    session_id: Optional[str] = Form(None)
 ):
     """
     Batch verification: Compare multiple anchor images against multiple negative images
@@ -594,252 +3695,973 @@ async def batch_verify(
     Args:
         anchors: List of live capture images (2-10 images)
         negatives: List of enrolled reference images (15+ images)
+        early_exit: Score references sharpest-first and stop once the
+            verdict can no longer change (metrics cover the scored part)
+        student_id: Record the outcome in the attendance store for this student
+        session_id: Attendance session (default: today's date)
         
     Returns:
         JSON with verification decision and detailed metrics
     """
     
     # Check model status
-    if model_loading:
-        elapsed = time.time() - load_start_time if load_start_time else 0
+    ensure_model_ready()
+    if student_id is not None:
+        validate_student_id(student_id)
+    if session_id is not None:
+        validate_session_id(session_id)
+    
+    # Validate counts
+    if len(anchors) < 1:
+        raise HTTPException(status_code=400, detail="Need at least 1 anchor image")
+    if len(negatives) < 15:
+        raise HTTPException(status_code=400, detail=f"Need at least 15 negative images (got {len(negatives)})")
+    
+    logger.debug("Anchors: %s, Negatives: %s", len(anchors), len(negatives))
+    
+    # Decode and embed the (already spooled) uploads as one overlapping pipeline
+    pipeline = UploadPipeline(embed=embedding_model is not None and not early_exit, gate=("Anchor",))
+    
+    async def feed():
+        await pipeline.feed("Anchor", anchors)
+        await pipeline.feed("Negative", negatives, log_every=5)
+    
+    return await run_batch_verification(
+        pipeline, feed(), early_exit, student_id, session_id,
+        filenames=[anchor.filename for anchor in anchors]
+    )
+
+@app.post("/batch-verify/json")
+async def batch_verify_json(request: Request):
+    """
+    /batch-verify with base64 JSON instead of multipart uploads
+    
+    Body:
+        {"anchors": [base64, ...], "negatives": [base64, ...],
+         "reference_ids": [id, ...], "early_exit": false,
+         "student_id": "...", "session_id": "..."}
+    
+    reference_ids (enrolled reference IDs from /enroll, or SHA-256 keys
+    of cached images) stand in for negatives that would otherwise be
+    uploaded again; together with "negatives" there must be 15 or more.
+    Base64 may be a data: URL.
+    
+    Returns:
+        Same JSON as /batch-verify
+    """
+    ensure_model_ready()
+    payload = await read_json_body(request)
+    student_id = payload.get("student_id")
+    session_id = payload.get("session_id")
+    early_exit = bool(payload.get("early_exit", False))
+    reference_ids = payload.get("reference_ids") or []
+    if student_id is not None:
+        validate_student_id(str(student_id))
+    if session_id is not None:
+        validate_session_id(str(session_id))
+    if not isinstance(reference_ids, list):
+        raise HTTPException(status_code=400, detail="reference_ids must be a list")
+    
+    anchors = decode_base64_list(payload, "anchors")
+    negatives = decode_base64_list(payload, "negatives", required=False)
+    if len(anchors) < 1:
+        raise HTTPException(status_code=400, detail="Need at least 1 anchor image")
+    if len(negatives) + len(reference_ids) < 15:
         raise HTTPException(
-            status_code=503,
-            detail={
-                "error": "Model still loading",
-                "loading_time_seconds": round(elapsed, 1),
-                "message": "Please wait and check /health"
-            }
+            status_code=400,
+            detail=f"Need at least 15 negative images or reference IDs (got {len(negatives) + len(reference_ids)})"
         )
     
-    if model is None:
-        error_msg = f"Model failed: {model_error}" if model_error else "Model not loaded"
-        raise HTTPException(status_code=503, detail=error_msg)
+    references = None
+    if reference_ids:
+        if early_exit:
+            raise HTTPException(status_code=400, detail="early_exit needs uploaded negatives, not reference_ids")
+        ensure_gallery_ready()
+        references = await inference_executor.run(resolve_reference_embeddings, reference_ids)
+    
+    pipeline = UploadPipeline(embed=embedding_model is not None and not early_exit, gate=("Anchor",))
+    for data in anchors:
+        pipeline.add("Anchor", data, len(anchors))
+    for data in negatives:
+        pipeline.add("Negative", data, len(negatives), log_every=5)
+    
+    return await run_batch_verification(
+        pipeline, None, early_exit,
+        None if student_id is None else str(student_id),
+        None if session_id is None else str(session_id),
+        reference_embeddings=references
+    )
+
+async def run_batch_verification(pipeline, feeding, early_exit, student_id=None, session_id=None,
+                                 filenames=None, reference_embeddings=None):
+    """
+    Shared /batch-verify logic once the uploads are in the pipeline
     
+    Args:
+        pipeline: UploadPipeline with "Anchor" and "Negative" images
+        feeding: Awaitable that finishes feeding the pipeline (or None)
+        early_exit: Use sequential early-exit scoring
+        student_id, session_id: Record the outcome in the attendance store
+        filenames: Anchor file names for the attendance frames
+        reference_embeddings: Extra reference embeddings scored like negatives
+        
+    Returns:
+        JSONResponse with the verification result
+    """
     try:
-        print("\n" + "="*60)
-        print("🔍 BATCH VERIFICATION REQUEST (STRICT MODE)")
-        print("="*60)
-        
-        # Validate counts
-        if len(anchors) < 1:
-            raise HTTPException(status_code=400, detail="Need at least 1 anchor image")
-        if len(negatives) < 15:
-            raise HTTPException(status_code=400, detail=f"Need at least 15 negative images (got {len(negatives)})")
-        
-        print(f"📥 Anchors: {len(anchors)}, Negatives: {len(negatives)}")
-        
-        # Preprocess all anchor images
-        print("🔧 Preprocessing anchor images...")
-        anchor_arrays = []
-        for i, anchor in enumerate(anchors):
-            try:
-                img_bytes = await anchor.read()
-                img_array = preprocess_image(img_bytes)
-                anchor_arrays.append(img_array)
-                print(f"  ✅ Anchor {i+1}/{len(anchors)}")
-            except Exception as e:
-                print(f"  ⚠️ Anchor {i+1} failed: {e}")
-                continue
+        logger.debug("BATCH VERIFICATION REQUEST (STRICT MODE)")
+        if feeding is not None:
+            await feeding
+        processed = await pipeline.finish()
+        empty = {"arrays": [], "keys": [], "embeddings": None, "indices": [], "quality": None}
+        anchor_set = processed.get("Anchor", empty)
+        negative_set = processed.get("Negative", empty)
+        num_references = len(negative_set["arrays"]) + (
+            0 if reference_embeddings is None else len(reference_embeddings)
+        )
+        quality = anchor_set["quality"]
+        if quality is not None and filenames is not None:
+            for rejected in quality["rejected"]:
+                rejected["filename"] = filenames[rejected["index"]]
         
-        if len(anchor_arrays) == 0:
+        if len(anchor_set["arrays"]) == 0:
+            if quality is not None and quality["rejected"]:
+                raise no_usable_frames(quality)
             raise HTTPException(status_code=400, detail="No valid anchor images")
         
-        # Preprocess all negative images
-        print("🔧 Preprocessing negative images...")
-        negative_arrays = []
-        for i, negative in enumerate(negatives):
+        if num_references < 15:
+            raise HTTPException(
+                status_code=400, 
+                detail=f"Not enough valid negative images ({num_references}/15)"
+            )
+        
+        logger.debug("Preprocessed: %s anchors, %s negatives", len(anchor_set['arrays']), num_references)
+        
+        # === BATCH PREDICTION: All anchors vs All negatives ===
+        logger.debug("Running batch predictions...")
+        verifier = None
+        if early_exit:
+            verifier = await inference_executor.run(
+                sequential_verify, anchor_set["arrays"], negative_set["arrays"],
+                anchor_set["keys"], negative_set["keys"]
+            )
+            score_matrix = verifier.score_matrix()
+        elif anchor_set["embeddings"] is not None:
+            negative_embeddings = [e for e in (negative_set["embeddings"], reference_embeddings) if e is not None]
+            score_matrix = await inference_executor.run(
+                score_embeddings, anchor_set["embeddings"], np.concatenate(negative_embeddings)
+            )
+        else:
+            score_matrix = await inference_executor.run(
+                score_anchor_grid, anchor_set["arrays"], negative_set["arrays"]
+            )
+        logger.debug("Completed %s comparisons", score_matrix.size)
+        
+        result = build_verification_result(score_matrix)
+        result["comparisons_spent"] = int(score_matrix.size)
+        if verifier is not None:
+            result["early_exit"] = verifier.report()
+        if quality is not None:
+            result["quality_gate"] = quality
+        log_fields(
+            verified=result["verified"],
+            max_similarity=round(result["max_similarity"], 4),
+            anchors=result["anchors_processed"],
+            negatives=num_references,
+            comparisons=result["comparisons_spent"],
+            early_exit=early_exit,
+            frames_rejected=len(quality["rejected"]) if quality is not None else 0
+        )
+        if student_id is not None:
+            result["student_id"] = student_id
+            if filenames is not None:
+                filenames = [filenames[i] for i in anchor_set["indices"]]
+            record_attendance(
+                student_id, result, score_matrix, session_id, filenames=filenames, source="batch-verify"
+            )
+        
+        return JSONResponse(result)
+    
+    except HTTPException:
+        raise
+    except ValueError as e:
+        logger.warning("Validation error: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Batch verification error: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Batch verification failed: {str(e)}")
+    finally:
+        pipeline.cancel()
+
+STREAM_MAX_FRAMES = int(os.getenv("STREAM_MAX_FRAMES", "5"))
+STREAM_MAX_REFERENCES = int(os.getenv("STREAM_MAX_REFERENCES", "50"))
+# Frames a stream may send per requested frame (undecodable and gated frames count too)
+STREAM_FRAME_RETRY_FACTOR = int(os.getenv("STREAM_FRAME_RETRY_FACTOR", "2"))
+
+class StreamProtocolError(Exception):
+    """Client broke the /batch-verify/stream message protocol"""
+
+async def receive_stream_message(websocket):
+    """Next message as ("text", parsed JSON) or ("bytes", data)"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        return "bytes", message["bytes"]
+    try:
+        return "text", json.loads(message.get("text") or "")
+    except ValueError:
+        raise StreamProtocolError("Text messages must be JSON")
+
+@app.websocket("/batch-verify/stream")
+async def batch_verify_stream(websocket: WebSocket):
+    """
+    Incremental verification: frames are scored as they are captured
+    
+    Protocol (client -> server):
+        1. JSON {"student_id": "S001", "session_id": "...", "frames": 5,
+           "references": 0}. "frames" is the most frames that will be
+           sent; with "references": N the next N binary messages are
+           reference JPEGs, otherwise the student's enrolled gallery is used.
+        2. One binary message (JPEG) per captured frame. Frames that fail
+           to decode or are rejected by the quality gate don't count
+           toward "frames", but at most frames * STREAM_FRAME_RETRY_FACTOR
+           binary frames are accepted in total.
+        3. Optionally JSON {"type": "end"} to decide on the frames sent.
+    
+    Server -> client:
+        {"type": "ready", ...} once references are embedded, then one
+        {"type": "frame", ...} per frame with its median / max score and
+        the running aggregate (or its "rejected" reasons when the quality
+        gate drops it), and finally {"type": "verdict", ...} (the
+        /batch-verify result plus the stream report) as soon as the
+        decision can no longer change -- possibly before every frame was
+        sent. Errors arrive as {"type": "error", "detail": ...}.
+    """
+    await websocket.accept()
+    try:
+        ensure_gallery_ready()
+        kind, start = await receive_stream_message(websocket)
+        if kind != "text" or not isinstance(start, dict):
+            raise StreamProtocolError("First message must be the JSON start message")
+        student_id = start.get("student_id")
+        session_id = start.get("session_id")
+        max_frames = int(start.get("frames") or STREAM_MAX_FRAMES)
+        num_references = int(start.get("references") or 0)
+        if student_id is not None:
+            validate_student_id(str(student_id))
+        if session_id is not None:
+            validate_session_id(str(session_id))
+        if not 1 <= max_frames <= STREAM_MAX_FRAMES * 4:
+            raise StreamProtocolError(f"frames must be between 1 and {STREAM_MAX_FRAMES * 4}")
+        if not 0 <= num_references <= STREAM_MAX_REFERENCES:
+            raise StreamProtocolError(f"references must be between 0 and {STREAM_MAX_REFERENCES}")
+        
+        # References: uploaded up front, or the enrolled gallery
+        if num_references:
+            reference_bytes = []
+            while len(reference_bytes) < num_references:
+                kind, data = await receive_stream_message(websocket)
+                if kind != "bytes":
+                    raise StreamProtocolError(f"Expected {num_references} binary reference images")
+                reference_bytes.append(data)
+            reference_arrays, reference_keys = await inference_executor.run(
+                preprocess_uploads, reference_bytes, "Reference"
+            )
+            if len(reference_arrays) < BULK_MIN_REFERENCES:
+                raise StreamProtocolError(
+                    f"Not enough valid reference images ({len(reference_arrays)}/{BULK_MIN_REFERENCES})"
+                )
+            references = await inference_executor.run(embed_with_cache, reference_arrays, reference_keys)
+            source = "upload"
+        else:
+            if student_id is None:
+                raise StreamProtocolError("Send student_id (enrolled) or references")
+            entry = get_gallery_entry(str(student_id))
+            if len(entry["reference_ids"]) < MIN_GALLERY_REFERENCES:
+                raise StreamProtocolError(
+                    f"Not enough enrolled references ({len(entry['reference_ids'])}/{MIN_GALLERY_REFERENCES})"
+                )
+            references = entry["embeddings"]
+            source = "gallery"
+        
+        max_received = max_frames * max(1, STREAM_FRAME_RETRY_FACTOR)
+        await websocket.send_json({
+            "type": "ready",
+            "references": len(references),
+            "references_source": source,
+            "max_frames": max_frames,
+            "max_frames_received": max_received
+        })
+        
+        verifier = FrameStreamVerifier(max_frames, len(references))
+        filenames = []
+        frames_received = 0
+        settled = None
+        # Quality gate: assessments of decoded frames (upload index), signatures of usable ones
+        assessments, assessed_indices, usable_signatures = [], [], []
+        while verifier.frames_scored < max_frames:
+            if frames_received >= max_received:
+                raise StreamProtocolError(
+                    f"Received {frames_received} frames but only {verifier.frames_scored} were usable "
+                    f"(at most {max_received} frames per stream)"
+                )
+            kind, data = await receive_stream_message(websocket)
+            if kind == "text":
+                if isinstance(data, dict) and data.get("type") == "end":
+                    break
+                raise StreamProtocolError("Unexpected text message (send frames or {\"type\": \"end\"})")
+            frames_received += 1
             try:
-                img_bytes = await negative.read()
-                img_array = preprocess_image(img_bytes)
-                negative_arrays.append(img_array)
-                if (i + 1) % 5 == 0:
-                    print(f"  ✅ Negatives {i+1}/{len(negatives)}")
+                if QUALITY_GATE:
+                    key, array, assessment = await decode_executor.run(preprocess_and_assess, data)
+                else:
+                    key, array = await decode_executor.run(cached_preprocess, data)
+            except HTTPException:
+                raise
             except Exception as e:
-                print(f"  ⚠️ Negative {i+1} failed: {e}")
+                await websocket.send_json({"type": "frame", "index": frames_received, "error": str(e)})
                 continue
+            if QUALITY_GATE:
+                if not assessment["reasons"]:
+                    if quality_gate.is_near_duplicate(assessment["signature"], usable_signatures):
+                        assessment["reasons"].append("near_duplicate")
+                    usable_signatures.append(assessment["signature"])
+                assessments.append(assessment)
+                assessed_indices.append(frames_received - 1)
+                if assessment["reasons"]:
+                    await websocket.send_json({
+                        "type": "frame",
+                        "index": frames_received,
+                        "rejected": assessment["reasons"],
+                        "metrics": assessment["metrics"]
+                    })
+                    continue
+            embedding = await inference_executor.run(embed_with_cache, [array], [key])
+            scores = score_embeddings(embedding, references)[0]
+            verifier.add_frame(scores)
+            filenames.append(f"frame_{frames_received}")
+            settled = verifier.verdict()
+            all_scores = verifier.score_matrix()
+            await websocket.send_json({
+                "type": "frame",
+                "index": frames_received,
+                "median": float(np.median(scores)),
+                "max": float(scores.max()),
+                "frames_scored": verifier.frames_scored,
+                "overall_median": float(np.median(all_scores)),
+                "max_similarity": float(all_scores.max()),
+                "settled": settled is not None
+            })
+            if settled is not None:
+                break
         
-        if len(negative_arrays) < 15:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Not enough valid negative images ({len(negative_arrays)}/15)"
+        quality = quality_report(assessments, assessed_indices) if QUALITY_GATE else None
+        if verifier.frames_scored == 0:
+            if quality is not None and quality["rejected"]:
+                raise no_usable_frames(quality)
+            raise StreamProtocolError("No valid frames")
+        score_matrix = verifier.score_matrix()
+        result = build_verification_result(score_matrix)
+        result["comparisons_spent"] = int(score_matrix.size)
+        result["references_source"] = source
+        if quality is not None:
+            result["quality_gate"] = quality
+        result["stream"] = verifier.report()
+        result["stream"]["settled_early"] = settled is not None and verifier.frames_scored < max_frames
+        if student_id is not None:
+            result["student_id"] = str(student_id)
+            record_attendance(
+                str(student_id), result, score_matrix, session_id, filenames=filenames, source="stream"
             )
+        logger.info("stream verification", extra={"fields": {
+            "student_id": student_id,
+            "verified": result["verified"],
+            "frames_scored": verifier.frames_scored,
+            "frames_expected": max_frames,
+            "settled_early": result["stream"]["settled_early"]
+        }})
+        await websocket.send_json({"type": "verdict", **result})
+        await websocket.close()
+    
+    except WebSocketDisconnect:
+        logger.debug("Stream client disconnected")
+    except (StreamProtocolError, ValueError, TypeError) as e:
+        await websocket.send_json({"type": "error", "detail": str(e)})
+        await websocket.close(code=1008)
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "status_code": e.status_code, "detail": e.detail})
+        await websocket.close(code=1013 if e.status_code == 503 else 1008)
+    except Exception as e:
+        logger.error("Stream verification error: %s", e, exc_info=True)
+        await websocket.send_json({"type": "error", "detail": f"Stream verification failed: {str(e)}"})
+        await websocket.close(code=1011)
+
+@app.post("/enroll/{student_id}")
+async def enroll(
+    student_id: str,
+    references: list[UploadFile] = File(...),
+    append: bool = Form(False)
+):
+    """
+    Enroll a student's reference images into the server-side gallery
+    
+    Each reference is embedded once and stored, so later verifications
+    only need to upload the live anchor frames.
+    
+    Args:
+        student_id: Student identifier (gallery key)
+        references: Enrolled reference images
+        append: Add to the existing references instead of replacing them
+        
+    Returns:
+        JSON with the stored reference IDs
+    """
+    global gallery_version
+    validate_student_id(student_id)
+    ensure_gallery_ready()
+    
+    try:
+        logger.debug("ENROLLMENT: %s (%s references)", student_id, len(references))
         
-        print(f"✅ Preprocessed: {len(anchor_arrays)} anchors, {len(negative_arrays)} negatives")
+        reference_bytes = [await read_upload(reference) for reference in references]
+        reference_arrays, reference_keys = await inference_executor.run(
+            preprocess_uploads, reference_bytes, "Reference"
+        )
         
-        # === BATCH PREDICTION: All anchors vs All negatives ===
-        print("🤖 Running batch predictions...")
+        if len(reference_arrays) == 0:
+            raise HTTPException(status_code=400, detail="No valid reference images")
         
-        all_scores = []
-        per_anchor_max_scores = []  # Track best match for each anchor
-        total_comparisons = 0
+        space = embedding_space
+        embeddings = await inference_executor.run(embed_with_cache, reference_arrays, reference_keys)
+        reference_ids = [reference_id_for(key) for key in reference_keys]
+        references = reference_pixels(reference_arrays)
+        # None when the existing file kept no references
+        existing_references = stored_references(student_id) if append else None
+        now = time.time()
         
-        for i, anchor in enumerate(anchor_arrays):
-            anchor_batch = np.expand_dims(anchor, axis=0)
-            anchor_scores = []
-            
-            # Compare this anchor against all negatives
-            for j, negative in enumerate(negative_arrays):
-                negative_batch = np.expand_dims(negative, axis=0)
-                
-                # Predict similarity
-                prediction = model.predict([anchor_batch, negative_batch], verbose=0)
-                score = float(prediction[0][0])
-                all_scores.append(score)
-                anchor_scores.append(score)
-                total_comparisons += 1
-            
-            # Track the best score for this anchor
-            per_anchor_max_scores.append(max(anchor_scores))
-        
-        print(f"✅ Completed {total_comparisons} comparisons")
-        
-        # === CALCULATE METRICS ===
-        if len(all_scores) == 0:
-            raise HTTPException(status_code=500, detail="No predictions generated")
-        
-        all_scores_array = np.array(all_scores)
-        per_anchor_max_array = np.array(per_anchor_max_scores)
-        
-        max_similarity = float(np.max(all_scores_array))
-        avg_similarity = float(np.mean(all_scores_array))
-        min_similarity = float(np.min(all_scores_array))
-        std_similarity = float(np.std(all_scores_array))
-        
-        # === STRICT VERIFICATION LOGIC ===
-        
-        # Stricter thresholds
-        PRIMARY_THRESHOLD = 0.90    # Much higher threshold
-        SECONDARY_THRESHOLD = 0.85  # For consistency check
-        MIN_MATCH_RATIO = 0.3       # At least 30% of comparisons should be decent
-        
-        # 1. Count matches above thresholds
-        matches_above_primary = int(np.sum(all_scores_array >= PRIMARY_THRESHOLD))
-        matches_above_secondary = int(np.sum(all_scores_array >= SECONDARY_THRESHOLD))
-        
-        # 2. Check if MULTIPLE anchors match consistently (not just one outlier)
-        anchors_with_good_match = int(np.sum(per_anchor_max_array >= PRIMARY_THRESHOLD))
-        
-        # 3. Calculate match ratio (what % of comparisons are decent?)
-        match_ratio = matches_above_secondary / total_comparisons
-        
-        # 4. Statistical outlier detection: Is max score an outlier?
-        # If max score is more than 3 std deviations above mean, it's suspicious
-        z_score = (max_similarity - avg_similarity) / (std_similarity + 1e-10)
-        is_outlier = z_score > 3.0
-        
-        # 5. Distribution check: Good matches should be clustered, not isolated
-        top_5_percent_threshold = np.percentile(all_scores_array, 95)
-        
-        print(f"📊 Strict Analysis:")
-        print(f"  Max similarity: {max_similarity:.4f}")
-        print(f"  Avg similarity: {avg_similarity:.4f}")
-        print(f"  Std similarity: {std_similarity:.4f}")
-        print(f"  Matches ≥{PRIMARY_THRESHOLD}: {matches_above_primary}/{total_comparisons}")
-        print(f"  Matches ≥{SECONDARY_THRESHOLD}: {matches_above_secondary}/{total_comparisons}")
-        print(f"  Anchors with good match: {anchors_with_good_match}/{len(anchor_arrays)}")
-        print(f"  Match ratio: {match_ratio:.2%}")
-        print(f"  Z-score (outlier test): {z_score:.2f} {'⚠️ OUTLIER' if is_outlier else '✓'}")
-        print(f"  95th percentile: {top_5_percent_threshold:.4f}")
-        
-        # === VERIFICATION DECISION (STRICT) ===
-        verification_checks = {
-            "max_score_check": max_similarity >= PRIMARY_THRESHOLD,
-            "multiple_matches_check": matches_above_primary >= 2,  # At least 2 strong matches
-            "consistency_check": anchors_with_good_match >= max(1, len(anchor_arrays) // 2),  # At least half anchors match
-            "ratio_check": match_ratio >= MIN_MATCH_RATIO,
-            "not_outlier_check": not is_outlier,
-            "distribution_check": top_5_percent_threshold >= SECONDARY_THRESHOLD
-        }
+        with gallery_lock:
+            existing = enrollment_gallery.get(student_id)
+            if append and existing is not None and existing["embedding_space"] == space:
+                known = set(existing["reference_ids"])
+                keep = [i for i, ref_id in enumerate(reference_ids) if ref_id not in known]
+                entry = {
+                    "embeddings": np.concatenate([existing["embeddings"], embeddings[keep]]),
+                    "reference_ids": existing["reference_ids"] + [reference_ids[i] for i in keep],
+                    "enrolled_at": existing["enrolled_at"],
+                    "updated_at": now,
+                    "embedding_space": space
+                }
+                if existing_references is not None and len(existing_references) == len(existing["reference_ids"]):
+                    references = np.concatenate([existing_references, references[keep]])
+                else:
+                    references = None
+            else:
+                entry = {
+                    "embeddings": embeddings,
+                    "reference_ids": reference_ids,
+                    "enrolled_at": now,
+                    "updated_at": now,
+                    "embedding_space": space
+                }
+            enrollment_gallery[student_id] = entry
+            gallery_version += 1
         
-        # ALL checks must pass for verification
-        # verified = all(verification_checks.values())
+        save_gallery_entry(student_id, entry, references)
+        update_gallery_index(student_id, entry)
+        logger.debug("Enrolled %s: %s references", student_id, len(entry['reference_ids']))
+        log_fields(student_id=student_id, references_stored=len(entry["reference_ids"]))
+        
+        return JSONResponse({
+            "student_id": student_id,
+            "enrolled": True,
+            "references_received": len(references),
+            "references_stored": len(entry["reference_ids"]),
+            "reference_ids": entry["reference_ids"],
+            "ready_for_verification": len(entry["reference_ids"]) >= MIN_GALLERY_REFERENCES
+        })
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Enrollment error: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Enrollment failed: {str(e)}")
+
+@app.get("/enroll/{student_id}")
+def get_enrollment(student_id: str):
+    """Describe a student's stored references"""
+    validate_student_id(student_id)
+    entry = get_gallery_entry(student_id)
+    return {
+        "student_id": student_id,
+        "references_stored": len(entry["reference_ids"]),
+        "reference_ids": entry["reference_ids"],
+        "enrolled_at": entry["enrolled_at"],
+        "updated_at": entry["updated_at"],
+        "ready_for_verification": len(entry["reference_ids"]) >= MIN_GALLERY_REFERENCES
+    }
+
+@app.delete("/enroll/{student_id}")
+def delete_enrollment(student_id: str):
+    """Remove a student from the gallery"""
+    global gallery_version
+    validate_student_id(student_id)
+    with gallery_lock:
+        entry = enrollment_gallery.pop(student_id, None)
+        gallery_version += 1
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Student {student_id} is not enrolled")
+    update_gallery_index(student_id, None)
+    if os.path.exists(gallery_file(student_id)):
+        os.remove(gallery_file(student_id))
+    return {"student_id": student_id, "deleted": True}
+
+@app.post("/verify/{student_id}")
+async def verify_enrolled(
+    student_id: str,
+    anchors: list[UploadFile] = File(...),
+    session_id: Optional[str] = Form(None)
+):
+    """
+    Verify live anchor frames against a student's enrolled gallery
+    
+    Same strict decision logic as /batch-verify, but the references come
+    from the precomputed gallery embeddings instead of uploads.
+    
+    Args:
+        student_id: Enrolled student identifier
+        anchors: List of live capture images
+        session_id: Attendance session (default: today's date)
         
-        # Alternative: Require at least 5 out of 6 checks (more lenient)
-        verified = sum(verification_checks.values()) >= 
+    Returns:
+        JSON with verification decision and detailed metrics
+    """
+    validate_student_id(student_id)
+    if session_id is not None:
+        validate_session_id(session_id)
+    anchor_bytes = [await read_upload(anchor) for anchor in anchors]
+    return await verify_against_gallery(
+        student_id, anchor_bytes, session_id, filenames=[anchor.filename for anchor in anchors]
+    )
+
+@app.post("/verify/{student_id}/json")
+async def verify_enrolled_json(student_id: str, request: Request):
+    """
+    /verify/{student_id} with base64 JSON anchors
+    
+    Body: {"anchors": [base64, ...], "session_id": "..."}
+    """
+    validate_student_id(student_id)
+    payload = await read_json_body(request)
+    session_id = payload.get("session_id")
+    if session_id is not None:
+        validate_session_id(str(session_id))
+    anchor_bytes = decode_base64_list(payload, "anchors")
+    return await verify_against_gallery(
+        student_id, anchor_bytes, None if session_id is None else str(session_id)
+    )
+
+async def verify_against_gallery(student_id, anchor_bytes, session_id=None, filenames=None):
+    """Shared /verify/{student_id} logic for raw anchor image bytes"""
+    ensure_gallery_ready()
+    entry = get_gallery_entry(student_id)
+    
+    if len(entry["reference_ids"]) < MIN_GALLERY_REFERENCES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Not enough enrolled references ({len(entry['reference_ids'])}/{MIN_GALLERY_REFERENCES})"
+        )
+    
+    try:
+        logger.debug("GALLERY VERIFICATION: %s (%s anchors)", student_id, len(anchor_bytes))
         
-        print(f"\n🔒 Verification Checks:")
-        for check_name, passed in verification_checks.items():
-            status = "✅ PASS" if passed else "❌ FAIL"
-            print(f"  {status} - {check_name}")
+        anchor_arrays, anchor_keys = await inference_executor.run(
+            preprocess_uploads, anchor_bytes, "Anchor"
+        )
         
-        print(f"\n  Final Decision: {'✅ VERIFIED' if verified else '❌ REJECTED'}")
+        if len(anchor_arrays) == 0:
+            raise HTTPException(status_code=400, detail="No valid anchor images")
         
-        # Determine confidence level
-        if max_similarity >= 0.95 and verified:
-            confidence = "very_high"
-        elif max_similarity >= 0.90 and verified:
-            confidence = "high"
-        elif max_similarity >= 0.85:
-            confidence = "medium"
-        else:
-            confidence = "low"
-        
-        # Detailed reason for rejection
-        rejection_reasons = []
-        if not verified:
-            if not verification_checks["max_score_check"]:
-                rejection_reasons.append(f"Max score too low ({max_similarity:.4f} < {PRIMARY_THRESHOLD})")
-            if not verification_checks["multiple_matches_check"]:
-                rejection_reasons.append(f"Too few strong matches ({matches_above_primary} < 2)")
-            if not verification_checks["consistency_check"]:
-                rejection_reasons.append(f"Inconsistent anchor matches ({anchors_with_good_match}/{len(anchor_arrays)})")
-            if not verification_checks["ratio_check"]:
-                rejection_reasons.append(f"Low overall match ratio ({match_ratio:.1%} < {MIN_MATCH_RATIO:.0%})")
-            if not verification_checks["not_outlier_check"]:
-                rejection_reasons.append(f"Max score is outlier (z-score: {z_score:.2f})")
-            if not verification_checks["distribution_check"]:
-                rejection_reasons.append(f"Poor score distribution (95th percentile: {top_5_percent_threshold:.4f})")
+        quality = None
+        if QUALITY_GATE:
+            assessments = assess_frames(anchor_arrays)
+            # Indices are per decoded anchor; names only line up when every anchor decoded
+            names = filenames if filenames is not None and len(filenames) == len(anchor_arrays) else None
+            quality = quality_report(assessments, filenames=names)
+            keep = [i for i, assessment in enumerate(assessments) if not assessment["reasons"]]
+            if not keep:
+                raise no_usable_frames(quality)
+            anchor_arrays = [anchor_arrays[i] for i in keep]
+            anchor_keys = [anchor_keys[i] for i in keep]
+            filenames = [names[i] for i in keep] if names is not None else None
         
-        result = {
-            "verified": verified,
-            "confidence": max_similarity,
-            "max_similarity": max_similarity,
-            "avg_similarity": avg_similarity,
-            "min_similarity": min_similarity,
-            "std_similarity": std_similarity,
-            "z_score": z_score,
-            "is_outlier": is_outlier,
-            "match_count_primary": matches_above_primary,
-            "match_count_secondary": matches_above_secondary,
-            "match_ratio": match_ratio,
-            "anchors_with_good_match": anchors_with_good_match,
-            "total_comparisons": total_comparisons,
-            "primary_threshold": PRIMARY_THRESHOLD,
-            "secondary_threshold": SECONDARY_THRESHOLD,
-            "confidence_level": confidence,
-            "anchors_processed": len(anchor_arrays),
-            "negatives_processed": len(negative_arrays),
-            "verification_checks": verification_checks,
-            "rejection_reasons": rejection_reasons,
-            "message": f"{'Verification successful' if verified else 'Verification failed: ' + '; '.join(rejection_reasons)}",
-            "all_scores_summary": {
-                "percentile_95": float(np.percentile(all_scores_array, 95)),
-                "percentile_75": float(np.percentile(all_scores_array, 75)),
-                "percentile_50": float(np.percentile(all_scores_array, 50)),
-                "percentile_25": float(np.percentile(all_scores_array, 25))
-            },
-            "per_anchor_max_scores": [float(s) for s in per_anchor_max_scores]
-        }
+        anchor_embeddings = await inference_executor.run(embed_with_cache, anchor_arrays, anchor_keys)
+        score_matrix = score_embeddings(anchor_embeddings, entry["embeddings"])
+        logger.debug("Completed %s comparisons", score_matrix.size)
         
-        print("="*60 + "\n")
+        result = build_verification_result(score_matrix)
+        result["student_id"] = student_id
+        if quality is not None:
+            result["quality_gate"] = quality
+        log_fields(
+            student_id=student_id,
+            verified=result["verified"],
+            max_similarity=round(result["max_similarity"], 4),
+            anchors=result["anchors_processed"],
+            frames_rejected=len(quality["rejected"]) if quality is not None else 0
+        )
+        record_attendance(student_id, result, score_matrix, session_id, filenames=filenames)
         
         return JSONResponse(result)
     
+    except HTTPException:
+        raise
     except ValueError as e:
-        print(f"❌ Validation error: {e}")
+        logger.warning("Validation error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"❌ Batch verification error: {e}")
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Batch verification failed: {str(e)}")
+        logger.error("Gallery verification error: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Gallery verification failed: {str(e)}")
+    
+
+@app.post("/sessions/{session_id}/verify")
+async def verify_session(session_id: str, request: Request):
+    """
+    Verify a whole session's students in one request
+    
+    Body, either:
+    - multipart/form-data with image files in fields named
+      "frames.<student_id>" (live captures) and optionally
+      "references.<student_id>" (15+ reference images; without them the
+      student's enrolled gallery is used)
+    - application/x-ndjson, one JSON object per line:
+      {"student_id": "S001", "frames": [base64 JPEG, ...], "references": [...]}
+      The body is processed as it streams in (a multipart body is
+      received in full before processing starts).
+    
+    All frames are decoded and embedded in large shared batches; each
+    student is then scored against their own references. Verdicts are
+    recorded in the attendance store under this session.
+    
+    Returns:
+        JSON with one /batch-verify-shaped result per student
+    """
+    validate_session_id(session_id)
+    ensure_gallery_ready()
+    content_type = request.headers.get("content-type", "")
+    
+    session = BulkSession()
+    try:
+        if content_type.startswith("multipart/form-data"):
+            await session.read_multipart(request)
+        elif content_type.startswith(("application/x-ndjson", "application/jsonl")):
+            await session.read_ndjson(request)
+        else:
+            raise HTTPException(status_code=415, detail="Send multipart/form-data or application/x-ndjson")
+        if not session.students:
+            raise HTTPException(status_code=400, detail="No student entries in the request")
+        
+        logger.debug("SESSION %s: %s students, %s images", session_id, len(session.students), session.images)
+        processed = await session.pipeline.finish()
+        scored = await inference_executor.run(score_bulk_session, session.students, processed)
+        
+        results = []
+        for item in scored:
+            if isinstance(item, dict):
+                results.append(item)
+                continue
+            result, score_matrix, filenames = item
+            results.append(result)
+            record_attendance(
+                result["student_id"], result, score_matrix, session_id, filenames=filenames, source="session"
+            )
+        
+        failed_images = sum(
+            1 for items in session.pipeline.items.values() for item in items if item["error"] is not None
+        )
+        verified = sum(1 for result in results if result["verified"])
+        log_fields(
+            session_id=session_id,
+            students=len(results),
+            verified=verified,
+            images=session.images,
+            failed_images=failed_images
+        )
+        return JSONResponse({
+            "session_id": session_id,
+            "students_processed": len(results),
+            "students_verified": verified,
+            "students_with_errors": sum(1 for result in results if "error" in result),
+            "images_received": session.images,
+            "images_failed": failed_images,
+            "results": results
+        })
+    
+    except HTTPException:
+        session.pipeline.cancel()
+        raise
+    except Exception as e:
+        session.pipeline.cancel()
+        logger.error("Session verification error: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Session verification failed: {str(e)}")
+
+@app.put("/rosters/{roster_id}")
+def put_roster(roster_id: str, student_ids: list[str] = Body(..., embed=True)):
+    """
+    Create or replace a class roster (the student IDs to identify against)
+    
+    Body: {"student_ids": ["S001", "S002", ...]}
+    """
+    global gallery_version
+    validate_roster_id(roster_id)
+    for student_id in student_ids:
+        validate_student_id(student_id)
+    roster = {"student_ids": list(dict.fromkeys(student_ids)), "updated_at": time.time()}
+    with gallery_lock:
+        rosters[roster_id] = roster
+        gallery_version += 1
+        enrolled = [sid for sid in roster["student_ids"] if sid in enrollment_gallery]
+    save_roster(roster_id, roster)
+    return {
+        "roster_id": roster_id,
+        "students": len(roster["student_ids"]),
+        "enrolled_students": len(enrolled),
+        "missing_students": [sid for sid in roster["student_ids"] if sid not in set(enrolled)]
+    }
+
+@app.get("/rosters/{roster_id}")
+def get_roster(roster_id: str):
+    """Describe a roster and which of its students are enrolled"""
+    validate_roster_id(roster_id)
+    with gallery_lock:
+        roster = rosters.get(roster_id)
+        if roster is None:
+            raise HTTPException(status_code=404, detail=f"Roster {roster_id} not found")
+        enrolled = {sid for sid in roster["student_ids"] if sid in enrollment_gallery}
+    return {
+        "roster_id": roster_id,
+        "student_ids": roster["student_ids"],
+        "enrolled_students": len(enrolled),
+        "missing_students": [sid for sid in roster["student_ids"] if sid not in enrolled],
+        "updated_at": roster["updated_at"]
+    }
+
+@app.delete("/rosters/{roster_id}")
+def delete_roster(roster_id: str):
+    """Remove a roster"""
+    validate_roster_id(roster_id)
+    with gallery_lock:
+        roster = rosters.pop(roster_id, None)
+        roster_matrices.pop(roster_id, None)
+    if roster is None:
+        raise HTTPException(status_code=404, detail=f"Roster {roster_id} not found")
+    if os.path.exists(roster_file(roster_id)):
+        os.remove(roster_file(roster_id))
+    return {"roster_id": roster_id, "deleted": True}
+
+@app.post("/identify")
+async def identify_campus(
+    anchors: list[UploadFile] = File(...),
+    top_k: int = Form(IDENTIFY_TOP_K)
+):
+    """
+    Campus-wide 1:N identification across the whole gallery
+    
+    Uses the approximate (IVF-PQ) gallery index with exact head re-ranking
+    instead of scoring every enrolled reference.
+    
+    Args:
+        anchors: List of live capture images
+        top_k: Number of candidates to return
+        
+    Returns:
+        JSON with the top-k candidates and the identified student (if any)
+    """
+    ensure_gallery_ready()
+    
+    try:
+        logger.debug("CAMPUS IDENTIFICATION (%s anchors)", len(anchors))
+        
+        anchor_bytes = [await read_upload(anchor) for anchor in anchors]
+        anchor_arrays, anchor_keys = await inference_executor.run(
+            preprocess_uploads, anchor_bytes, "Anchor"
+        )
+        
+        if len(anchor_arrays) == 0:
+            raise HTTPException(status_code=400, detail="No valid anchor images")
+        
+        index, candidates = await inference_executor.run(
+            identify_in_gallery, anchor_arrays, anchor_keys, top_k
+        )
+        top = candidates[0]
+        identified = top["score"] >= PRIMARY_THRESHOLD
+        log_fields(
+            identified=identified,
+            student_id=top["student_id"] if identified else None,
+            top_score=round(top["score"], 4)
+        )
+        logger.debug("Searched %s references (%s); top: %s (%.4f)", len(index),
+                     'ANN' if index.is_trained else 'exact', top['student_id'], top['score'])
+        
+        return JSONResponse({
+            "identified": identified,
+            "student_id": top["student_id"] if identified else None,
+            "threshold": PRIMARY_THRESHOLD,
+            "candidates": candidates,
+            "search": "ann" if index.is_trained else "exact",
+            "references_indexed": len(index),
+            "anchors_processed": len(anchor_arrays)
+        })
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Identification error: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Identification failed: {str(e)}")
+
+@app.post("/identify/{roster_id}")
+async def identify(
+    roster_id: str,
+    anchors: list[UploadFile] = File(...),
+    top_k: int = Form(IDENTIFY_TOP_K)
+):
+    """
+    1:N identification: rank a roster's enrolled students for live frames
+    
+    All reference embeddings of the roster are scored in one vectorized
+    pass of the L1-distance head. A student's score is the best reference
+    score per anchor, averaged over the anchors.
+    
+    Args:
+        roster_id: Class/session roster to search
+        anchors: List of live capture images
+        top_k: Number of candidates to return
+        
+    Returns:
+        JSON with the top-k candidates and the identified student (if any)
+    """
+    validate_roster_id(roster_id)
+    ensure_gallery_ready()
+    log_fields(roster_id=roster_id)
+    
+    try:
+        logger.debug("IDENTIFICATION: roster %s (%s anchors)", roster_id, len(anchors))
+        
+        anchor_bytes = [await read_upload(anchor) for anchor in anchors]
+        anchor_arrays, anchor_keys = await inference_executor.run(
+            preprocess_uploads, anchor_bytes, "Anchor"
+        )
+        
+        if len(anchor_arrays) == 0:
+            raise HTTPException(status_code=400, detail="No valid anchor images")
+        
+        matrix, candidates = await inference_executor.run(
+            identify_in_roster, roster_id, anchor_arrays, anchor_keys, top_k
+        )
+        top = candidates[0]
+        identified = top["score"] >= PRIMARY_THRESHOLD
+        log_fields(
+            identified=identified,
+            student_id=top["student_id"] if identified else None,
+            top_score=round(top["score"], 4)
+        )
+        logger.debug("Scored %s students (%s references); top: %s (%.4f)", len(matrix.student_ids),
+                     len(matrix.embeddings), top['student_id'], top['score'])
+        
+        return JSONResponse({
+            "roster_id": roster_id,
+            "identified": identified,
+            "student_id": top["student_id"] if identified else None,
+            "threshold": PRIMARY_THRESHOLD,
+            "candidates": candidates,
+            "students_scored": len(matrix.student_ids),
+            "anchors_processed": len(anchor_arrays),
+            "total_comparisons": int(len(anchor_arrays) * len(matrix.embeddings))
+        })
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Identification error: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Identification failed: {str(e)}")
+
+@app.get("/attendance/sessions/{session_id}")
+def attendance_session(session_id: str):
+    """Per-student attendance summary of one session"""
+    validate_session_id(session_id)
+    return ensure_attendance_store().session_report(session_id)
+
+@app.get("/attendance/students/{student_id}")
+def attendance_student(
+    student_id: str,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 50
+):
+    """
+    Attendance history of one student
+    
+    Args:
+        student_id: Student identifier
+        since, until: Optional unix-time bounds
+        limit: Number of most recent scans returned in full (max 1000)
+    """
+    validate_student_id(student_id)
+    return ensure_attendance_store().student_report(student_id, since, until, min(max(1, limit), 1000))
+
+@app.get("/attendance/scans")
+def attendance_scans(
+    student_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 100,
+    frames: bool = False
+):
+    """Most recent scans matching the filters, newest first (max 1000)"""
+    scans = ensure_attendance_store().scans(
+        student_id, session_id, since, until, min(max(1, limit), 1000), frames
+    )
+    return {"count": len(scans), "scans": scans}
+
+@app.post("/attendance/import")
+async def attendance_import(
+    attendance_csv: Optional[UploadFile] = File(None),
+    scan_history: Optional[UploadFile] = File(None),
+    session_id: Optional[str] = Form(None)
+):
+    """
+    Import the legacy class_attendance.csv / scan_history.txt logs
+    
+    Rows are merged on (student ID, timestamp), so re-importing the same
+    files does not duplicate scans.
+    """
+    store = ensure_attendance_store()
+    if attendance_csv is None and scan_history is None:
+        raise HTTPException(status_code=400, detail="Upload attendance_csv and/or scan_history")
+    if session_id is not None:
+        validate_session_id(session_id)
     
+    csv_text = (await read_upload(attendance_csv)).decode("utf-8-sig") if attendance_csv else None
+    history_text = (await read_upload(scan_history)).decode("utf-8-sig") if scan_history else None
+    try:
+        counts = await asyncio.get_running_loop().run_in_executor(
+            None, import_legacy, store, csv_text, history_text, session_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse legacy log: {e}")
+    log_fields(**counts)
+    return {"imported": True, **counts}
 
 @app.get("/test")
-def test_endpoint():
-    """Self-test endpoint"""
+async def test_endpoint():
+    """Self-test endpoint (queued as background work behind real traffic)"""
     if model is None:
         return {"error": "Model not loaded"}
-    
+    return await inference_executor.run(run_self_test)
+
+def run_self_test():
+    """Score a synthetic image against itself and report parity checks"""
     try:
         # Create test image
         test_img = np.ones((100, 100, 3), dtype=np.uint8) * 128
@@ -858,7 +4680,26 @@ def test_endpoint():
             "self_similarity_score": score,
             "expected": "> 0.9",
             "passed": score > 0.7,
-            "note": "Identical images should score > 0.9"
+            "note": "Identical images should score > 0.9",
+            "preprocessing_backend": PREPROCESS_BACKEND,
+            "preprocess_parity": check_preprocess_parity(),
+            "quantized_parity": quantized_parity
         }
     except Exception as e:
-        return {"error": str(e), "traceback": traceback.format_exc()}
\ No newline at end of file
+        return {"error": str(e), "traceback": traceback.format_exc()}
+
+# ================================
+# ENTRY POINT
+# ================================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EduFace Siamese API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "7860")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("PREFORK_WORKERS", "1")))
+    args = parser.parse_args()
+    
+    if args.workers > 1:
+        serve_prefork(args.workers, args.host, args.port)
+    else:
+        import uvicorn
+        uvicorn.run(app, host=args.host, port=args.port, timeout_keep_alive=300)
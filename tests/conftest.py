@@ -0,0 +1,85 @@
+"""
+Shared fixtures: siamese_api with a random-weight model in a scratch directory
+
+The model is built by benchmarks/api_benchmark.py (make_siamese_model with
+random weights, loaded through load_siamese_model), so scores are
+meaningless but every shape and code path is the serving one. Requests go
+straight into the ASGI app.
+"""
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+
+from api_benchmark import asgi_request, load_api, multipart, sample_images  # noqa: E402
+
+@pytest.fixture(scope="session")
+def api(tmp_path_factory):
+    """siamese_api with a random-weight model; cwd is a scratch dir for its artifacts"""
+    cwd = os.getcwd()
+    module = load_api(str(tmp_path_factory.mktemp("api")), seed=0)
+    yield module
+    if module.attendance_store is not None:
+        module.attendance_store.close()
+    os.chdir(cwd)
+
+@pytest.fixture(scope="session")
+def images():
+    """Distinct JPEGs (the repo's input_images, plus noisy re-encodes beyond those)"""
+    return sample_images(400)
+
+def call(api, method, path, fields=None, body=b"", content_type=None):
+    """
+    One request through the ASGI app
+    
+    Returns:
+        tuple: (status, parsed JSON body)
+    """
+    if fields is not None:
+        body, content_type = multipart(fields)
+    status, data = asyncio.run(asgi_request(api.app, method, path, body, content_type))
+    return status, json.loads(data) if data else None
+
+async def stream(api, start, frames, end=True):
+    """
+    Drive /batch-verify/stream: the start message, binary frames, then {"type": "end"}
+    
+    `frames` items are bytes (binary frames), dicts (JSON text messages) or
+    str (raw text messages).
+    
+    Returns:
+        list: every JSON message the server sent before closing
+    """
+    inbox, outbox = asyncio.Queue(), asyncio.Queue()
+    scope = {
+        "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "path": "/batch-verify/stream",
+        "raw_path": b"/batch-verify/stream", "query_string": b"", "root_path": "", "headers": [],
+        "subprotocols": [], "client": ("127.0.0.1", 0), "server": ("test", 80)
+    }
+    task = asyncio.ensure_future(api.app(scope, inbox.get, outbox.put))
+    await inbox.put({"type": "websocket.connect"})
+    assert (await outbox.get())["type"] == "websocket.accept"
+    await inbox.put({"type": "websocket.receive", "text": json.dumps(start)})
+    for data in frames:
+        if isinstance(data, dict):
+            await inbox.put({"type": "websocket.receive", "text": json.dumps(data)})
+        elif isinstance(data, str):
+            await inbox.put({"type": "websocket.receive", "text": data})
+        else:
+            await inbox.put({"type": "websocket.receive", "bytes": data})
+    if end:
+        await inbox.put({"type": "websocket.receive", "text": json.dumps({"type": "end"})})
+    messages = []
+    while True:
+        message = await outbox.get()
+        if message["type"] == "websocket.close":
+            break
+        messages.append(json.loads(message["text"]))
+    await task
+    return messages
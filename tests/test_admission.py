@@ -0,0 +1,103 @@
+"""Priority admission and deadline-aware shedding (InferenceExecutor)"""
+import asyncio
+import time
+
+from conftest import asgi_request
+
+def job(tag, seconds=0.05, order=None):
+    time.sleep(seconds)
+    if order is not None:
+        order.append(tag)
+    return tag
+
+async def submit(api, executor, tag, request_class="interactive", session="-", budget=None,
+                 seconds=0.05, order=None, headers=None):
+    """Run `job` under an admission; returns its tag or the 503 error name"""
+    deadline = time.monotonic() + budget if budget else None
+    token = api.admission_context.set(api.Admission(request_class, session, deadline))
+    try:
+        return await executor.run(job, tag, seconds, order)
+    except api.HTTPException as e:
+        assert e.status_code == 503
+        if headers is not None:
+            headers.append(e.headers)
+        return e.detail["error"]
+    finally:
+        api.admission_context.reset(token)
+
+def test_higher_class_evicts_and_sessions_take_turns(api):
+    # 1 worker + 4 queued
+    executor = api.InferenceExecutor(1, 4, name="test-evict")
+    order = []
+
+    async def scenario():
+        tasks = [asyncio.create_task(submit(api, executor, "blocker", seconds=0.1, order=order))]
+        await asyncio.sleep(0.02)
+        for tag, request_class, session in [("bg1", "background", "x"), ("bulkA1", "bulk", "A"),
+                                            ("bulkA2", "bulk", "A"), ("bulkB1", "bulk", "B")]:
+            tasks.append(asyncio.create_task(submit(api, executor, tag, request_class, session, order=order)))
+        await asyncio.sleep(0.01)
+        # Full: a critical job evicts the queued background one...
+        tasks.append(asyncio.create_task(submit(api, executor, "crit", "critical", "z", order=order)))
+        await asyncio.sleep(0.01)
+        # ...and another background job finds nothing lower to evict
+        tasks.append(asyncio.create_task(submit(api, executor, "bg2", "background", "x", order=order)))
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(scenario())
+    assert results == ["blocker", "Inference queue full", "bulkA1", "bulkA2", "bulkB1", "crit",
+                       "Inference queue full"]
+    assert order == ["blocker", "crit", "bulkA1", "bulkB1", "bulkA2"]
+    stats = executor.stats()
+    assert stats["rejected"] == 1
+    assert stats["shed"] == {"background:evicted": 1, "background:queue_full": 1}
+    assert stats["outstanding"] == 0
+
+def test_deadlines_refuse_and_expire_jobs(api):
+    executor = api.InferenceExecutor(1, 4, name="test-deadline")
+    headers = []
+
+    async def scenario():
+        # Teach the executor that `job` takes ~50 ms
+        assert await submit(api, executor, "warm") == "warm"
+        while "job" not in executor.service_time:
+            await asyncio.sleep(0.001)
+        refused = await submit(api, executor, "tight", budget=0.02, headers=headers)
+
+        # Admitted behind a job expected to finish soon, but that one runs long
+        long_job = asyncio.create_task(submit(api, executor, "long", seconds=0.3))
+        await asyncio.sleep(0.01)
+        late = asyncio.create_task(submit(api, executor, "late", budget=0.15, headers=headers))
+        return refused, await long_job, await late
+
+    refused, long_result, late = asyncio.run(scenario())
+    assert refused == "Deadline cannot be met"
+    assert long_result == "long"
+    assert late == "Deadline exceeded"
+    assert executor.stats()["shed"] == {"interactive:deadline": 1, "interactive:expired": 1}
+    # Both sheds tell the client when to come back
+    assert [h["Retry-After"] for h in headers] == ["1", "1"]
+
+def test_wait_is_reported_per_session_queue(api):
+    executor = api.InferenceExecutor(1, 8, name="test-sessions")
+
+    async def scenario():
+        tasks = [asyncio.create_task(submit(api, executor, "blocker", seconds=0.1))]
+        await asyncio.sleep(0.02)
+        for tag, session in [("a1", "A"), ("a2", "A"), ("b1", "B")]:
+            tasks.append(asyncio.create_task(submit(api, executor, tag, "bulk", session)))
+        await asyncio.sleep(0.03)
+        queues = executor.stats()["session_queues"]
+        await asyncio.gather(*tasks)
+        return queues
+
+    queues = asyncio.run(scenario())
+    assert sorted((q["request_class"], q["session"], q["queued"]) for q in queues) == [
+        ("bulk", "A", 2), ("bulk", "B", 1)
+    ]
+    assert all(q["oldest_wait_ms"] >= 20 for q in queues)
+    assert executor.stats()["session_queues"] == []
+
+    status, body = asyncio.run(asgi_request(api.app, "GET", "/metrics"))
+    assert status == 200
+    assert b"# TYPE eduface_executor_session_oldest_wait_seconds gauge" in body
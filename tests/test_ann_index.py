@@ -0,0 +1,82 @@
+"""IVF-PQ gallery index (ann_index.IVFPQIndex)"""
+import numpy as np
+import pytest
+
+from ann_index import IVFPQIndex
+
+DIM = 64
+
+def head(seed=0):
+    rng = np.random.default_rng(seed)
+    return -rng.uniform(0.5, 1.5, DIM).astype(np.float32), np.float32(4.0)
+
+def clustered(rng, count, clusters=32):
+    centers = rng.random((clusters, DIM), dtype=np.float32)
+    return centers[rng.integers(clusters, size=count)] + rng.normal(0, 0.05, (count, DIM)).astype(np.float32)
+
+@pytest.fixture(scope="module")
+def trained():
+    rng = np.random.default_rng(0)
+    vectors = clustered(rng, 3000)
+    index = IVFPQIndex(*head(), num_lists=16, num_subspaces=16, num_centroids=64, nprobe=4, rerank=64)
+    index.add(range(len(vectors)), vectors)
+    index.train(vectors)
+    return index, vectors
+
+def test_untrained_search_is_exact():
+    rng = np.random.default_rng(1)
+    vectors = rng.random((200, DIM), dtype=np.float32)
+    kernel, bias = head()
+    index = IVFPQIndex(kernel, bias, num_lists=4, num_subspaces=16, num_centroids=16)
+    index.add([f"v{i}" for i in range(len(vectors))], vectors)
+    assert not index.is_trained
+
+    query = vectors[17] + 0.01
+    results = index.search(query, k=5)
+    logits = np.abs(vectors - query) @ kernel + bias
+    expected = np.argsort(-logits, kind="stable")[:5]
+    assert [label for label, _ in results] == [f"v{i}" for i in expected]
+    np.testing.assert_allclose([score for _, score in results], 1 / (1 + np.exp(-logits[expected])), rtol=1e-5)
+
+def test_trained_search_recalls_the_exact_neighbours(trained):
+    index, vectors = trained
+    assert index.is_trained
+    rng = np.random.default_rng(2)
+    queries = rng.choice(len(vectors), 100, replace=False)
+    recall = 0
+    for i in queries:
+        query = vectors[i] + rng.normal(0, 0.01, DIM).astype(np.float32)
+        approx = [label for label, _ in index.search(query, k=10)]
+        exact = [label for label, _ in index.search(query, k=10, exact=True)]
+        assert approx[0] == exact[0] == i
+        recall += len(set(approx) & set(exact))
+    assert recall / (10 * len(queries)) >= 0.9
+
+def test_add_replace_and_remove(trained):
+    index, vectors = trained
+    size = len(index)
+    moved = vectors[5] + 0.5
+    index.add(["moved"], [moved])
+    assert len(index) == size + 1
+    assert index.search(moved, k=1)[0][0] == "moved"
+
+    # Re-adding a label replaces its vector
+    index.add(["moved"], [vectors[5]])
+    assert len(index) == size + 1
+    labels, stored = index.vectors()
+    np.testing.assert_array_equal(stored[labels.index("moved")], vectors[5])
+
+    assert index.remove(["moved", "unknown"]) == 1
+    assert "moved" not in index and len(index) == size
+    free_slot = index._free[-1]
+    index.add(["reused"], [moved])
+    assert index._slots["reused"] == free_slot
+    assert index.remove(["reused"]) == 1
+    assert all(label not in ("moved", "reused") for label, _ in index.search(moved, k=20))
+
+def test_training_needs_enough_vectors():
+    index = IVFPQIndex(*head(), num_lists=16, num_subspaces=16, num_centroids=64)
+    with pytest.raises(ValueError, match="at least 64"):
+        index.train(np.zeros((10, DIM), np.float32))
+    with pytest.raises(ValueError, match="not divisible"):
+        IVFPQIndex(*head(), num_subspaces=10)
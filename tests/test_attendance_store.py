@@ -0,0 +1,106 @@
+"""SQLite attendance store: batched writer, reports and legacy import"""
+import os
+import threading
+
+import pytest
+
+from attendance_store import AttendanceStore, import_legacy
+from conftest import REPO_DIR
+
+@pytest.fixture
+def store(tmp_path):
+    store = AttendanceStore(str(tmp_path / "attendance.db"), batch_size=256, flush_interval=0.05)
+    yield store
+    store.close()
+
+def scan(student_id, verified, session="lecture-1", timestamp=1_700_000_000.0, **extra):
+    return {"student_id": student_id, "status": "PRESENT" if verified else "ABSENT", "verified": verified,
+            "confidence": 0.95 if verified else 0.2, "session_id": session, "timestamp": timestamp, **extra}
+
+def test_writer_batches_queued_scans(store):
+    for i in range(600):
+        assert store.record(scan(f"S{i % 30:02d}", verified=i % 3 != 0, timestamp=1_700_000_000.0 + i))
+    store.flush()
+    stats = store.stats()
+    assert stats["written"] == 600 and stats["approx_scans"] == 600
+    assert 3 <= stats["batches"] < 600
+    assert stats["dropped"] == stats["failed"] == stats["queued"] == 0
+
+    report = store.session_report("lecture-1")
+    assert report["students_seen"] == 30 and report["scans"] == 600
+    # S00, S03, ... only ever had i % 3 == 0 scans
+    absent = {s["student_id"] for s in report["students"] if not s["present"]}
+    assert absent == {f"S{i:02d}" for i in range(0, 30, 3)}
+    assert report["students_present"] == 20
+
+def test_reports_and_frames(store):
+    frames = [{"frame_index": i, "filename": f"f{i}.jpg", "num_scores": 15, "median": 0.9, "max": 0.95}
+              for i in range(3)]
+    store.record(scan("S1", True, "lecture-1", 1_700_000_000.0, student_name="Ada", frames=frames,
+                      details={"summary": "ok"}))
+    store.record(scan("S1", False, "lecture-2", 1_700_090_000.0))
+    store.record(scan("S2", False, "lecture-2", 1_700_090_001.0))
+    store.flush()
+
+    report = store.student_report("S1")
+    assert report["student_name"] == "Ada"
+    assert report["scans"] == 2 and report["sessions_seen"] == 2 and report["sessions_present"] == 1
+    assert [s["session_id"] for s in report["sessions"]] == ["lecture-2", "lecture-1"]
+    assert store.student_report("S1", since=1_700_050_000.0)["scans"] == 1
+
+    latest, first = store.scans(student_id="S1", frames=True)
+    assert latest["frames"] == [] and latest["num_frames"] is None
+    assert first["num_frames"] == 3 and first["details"] == {"summary": "ok"}
+    assert [f["filename"] for f in first["frames"]] == ["f0.jpg", "f1.jpg", "f2.jpg"]
+    assert store.session_report("lecture-2")["students_present"] == 0
+
+def test_full_queue_drops_scans(tmp_path, monkeypatch):
+    store = AttendanceStore(str(tmp_path / "full.db"), batch_size=1, flush_interval=0.05, max_queued=2)
+    release = threading.Event()
+    insert_scans = store.insert_scans
+    monkeypatch.setattr(store, "insert_scans", lambda scans: release.wait() and insert_scans(scans))
+    try:
+        accepted = sum(store.record(scan(f"S{i}", True)) for i in range(10))
+        # One batch of one held by the writer plus two queued
+        assert accepted <= 3
+        assert store.stats()["dropped"] == 10 - accepted
+    finally:
+        release.set()
+        store.flush()
+    assert store.stats()["written"] == accepted
+    store.close()
+
+def test_failed_batches_are_counted_and_writing_continues(store, monkeypatch):
+    insert_scans = store.insert_scans
+    failures = [True]
+
+    def flaky(scans):
+        if failures and failures.pop():
+            raise RuntimeError("disk full")
+        return insert_scans(scans)
+
+    monkeypatch.setattr(store, "insert_scans", flaky)
+    store.record(scan("S1", True))
+    store.flush()
+    store.record(scan("S2", True))
+    store.flush()
+    stats = store.stats()
+    assert stats["failed"] == 1 and stats["written"] == 1
+    assert [s["student_id"] for s in store.scans()] == ["S2"]
+
+def test_legacy_import_is_idempotent(store):
+    def read(name):
+        with open(os.path.join(REPO_DIR, name), encoding="utf-8") as f:
+            return f.read()
+
+    logs = read("class_attendance.csv"), read("scan_history.txt")
+    assert import_legacy(store, *logs) == {"history_scans": 5, "csv_scans": 8}
+    assert import_legacy(store, *logs) == {"history_scans": 5, "csv_scans": 8}
+    connection = store.connection()
+    assert connection.execute("SELECT COUNT(*) FROM scans").fetchone()[0] == 8
+    assert connection.execute("SELECT COUNT(*) FROM frames").fetchone()[0] == 25
+
+    imported, = store.scans(student_id="150651", frames=True)
+    assert imported["student_name"] == "Maximillian" and imported["source"] == "legacy"
+    assert imported["status"] == "PRESENT" and imported["confidence"] == 0.9997
+    assert len(imported["frames"]) == 5 and imported["frames"][0]["median"] == 0.9995
@@ -0,0 +1,64 @@
+"""Bounded pair-grid scoring behind /batch-verify"""
+import numpy as np
+import pytest
+
+from conftest import call
+
+def unbatched_grid(api, anchors, negatives):
+    """One model call per pair, as /batch-verify used to score"""
+    return np.array([
+        [float(np.asarray(api.model.predict_on_batch([a[None], n[None]])).reshape(-1)[0]) for n in negatives]
+        for a in anchors
+    ])
+
+@pytest.fixture
+def pair_grid_only(api, monkeypatch):
+    # Without the split model /batch-verify scores the full pair grid
+    monkeypatch.setattr(api, "embedding_model", None)
+
+@pytest.fixture(scope="module")
+def small_grid(api, images):
+    anchors = [api.preprocess_image(data) for data in images[:3]]
+    negatives = [api.preprocess_image(data) for data in images[40:57]]
+    return anchors, negatives, unbatched_grid(api, anchors, negatives)
+
+@pytest.mark.parametrize("batch_size", [1, 7, 64, 1000])
+def test_chunked_grid_matches_per_pair_scores(api, small_grid, batch_size):
+    anchors, negatives, expected = small_grid
+    scores = api.score_pair_grid(anchors, negatives, batch_size=batch_size)
+    assert scores.shape == (3, 17)
+    np.testing.assert_allclose(scores, expected, atol=1e-5)
+
+def test_batch_verify_grid_larger_than_one_pass(api, images, pair_grid_only):
+    anchors, negatives = images[:6], images[40:55]
+    assert len(anchors) * len(negatives) > api.PAIR_BATCH_SIZE
+    fields = [("anchors", f"a{i}.jpg", data) for i, data in enumerate(anchors)]
+    fields += [("negatives", f"n{i}.jpg", data) for i, data in enumerate(negatives)]
+    status, body = call(api, "POST", "/batch-verify", fields)
+    assert status == 200, body
+
+    expected = api.build_verification_result(unbatched_grid(
+        api, [api.preprocess_image(d) for d in anchors], [api.preprocess_image(d) for d in negatives]
+    ))
+    assert body["total_comparisons"] == 90
+    assert body["verified"] == expected["verified"]
+    assert body["verification_checks"] == expected["verification_checks"]
+    np.testing.assert_allclose(body["per_anchor_max_scores"], expected["per_anchor_max_scores"], atol=1e-5)
+    for key in ("max_similarity", "avg_similarity", "min_similarity", "std_similarity"):
+        assert body[key] == pytest.approx(expected[key], abs=1e-5)
+
+def test_min_passed_checks_boundary(api, monkeypatch):
+    # 2 anchors x 10 references, two strong matches per anchor: every check
+    # passes except ratio_check (4/20 = 20% decent comparisons)
+    grid = np.full((2, 10), 0.5)
+    grid[:, :2] = 0.95
+    result = api.build_verification_result(grid)
+    checks = result["verification_checks"]
+    assert [name for name, passed in checks.items() if not passed] == ["ratio_check"]
+    assert sum(checks.values()) == api.MIN_PASSED_CHECKS
+    assert result["verified"]
+
+    monkeypatch.setattr(api, "MIN_PASSED_CHECKS", api.MIN_PASSED_CHECKS + 1)
+    result = api.build_verification_result(grid)
+    assert not result["verified"]
+    assert result["rejection_reasons"] == ["Low overall match ratio (20.0% < 30%)"]
@@ -0,0 +1,28 @@
+"""Bulk session verification (/sessions/{session_id}/verify)"""
+from conftest import call
+
+def test_session_larger_than_decode_queue(api, images):
+    # 20 students x 20 frames: more images than the decode pool can hold at once
+    assert 400 > api.decode_executor.capacity
+    fields = [(f"frames.S{s:02d}", f"s{s}_{i}.jpg", images[s * 20 + i]) for s in range(20) for i in range(20)]
+    status, body = call(api, "POST", "/sessions/lecture-1/verify", fields)
+    assert status == 200, body
+    assert body["images_received"] == 400
+    assert body["images_failed"] == 0
+    assert body["students_processed"] == 20
+    # Nobody is enrolled and no references were sent: per-student errors, not a failed session
+    assert all(result["error"] == "Not enrolled and no references uploaded" for result in body["results"])
+
+def test_attendance_frames_skip_undecodable_uploads(api, images):
+    store = api.open_attendance_store()
+    fields = [("frames.S100", "good_0.jpg", images[0]), ("frames.S100", "broken.jpg", b"\xff\xd8\xff not a jpeg"),
+              ("frames.S100", "good_1.jpg", images[1])]
+    fields += [("references.S100", f"ref_{i}.jpg", images[10 + i]) for i in range(15)]
+    status, body = call(api, "POST", "/sessions/lecture-2/verify", fields)
+    assert status == 200, body
+    assert body["images_failed"] == 1
+    assert body["results"][0]["anchors_processed"] == 2
+    
+    store.flush()
+    scan, = store.scans(session_id="lecture-2", frames=True)
+    assert [frame["filename"] for frame in scan["frames"]] == ["good_0.jpg", "good_1.jpg"]
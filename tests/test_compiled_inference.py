@@ -0,0 +1,43 @@
+"""CompiledInference bucket padding"""
+import numpy as np
+import pytest
+
+@pytest.fixture(scope="module")
+def compiled(api):
+    import tensorflow as tf
+    
+    inputs = tf.keras.Input((100, 100, 3))
+    outputs = tf.keras.layers.Dense(4)(tf.keras.layers.GlobalAveragePooling2D()(inputs))
+    keras_model = tf.keras.Model(inputs, outputs)
+    compiled = api.CompiledInference(keras_model, num_inputs=1, buckets=(1, 4, 16, 64))
+    calls = []
+    forward = compiled._forward
+    
+    def counting_forward(*chunk):
+        calls.append(len(chunk[0]))
+        return forward(*chunk)
+    
+    compiled._forward = counting_forward
+    return keras_model, compiled, calls
+
+@pytest.mark.parametrize("total, expected_calls", [
+    (1, [1]),
+    (3, [4]),
+    (4, [4]),
+    (15, [16]),
+    (16, [16]),
+    (17, [64]),
+    (64, [64]),
+    (70, [64, 16]),
+    (129, [64, 64, 1]),
+])
+def test_tail_is_padded_to_one_bucket(compiled, total, expected_calls):
+    keras_model, model, calls = compiled
+    batch = np.random.default_rng(total).random((total, 100, 100, 3), dtype=np.float32)
+    calls.clear()
+    
+    output = model.predict_on_batch(batch)
+    
+    assert calls == expected_calls
+    assert output.shape == (total, 4)
+    np.testing.assert_allclose(output, keras_model(batch, training=False).numpy(), rtol=1e-4, atol=1e-5)
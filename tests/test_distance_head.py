@@ -0,0 +1,41 @@
+"""NumPy distance head (head_scores) against the Keras L1Dist + Dense(1) head"""
+import numpy as np
+import pytest
+
+@pytest.fixture(scope="module")
+def keras_head(api):
+    siamese_model = api.make_siamese_model()
+    _, kernel, bias = api.extract_siamese_components(siamese_model)
+    dense = [layer for layer in siamese_model.layers if type(layer).__name__ == "Dense"][-1]
+    return api.L1Dist(), dense, kernel, bias
+
+def keras_grid(head, anchors, references):
+    distance, dense, _, _ = head
+    a = np.repeat(anchors, len(references), axis=0)
+    b = np.tile(references, (len(anchors), 1))
+    return dense(distance(a, b)).numpy().reshape(len(anchors), len(references))
+
+def test_numpy_head_matches_keras_dense(api, keras_head):
+    rng = np.random.default_rng(0)
+    anchors, references = rng.random((5, 4096), dtype=np.float32), rng.random((7, 4096), dtype=np.float32)
+    _, _, kernel, bias = keras_head
+    scores = api.head_scores(anchors, references, kernel, bias)
+    assert scores.shape == (5, 7)
+    np.testing.assert_allclose(scores, keras_grid(keras_head, anchors, references), atol=1e-5)
+
+@pytest.mark.parametrize("chunk_elements", [1, 4096, 3 * 4096, 10 * 4096])
+def test_chunking_does_not_change_scores(api, keras_head, monkeypatch, chunk_elements):
+    rng = np.random.default_rng(1)
+    anchors, references = rng.random((6, 4096), dtype=np.float32), rng.random((9, 4096), dtype=np.float32)
+    _, _, kernel, bias = keras_head
+    expected = api.head_scores(anchors, references, kernel, bias)
+    monkeypatch.setattr(api, "HEAD_CHUNK_ELEMENTS", chunk_elements)
+    np.testing.assert_allclose(api.head_scores(anchors, references, kernel, bias), expected, atol=1e-6)
+
+def test_split_model_scores_like_the_full_model(api, images):
+    x = np.stack([api.preprocess_image(data) for data in images[:4]])
+    y = np.stack([api.preprocess_image(data) for data in images[100:104]])
+    full = np.asarray(api.model.predict_on_batch([x, y])).reshape(-1)
+    split = api.score_embeddings(api.embed_images(x), api.embed_images(y)).diagonal()
+    np.testing.assert_allclose(split, full, atol=api.HEAD_PARITY_TOLERANCE)
+    assert api.head_parity_error <= api.HEAD_PARITY_TOLERANCE
@@ -0,0 +1,73 @@
+"""Enrollment gallery: enroll -> verify by ID, and the embedding-space key"""
+import os
+import time
+
+import numpy as np
+import pytest
+
+from conftest import call
+
+def uploads(name, images):
+    return [(name, f"{name[0]}{i}.jpg", data) for i, data in enumerate(images)]
+
+@pytest.fixture(scope="module")
+def enrolled(api, images):
+    status, body = call(api, "POST", "/enroll/GA1", uploads("references", images[80:95]))
+    assert status == 200, body
+    return body
+
+def test_verify_by_id_scores_like_uploaded_references(api, images, enrolled, monkeypatch):
+    monkeypatch.setattr(api, "QUALITY_GATE", False)
+    assert enrolled["references_stored"] == 15 and enrolled["ready_for_verification"]
+    status, body = call(api, "GET", "/enroll/GA1")
+    assert status == 200 and body["reference_ids"] == enrolled["reference_ids"]
+
+    anchors = images[:4]
+    status, by_id = call(api, "POST", "/verify/GA1", uploads("anchors", anchors))
+    assert status == 200, by_id
+    assert by_id["student_id"] == "GA1"
+    status, uploaded = call(api, "POST", "/batch-verify",
+                            uploads("anchors", anchors) + uploads("negatives", images[80:95]))
+    assert status == 200, uploaded
+    assert by_id["verified"] == uploaded["verified"]
+    assert by_id["verification_checks"] == uploaded["verification_checks"]
+    np.testing.assert_allclose(by_id["per_anchor_max_scores"], uploaded["per_anchor_max_scores"], atol=1e-5)
+
+    # Appending known references stores nothing new
+    fields = uploads("references", images[80:82]) + [("append", "true")]
+    status, body = call(api, "POST", "/enroll/GA1", fields)
+    assert status == 200 and body["references_stored"] == 15
+
+def test_unknown_student_is_404(api, images):
+    assert call(api, "POST", "/verify/NOPE", uploads("anchors", images[:1]))[0] == 404
+    assert call(api, "GET", "/enroll/NOPE")[0] == 404
+
+def test_entries_of_another_embedding_space_are_re_embedded(api, enrolled):
+    references = api.stored_references("GA1")
+    assert references.shape == (15, 100, 100, 3) and references.dtype == np.uint8
+    now = time.time()
+    stale = {
+        "embeddings": np.zeros((15, len(api.head_kernel)), np.float32),
+        "reference_ids": enrolled["reference_ids"],
+        "enrolled_at": now,
+        "updated_at": now,
+        "embedding_space": "0" * 64 + "/tflite-int8"
+    }
+    # Written by a worker still serving the previous model; one without references is dropped
+    api.save_gallery_entry("GA2", stale, references)
+    api.save_gallery_entry("GA3", stale)
+    api.load_gallery()
+
+    entry = api.get_gallery_entry("GA2")
+    assert entry["embedding_space"] == api.embedding_space
+    expected = api.embed_images(references.astype(np.float32) / 255.0)
+    np.testing.assert_allclose(entry["embeddings"], expected, atol=1e-6)
+    with np.load(api.gallery_file("GA2")) as data:
+        assert str(data["embedding_space"]) == api.embedding_space
+    with pytest.raises(api.HTTPException):
+        api.get_gallery_entry("GA3")
+
+    for student_id in ("GA2", "GA3"):
+        call(api, "DELETE", f"/enroll/{student_id}")
+        if os.path.exists(api.gallery_file(student_id)):
+            os.remove(api.gallery_file(student_id))
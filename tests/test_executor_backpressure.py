@@ -0,0 +1,40 @@
+"""Bounded inference queue: full-queue 503s with Retry-After"""
+import asyncio
+import json
+import threading
+
+from conftest import asgi_request, multipart
+
+def test_full_queue_returns_503_with_retry_after(api, images, monkeypatch):
+    executor = api.InferenceExecutor(
+        1, 1, name="test-full", retry_after_seconds=api.INFERENCE_RETRY_AFTER_SECONDS
+    )
+    monkeypatch.setattr(api, "inference_executor", executor)
+    monkeypatch.setattr(api, "PREDICT_BATCHING", False)
+    release = threading.Event()
+    body, content_type = multipart([("file1", "a.jpg", images[0]), ("file2", "b.jpg", images[1])])
+
+    async def scenario():
+        # One job running, one queued: the queue is full
+        blockers = [asyncio.create_task(executor.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        headers = {}
+        try:
+            status, data = await asgi_request(api.app, "POST", "/predict", body, content_type, headers)
+        finally:
+            release.set()
+        await asyncio.gather(*blockers)
+        return status, json.loads(data), headers
+
+    status, data, headers = asyncio.run(scenario())
+    assert status == 503
+    assert data["detail"]["error"] == "Inference queue full"
+    assert headers["retry-after"] == str(api.INFERENCE_RETRY_AFTER_SECONDS)
+    stats = executor.stats()
+    assert stats["rejected"] == 1 and stats["outstanding"] == 0
+
+    # Once drained, the same request is served
+    headers = {}
+    status, data = asyncio.run(asgi_request(api.app, "POST", "/predict", body, content_type, headers))
+    assert status == 200, data
+    assert "retry-after" not in headers
@@ -0,0 +1,48 @@
+"""Fast-load weights artifact keyed by the model file's SHA-256"""
+import json
+import os
+
+import numpy as np
+import pytest
+
+OLD, NEW = "a" * 64, "b" * 64
+
+@pytest.fixture
+def artifacts(api, monkeypatch, tmp_path):
+    monkeypatch.setattr(api, "MODEL_ARTIFACT_DIR", str(tmp_path))
+    return tmp_path
+
+@pytest.fixture(scope="module")
+def siamese_model(api):
+    return api.make_siamese_model()
+
+def same_weights(a, b):
+    return all(np.array_equal(x, y) for x, y in zip(a.get_weights(), b.get_weights()))
+
+def test_artifact_round_trip(api, artifacts, siamese_model):
+    api.export_fast_artifact(siamese_model, OLD)
+    loaded = api.load_fast_artifact(OLD)
+    assert loaded is not None and same_weights(loaded, siamese_model)
+
+def test_checksum_change_invalidates_the_artifact(api, artifacts, siamese_model):
+    api.export_fast_artifact(siamese_model, OLD)
+    # A new model file: no artifact for its checksum yet
+    assert api.load_fast_artifact(NEW) is None
+
+    api.export_fast_artifact(siamese_model, NEW)
+    assert not os.path.exists(api.fast_artifact_path(OLD))
+    assert not os.path.exists(api.fast_artifact_path(OLD) + ".json")
+    assert sorted(os.listdir(artifacts)) == [os.path.basename(api.fast_artifact_path(NEW)) + suffix
+                                            for suffix in ("", ".json")]
+    assert api.load_fast_artifact(NEW) is not None
+
+def test_mismatched_metadata_is_rejected(api, artifacts, siamese_model):
+    api.export_fast_artifact(siamese_model, NEW)
+    # Same file name prefix, but written for another checksum
+    index_path = api.fast_artifact_path(NEW) + ".json"
+    with open(index_path) as f:
+        index = json.load(f)
+    index["metadata"]["source_sha256"] = "b" * 16 + "c" * 48
+    with open(index_path, "w") as f:
+        json.dump(index, f)
+    assert api.load_fast_artifact(NEW) is None
@@ -0,0 +1,45 @@
+"""Pre-fork workers sharing the gallery through GALLERY_DIR (GALLERY_SYNC)"""
+import os
+import time
+
+import numpy as np
+
+from conftest import call
+
+def test_workers_see_each_others_gallery_changes(api, monkeypatch):
+    monkeypatch.setattr(api, "GALLERY_SYNC", True)
+    rng = np.random.default_rng(0)
+    now = time.time()
+    entry = {
+        "embeddings": rng.random((15, len(api.head_kernel)), dtype=np.float32),
+        "reference_ids": [f"w{i}" for i in range(15)],
+        "enrolled_at": now,
+        "updated_at": now
+    }
+    index = api.get_gallery_index()
+
+    # Another worker enrolls a student and creates a roster: only the files change here
+    api.save_gallery_entry("W1", entry)
+    api.save_roster("hall-w", {"student_ids": ["W1"], "updated_at": now})
+    assert "W1" not in api.enrollment_gallery
+
+    status, body = call(api, "GET", "/enroll/W1")
+    assert status == 200, body
+    assert body["reference_ids"] == entry["reference_ids"]
+    status, body = call(api, "GET", "/rosters/hall-w")
+    assert status == 200 and body["enrolled_students"] == 1
+    assert ("W1", "w0") in index
+
+    # ...then removes both
+    os.remove(api.gallery_file("W1"))
+    os.remove(api.roster_file("hall-w"))
+    assert call(api, "GET", "/enroll/W1")[0] == 404
+    assert call(api, "GET", "/rosters/hall-w")[0] == 404
+    assert ("W1", "w0") not in index
+
+def test_sync_is_a_stat_when_nothing_changed(api, monkeypatch):
+    api.sync_gallery()
+    monkeypatch.setattr(api, "GALLERY_SYNC_SETTLE_NS", 0)
+    api.sync_gallery()
+    monkeypatch.setattr(api, "load_gallery", lambda: 1 / 0)
+    assert api.sync_gallery() == 0
@@ -0,0 +1,71 @@
+"""Content-addressed LRU image/embedding cache"""
+import numpy as np
+import pytest
+
+IMAGE_BYTES = 100 * 100 * 3 * 4
+
+def image(value):
+    return np.full((100, 100, 3), value, np.float32)
+
+def test_least_recently_used_entry_is_evicted(api):
+    cache = api.ImageCache(3 * IMAGE_BYTES)
+    for key in "abc":
+        cache.put_image(key, image(ord(key)))
+    # Touch "a": "b" is now the oldest
+    assert cache.get_image("a")[0, 0, 0] == ord("a")
+    cache.put_image("d", image(ord("d")))
+
+    assert cache.get_image("b") is None
+    assert [cache.get_image(key) is not None for key in "acd"] == [True, True, True]
+    stats = cache.stats()
+    assert stats["entries"] == 3 and stats["evictions"] == 1
+    assert cache.current_bytes == 3 * IMAGE_BYTES
+
+def test_embeddings_count_towards_the_bound(api):
+    cache = api.ImageCache(2 * IMAGE_BYTES + 4096 * 4)
+    cache.put_image("a", image(1))
+    cache.put_image("b", image(2))
+    cache.put_embedding("a", np.ones(4096, np.float32))
+    assert cache.current_bytes == 2 * IMAGE_BYTES + 4096 * 4 and cache.evictions == 0
+    # Replacing a value does not count it twice
+    cache.put_embedding("a", np.zeros(4096, np.float32))
+    assert cache.current_bytes == 2 * IMAGE_BYTES + 4096 * 4
+    cache.put_embedding("b", np.ones(4096, np.float32))
+    assert cache.get_image("a") is None and cache.get_embedding("b") is not None
+    assert cache.current_bytes == IMAGE_BYTES + 4096 * 4
+
+def test_an_entry_larger_than_the_cache_is_still_kept_alone(api):
+    cache = api.ImageCache(IMAGE_BYTES // 2)
+    cache.put_image("a", image(1))
+    cache.put_image("b", image(2))
+    assert cache.get_image("a") is None and cache.get_image("b") is not None
+    disabled = api.ImageCache(0)
+    disabled.put_image("a", image(1))
+    assert disabled.get_image("a") is None and disabled.current_bytes == 0
+
+def test_keys_separate_distinct_uploads_and_slots(api, images):
+    data = images[0]
+    # Trailing bytes decode to the same pixels but are a different upload
+    variant = data + b"\0"
+    assert api.ImageCache.key_for(data) != api.ImageCache.key_for(variant)
+    assert api.ImageCache.key_for(data) == api.ImageCache.key_for(bytes(data))
+
+    cache = api.ImageCache(4 * IMAGE_BYTES)
+    key = api.ImageCache.key_for(data)
+    cache.put_image(key, image(1))
+    # Image and embedding share the key but not the slot
+    assert cache.get_embedding(key) is None
+    cache.put_embedding(key, np.ones(4096, np.float32))
+    assert cache.get_image(key)[0, 0, 0] == 1 and cache.get_embedding(key).shape == (4096,)
+
+def test_cached_preprocess_hits_on_identical_bytes(api, images, monkeypatch):
+    monkeypatch.setattr(api, "image_cache", api.ImageCache(8 * IMAGE_BYTES))
+    key, first = api.cached_preprocess(images[1])
+    again_key, again = api.cached_preprocess(bytes(images[1]))
+    assert again_key == key
+    np.testing.assert_array_equal(again, first)
+    assert api.image_cache.stats()["hits"] == 1 and api.image_cache.stats()["misses"] == 1
+    # Cached arrays are shared between requests, so they are read-only
+    with pytest.raises(ValueError):
+        again[0, 0, 0] = 0.0
+    np.testing.assert_array_equal(first, api.preprocess_image(images[1]))
@@ -0,0 +1,56 @@
+"""Base64 JSON request bodies"""
+import base64
+import json
+
+import pytest
+
+from conftest import call
+
+def b64(data):
+    return base64.b64encode(data).decode()
+
+def post_json(api, path, payload, content_type="application/json"):
+    body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+    return call(api, "POST", path, body=body, content_type=content_type)
+
+def test_decodes_plain_and_data_url(api, images):
+    assert api.decode_base64_image(b64(images[0])) == images[0]
+    assert api.decode_base64_image("data:image/jpeg;base64," + b64(images[0])) == images[0]
+
+@pytest.mark.parametrize("value", [
+    "@@@@",                  # outside the alphabet
+    "QUJD$RA==",             # one bad character inside valid data
+    "QUJDRA",                # missing padding
+    "QUJD\\nRA==",           # line break
+    "QUJDRA==QUJD",          # data after padding
+])
+def test_corrupt_base64_is_rejected(api, value):
+    with pytest.raises(ValueError, match="invalid base64"):
+        api.decode_base64_image(value.replace("\\n", "\n"), "image1")
+
+def test_predict_json_corrupt_payload_is_400(api, images):
+    corrupted = b64(images[0])
+    corrupted = corrupted[:100] + "*" + corrupted[101:]
+    status, body = post_json(api, "/predict/json", {"image1": corrupted, "image2": b64(images[1])})
+    assert status == 400
+    assert "image1: invalid base64" in body["detail"]
+
+def test_predict_json_scores_like_multipart(api, images):
+    status, multipart_body = call(api, "POST", "/predict", [("file1", "a.jpg", images[0]), ("file2", "b.jpg", images[1])])
+    assert status == 200
+    status, body = post_json(api, "/predict/json", {"image1": b64(images[0]), "image2": b64(images[1])})
+    assert status == 200
+    assert body["similarity"] == pytest.approx(multipart_body["similarity"], abs=1e-6)
+
+def test_batch_verify_json_corrupt_negative_is_400(api, images):
+    negatives = [b64(data) for data in images[10:25]]
+    negatives[3] = negatives[3][:-8] + "!!!!!!!!"
+    status, body = post_json(api, "/batch-verify/json", {"anchors": [b64(images[0])], "negatives": negatives})
+    assert status == 400
+    assert "negatives[3]: invalid base64" in body["detail"]
+
+def test_session_ndjson_corrupt_frame_is_400(api, images):
+    line = json.dumps({"student_id": "S1", "frames": [b64(images[0])[:-1] + "%"]})
+    status, body = post_json(api, "/sessions/lecture-9/verify", line.encode() + b"\n", "application/x-ndjson")
+    assert status == 400
+    assert "invalid base64" in body["detail"]
@@ -0,0 +1,94 @@
+"""/metrics in the Prometheus text exposition format (0.0.4)"""
+import asyncio
+import math
+import re
+from collections import defaultdict
+
+from conftest import asgi_request, call
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"(,|$)')
+
+def parse_labels(text):
+    labels, position = {}, 0
+    while position < len(text):
+        match = LABEL.match(text, position)
+        assert match, f"bad labels: {text!r}"
+        labels[match.group(1)] = match.group(2)
+        position = match.end()
+    return labels
+
+def scrape(api):
+    headers = {}
+    status, body = asyncio.run(asgi_request(api.app, "GET", "/metrics", response_headers=headers))
+    assert status == 200
+    assert headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = body.decode()
+    assert text.endswith("\n")
+    return text
+
+def parse(text):
+    """{family: {"type", "help", "samples": [(name, labels, value)]}}, checking the layout"""
+    families, current = {}, None
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            name, _, documentation = line[len("# HELP "):].partition(" ")
+            assert name not in families, f"{name} declared twice"
+            assert documentation
+            families[name] = current = {"help": documentation, "type": None, "samples": []}
+            current_name = name
+        elif line.startswith("# TYPE "):
+            name, _, kind = line[len("# TYPE "):].partition(" ")
+            assert name == current_name and not current["samples"]
+            assert kind in ("counter", "gauge", "histogram")
+            current["type"] = kind
+        else:
+            match = SAMPLE.match(line)
+            assert match, f"bad sample line: {line!r}"
+            name, _, labels, value = match.groups()
+            assert current is not None and current["type"]
+            suffixes = ("_bucket", "_sum", "_count") if current["type"] == "histogram" else ("",)
+            assert any(name == current_name + suffix for suffix in suffixes), f"{name} outside its family"
+            current["samples"].append((name, parse_labels(labels or ""), float(value)))
+    return families
+
+def test_exposition_is_well_formed(api, images):
+    # Populate request, stage and executor series first
+    fields = [("file1", "a.jpg", images[0]), ("file2", "b.jpg", images[1])]
+    assert call(api, "POST", "/predict", fields)[0] == 200
+    families = parse(scrape(api))
+
+    for name, family in families.items():
+        if family["type"] == "counter":
+            assert name.endswith("_total"), name
+        for _, _, value in family["samples"]:
+            assert not math.isnan(value)
+
+    requests = families["eduface_requests_total"]["samples"]
+    assert any(labels == {"endpoint": "predict", "status": "200"} and value >= 1 for _, labels, value in requests)
+    assert families["eduface_model_loaded"]["samples"] == [("eduface_model_loaded", {}, 1.0)]
+
+def test_histogram_buckets_are_cumulative(api):
+    families = parse(scrape(api))
+    histograms = [family for family in families.values() if family["type"] == "histogram"]
+    assert histograms
+    for family in histograms:
+        series = defaultdict(dict)
+        for name, labels, value in family["samples"]:
+            key = tuple(sorted((k, v) for k, v in labels.items() if k != "le"))
+            series[key].setdefault(name.rsplit("_", 1)[1], []).append((labels.get("le"), value))
+        for parts in series.values():
+            buckets = parts["bucket"]
+            bounds = [float(le) for le, _ in buckets]
+            counts = [value for _, value in buckets]
+            assert bounds == sorted(bounds) and bounds[-1] == math.inf
+            assert counts == sorted(counts)
+            assert counts[-1] == parts["count"][0][1]
+
+def test_label_values_are_escaped(api):
+    assert api.format_labels(("a", "b"), ('say "hi"\\', "two\nlines")) == '{a="say \\"hi\\"\\\\",b="two\\nlines"}'
+    counter = api.Counter("eduface_test_total", "Escaping check", ["path"])
+    counter.inc('x"y')
+    lines = counter.render()
+    parse("\n".join(lines))
+    assert lines[-1] == 'eduface_test_total{path="x\\"y"} 1'
@@ -0,0 +1,59 @@
+"""Micro-batching of concurrent /predict requests (MicroBatcher)"""
+import asyncio
+
+from conftest import call
+
+class Recorder:
+    """Batch function that records batch sizes and the class each batch ran at"""
+
+    def __init__(self, api, fail=False):
+        self.admission = api.admission_context.get
+        self.batches = []
+        self.classes = []
+        self.fail = fail
+
+    def __call__(self, items):
+        self.batches.append(len(items))
+        self.classes.append(self.admission().request_class)
+        if self.fail:
+            raise ValueError("batch failed")
+        return [item * 2 for item in items]
+
+def test_micro_batcher_coalesces_concurrent_requests(api):
+    recorder = Recorder(api)
+    batcher = api.MicroBatcher(recorder, api.inference_executor, max_batch_size=4, max_wait_ms=50)
+
+    async def one(item, request_class):
+        api.admission_context.set(api.Admission(request_class, f"s{item}"))
+        return await batcher.submit(item)
+
+    async def scenario():
+        classes = ["background"] * 10
+        classes[5] = "critical"
+        return await asyncio.gather(*(one(i, cls) for i, cls in enumerate(classes)))
+
+    assert asyncio.run(scenario()) == [i * 2 for i in range(10)]
+    assert recorder.batches == [4, 4, 2]
+    # Each batch runs at the best class among its requests
+    assert recorder.classes == ["background", "critical", "background"]
+    stats = batcher.stats()
+    assert stats["requests"] == 10 and stats["batches"] == 3
+    assert stats["batch_size_histogram"]["4"] == 2 and stats["batch_size_histogram"]["2"] == 1
+
+def test_micro_batcher_fails_every_request_of_a_failed_batch(api):
+    recorder = Recorder(api, fail=True)
+    batcher = api.MicroBatcher(recorder, api.inference_executor, max_batch_size=8, max_wait_ms=20)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert recorder.batches == [3]
+    assert all(isinstance(result, ValueError) for result in results)
+
+def test_predict_requests_share_batches(api, images):
+    before = api.predict_batcher.stats()["requests"]
+    status, body = call(api, "POST", "/predict", [("file1", "a.jpg", images[0]), ("file2", "b.jpg", images[1])])
+    assert status == 200, body
+    assert 0.0 <= body["similarity"] <= 1.0
+    assert api.predict_batcher.stats()["requests"] == before + int(api.PREDICT_BATCHING)
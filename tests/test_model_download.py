@@ -0,0 +1,229 @@
+"""Ranged, resumable model download against a local HTTP range server"""
+import hashlib
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+import model_download
+
+PAYLOAD = np.random.default_rng(0).integers(0, 256, 3 * 1024 * 1024 + 12345, dtype=np.uint8).tobytes()
+DIGEST = hashlib.sha256(PAYLOAD).hexdigest()
+
+class RangeServer:
+    """
+    Serves PAYLOAD with Range support; `fail_offsets` answer 500 for ranges starting there
+    
+    The asset URL redirects to a signed URL for the current `generation`;
+    older signatures answer 403. `expire_after` bumps the generation after
+    that many part requests. With `known_total=False` ranged answers do
+    not report the total size, so the client falls back to one stream;
+    `cut_full_body` drops the connection halfway through a 200 answer.
+    """
+
+    def __init__(self):
+        self.ranges = []
+        self.fail_offsets = set()
+        self.generation = 0
+        self.expire_after = None
+        self.refused = 0
+        self.known_total = True
+        self.cut_full_body = False
+        self.etag = '"v1"'
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def empty(self, status, **headers):
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                if self.path == "/siamese_model.h5":
+                    self.empty(302, Location=f"/signed/{server.generation}")
+                    return
+                if self.path != f"/signed/{server.generation}":
+                    with server.lock:
+                        server.refused += 1
+                    self.empty(403)
+                    return
+                match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range") or "")
+                if_range = self.headers.get("If-Range")
+                if not match or (if_range and if_range != server.etag):
+                    self.send_response(200)
+                    self.send_header("Content-Length", str(len(PAYLOAD)))
+                    self.send_header("ETag", server.etag)
+                    self.end_headers()
+                    if server.cut_full_body:
+                        server.cut_full_body = False
+                        self.close_connection = True
+                        self.wfile.write(PAYLOAD[:len(PAYLOAD) // 2])
+                        return
+                    self.wfile.write(PAYLOAD)
+                    return
+                start = int(match.group(1))
+                end = min(int(match.group(2) or len(PAYLOAD) - 1), len(PAYLOAD) - 1)
+                with server.lock:
+                    server.ranges.append((start, end))
+                    parts = len(server.part_requests())
+                if start in server.fail_offsets:
+                    self.empty(500)
+                    return
+                body = PAYLOAD[start:end + 1]
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD) if server.known_total else '*'}")
+                self.send_header("ETag", server.etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                if server.expire_after and parts == server.expire_after and (start, end) != (0, 0):
+                    server.generation += 1
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/siamese_model.h5"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def part_requests(self):
+        """Range requests other than the 1-byte probe"""
+        return sorted(r for r in self.ranges if r != (0, 0))
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+@pytest.fixture
+def server():
+    server = RangeServer()
+    yield server
+    server.close()
+
+@pytest.fixture
+def download(api, monkeypatch, tmp_path):
+    """download_model into tmp_path with 1 MB parts and no retry back-off"""
+    monkeypatch.setattr(api, "DOWNLOAD_PART_MB", 1)
+    monkeypatch.setattr(api, "DOWNLOAD_RETRIES", 1)
+    path = str(tmp_path / "siamese_model.h5")
+    
+    def run(url, sha256=DIGEST, connections=3):
+        return api.download_model(url=url, path=path, sha256=sha256, connections=connections)
+    return run, path
+
+MB = 1024 * 1024
+EXPECTED_PARTS = [(0, MB - 1), (MB, 2 * MB - 1), (2 * MB, 3 * MB - 1), (3 * MB, len(PAYLOAD) - 1)]
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_parallel_ranges_assemble_the_file(server, download):
+    run, path = download
+    assert run(server.url) == DIGEST
+    assert server.part_requests() == EXPECTED_PARTS
+    assert read(path) == PAYLOAD
+    assert not os.path.exists(path + ".part")
+    assert not os.path.exists(path + ".part.json")
+
+def test_resume_fetches_only_missing_parts(server, download):
+    run, path = download
+    server.fail_offsets = {3 * MB}
+    with pytest.raises(RuntimeError, match="Download incomplete"):
+        run(server.url, connections=1)
+    assert not os.path.exists(path)
+    assert os.path.getsize(path + ".part") == len(PAYLOAD)
+    
+    server.fail_offsets = set()
+    server.ranges.clear()
+    assert run(server.url) == DIGEST
+    assert server.part_requests() == [(3 * MB, len(PAYLOAD) - 1)]
+    assert read(path) == PAYLOAD
+
+def test_checksum_mismatch_installs_nothing(server, download):
+    run, path = download
+    with pytest.raises(RuntimeError, match="Checksum mismatch"):
+        run(server.url, sha256="0" * 64)
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + ".part")
+    assert not os.path.exists(path + ".part.json")
+    
+    # A corrupted installed file is replaced on the next start
+    with open(path, "wb") as f:
+        f.write(b"truncated")
+    assert run(server.url) == DIGEST
+    assert read(path) == PAYLOAD
+
+def test_missing_digest_is_logged_once(server, download, monkeypatch):
+    run, path = download
+    warnings = []
+    monkeypatch.setattr(model_download, "missing_sha256_warned", False)
+    monkeypatch.setattr(model_download.logger, "warning", lambda message, *args, **kwargs: warnings.append(message))
+    # Starting with the file in place downloads nothing and warns about nothing
+    with open(path, "wb") as f:
+        f.write(PAYLOAD)
+    assert run(server.url, sha256="") is None
+    assert warnings == []
+
+    os.remove(path)
+    assert run(server.url, sha256="") == DIGEST
+    os.remove(path)
+    assert run(server.url, sha256="") == DIGEST
+    assert [message for message in warnings if "MODEL_SHA256" in message] == [warnings[0]]
+    assert len(warnings) == 1
+
+def test_expired_url_is_re_resolved(server, download):
+    run, path = download
+    # The signed URL from the probe stops working after two parts
+    server.expire_after = 2
+    assert run(server.url, connections=1) == DIGEST
+    assert server.generation == 1 and server.refused == 1
+    assert server.part_requests() == EXPECTED_PARTS
+    assert read(path) == PAYLOAD
+
+def test_stream_fallback_resumes_after_interruption(server, download, monkeypatch, api):
+    run, path = download
+    server.known_total = False
+    # The connection drops halfway and the only attempt fails...
+    server.cut_full_body = True
+    with pytest.raises(RuntimeError, match="Could not download model"):
+        run(server.url)
+    written = os.path.getsize(path + ".part")
+    assert 0 < written <= len(PAYLOAD) // 2
+
+    # ...so the next start asks for the rest only
+    server.ranges.clear()
+    assert run(server.url) == DIGEST
+    assert server.part_requests() == [(written, len(PAYLOAD) - 1)]
+    assert read(path) == PAYLOAD
+
+    # Within one start, a retry resumes as well
+    monkeypatch.setattr(api, "DOWNLOAD_RETRIES", 2)
+    os.remove(path)
+    server.ranges.clear()
+    server.cut_full_body = True
+    assert run(server.url) == DIGEST
+    assert server.part_requests() == [(written, len(PAYLOAD) - 1)]
+    assert read(path) == PAYLOAD
+
+def test_stream_fallback_restarts_when_the_file_changed(server, download):
+    run, path = download
+    server.known_total = False
+    server.cut_full_body = True
+    with pytest.raises(RuntimeError):
+        run(server.url)
+    # A new release: the half-written file of the old one is not resumed
+    server.etag = '"v2"'
+    server.ranges.clear()
+    assert run(server.url) == DIGEST
+    assert server.part_requests() == []
+    assert read(path) == PAYLOAD
@@ -0,0 +1,59 @@
+"""TensorFlow and Pillow decode paths agree on the repo's sample images"""
+import os
+
+import numpy as np
+import pytest
+
+from conftest import REPO_DIR
+
+def repo_samples():
+    image_dir = os.path.join(REPO_DIR, "input_images")
+    names = sorted(name for name in os.listdir(image_dir) if name.lower().endswith((".jpg", ".jpeg")))
+    samples = []
+    for name in names:
+        with open(os.path.join(image_dir, name), "rb") as f:
+            samples.append(f.read())
+    return samples
+
+@pytest.fixture(scope="module")
+def samples():
+    samples = repo_samples()
+    assert samples, "input_images/ has no JPEGs"
+    return samples
+
+def test_both_backends_produce_model_inputs(api, samples):
+    for image_bytes in samples[:8]:
+        for preprocess in (api.preprocess_image_tf, api.preprocess_image_pillow):
+            array = preprocess(image_bytes)
+            assert array.shape == (api.IMAGE_SIZE, api.IMAGE_SIZE, 3)
+            assert array.dtype == np.float32
+            assert 0.0 <= array.min() and array.max() <= 1.0
+
+def test_parity_on_every_sample(api, samples):
+    result = api.check_preprocess_parity(samples)
+    assert result["images"] == len(samples)
+    assert result["mean_pixel_error"] <= result["tolerance"]
+    assert result["max_pixel_error"] <= result["max_pixel_tolerance"]
+    assert result["max_score_drift"] is not None
+    assert result["max_score_drift"] <= result["tolerance"]
+    assert result["passed"] is True
+
+def test_max_pixel_error_is_gated(api, samples):
+    result = api.check_preprocess_parity(samples[:4], max_pixel_tolerance=0.0)
+    assert result["max_pixel_error"] > 0.0
+    assert result["passed"] is False
+
+def test_passed_reported_without_model(api, samples, monkeypatch):
+    monkeypatch.setattr(api, "model", None)
+    result = api.check_preprocess_parity(samples[:4])
+    assert result["max_score_drift"] is None
+    assert result["passed"] is True
+    # Mean pixel error just over the tolerance fails even with no scores to compare
+    result = api.check_preprocess_parity(samples[:4], tolerance=mean_pixel_error(api, samples[:4]) * 0.95)
+    assert result["passed"] is False
+
+def mean_pixel_error(api, images):
+    """Mean pixel error between the backends"""
+    tf_batch = np.stack([api.preprocess_image_tf(b) for b in images])
+    pillow_batch = np.stack([api.preprocess_image_pillow(b) for b in images])
+    return float(np.abs(tf_batch - pillow_batch).mean())
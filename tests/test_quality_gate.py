@@ -0,0 +1,104 @@
+"""Pre-inference quality gate (QUALITY_GATE)"""
+import asyncio
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance, ImageFilter
+
+from conftest import call, stream
+
+def jpeg(image, quality=90):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+@pytest.fixture(scope="module")
+def frames(images):
+    """Two good frames, then blurred, dark, flat and re-encoded (duplicate) ones"""
+    first, second = (Image.open(io.BytesIO(data)).convert("RGB") for data in images[:2])
+    return {
+        "good_0": images[0],
+        "good_1": images[1],
+        "blur": jpeg(first.filter(ImageFilter.GaussianBlur(5))),
+        "dark": jpeg(ImageEnhance.Brightness(second).enhance(0.1)),
+        "flat": jpeg(Image.new("RGB", (120, 120), (128, 128, 128))),
+        "dup": jpeg(first, quality=70),
+    }
+
+EXPECTED_REJECTIONS = {"blur": "blurry", "dark": "underexposed", "flat": "low_contrast", "dup": "near_duplicate"}
+
+@pytest.fixture
+def gate_on(api, monkeypatch):
+    monkeypatch.setattr(api, "QUALITY_GATE", True)
+
+def rejected_reasons(report):
+    return {entry["filename"]: entry["reasons"] for entry in report["rejected"]}
+
+def assert_expected_rejections(report):
+    reasons = rejected_reasons(report)
+    assert set(reasons) == set(EXPECTED_REJECTIONS)
+    for name, reason in EXPECTED_REJECTIONS.items():
+        assert reason in reasons[name]
+    assert report["frames_used"] == 2
+
+def test_metrics_separate_good_from_bad_frames(api, frames):
+    arrays = np.stack([api.preprocess_image(data) for data in frames.values()])
+    assessments = api.quality_gate.mark_near_duplicates(api.quality_gate.frame_quality(arrays))
+    reasons = dict(zip(frames, (a["reasons"] for a in assessments)))
+    assert reasons["good_0"] == [] and reasons["good_1"] == []
+    for name, reason in EXPECTED_REJECTIONS.items():
+        assert reason in reasons[name]
+
+def test_duplicates_keep_the_first_frame(api, frames):
+    arrays = np.stack([api.preprocess_image(frames[name]) for name in ("dup", "good_0")])
+    assessments = api.quality_gate.mark_near_duplicates(api.quality_gate.frame_quality(arrays))
+    assert [a["reasons"] for a in assessments] == [[], ["near_duplicate"]]
+
+def test_gate_is_off_by_default(api, frames, images):
+    assert api.QUALITY_GATE is False
+    fields = [("anchors", name, data) for name, data in frames.items()]
+    fields += [("negatives", f"n{i}.jpg", data) for i, data in enumerate(images[10:25])]
+    status, body = call(api, "POST", "/batch-verify", fields)
+    assert status == 200
+    assert "quality_gate" not in body
+    assert body["anchors_processed"] == len(frames)
+
+def test_batch_verify_drops_rejected_frames(api, frames, images, gate_on):
+    fields = [("anchors", name, data) for name, data in frames.items()]
+    fields += [("negatives", f"n{i}.jpg", data) for i, data in enumerate(images[10:25])]
+    status, body = call(api, "POST", "/batch-verify", fields)
+    assert status == 200, body
+    assert body["anchors_processed"] == 2
+    assert_expected_rejections(body["quality_gate"])
+
+def test_all_frames_rejected_is_400(api, frames, images, gate_on):
+    fields = [("anchors", "blur", frames["blur"]), ("anchors", "flat", frames["flat"])]
+    fields += [("negatives", f"n{i}.jpg", data) for i, data in enumerate(images[10:25])]
+    status, body = call(api, "POST", "/batch-verify", fields)
+    assert status == 400
+    assert body["detail"]["error"] == "No usable anchor images"
+    assert body["detail"]["quality_gate"]["frames_used"] == 0
+
+def test_every_verification_path_rejects_the_same_frames(api, frames, images, gate_on):
+    status, _ = call(api, "POST", "/enroll/Q1", [("references", f"r{i}.jpg", data) for i, data in enumerate(images[10:25])])
+    assert status == 200
+    
+    status, body = call(api, "POST", "/verify/Q1", [("anchors", name, data) for name, data in frames.items()])
+    assert status == 200, body
+    assert_expected_rejections(body["quality_gate"])
+    
+    status, body = call(api, "POST", "/sessions/quality/verify", [("frames.Q1", name, data) for name, data in frames.items()])
+    assert status == 200, body
+    result, = body["results"]
+    assert result["anchors_processed"] == 2
+    assert_expected_rejections(result["quality_gate"])
+    
+    messages = asyncio.run(stream(api, {"student_id": "Q1", "frames": len(frames)}, list(frames.values())))
+    verdict = messages[-1]
+    assert verdict["type"] == "verdict", verdict
+    names = list(frames)
+    stream_rejected = {names[m["index"] - 1]: m["rejected"] for m in messages if "rejected" in m}
+    assert set(stream_rejected) == set(EXPECTED_REJECTIONS)
+    assert verdict["anchors_processed"] == 2
+    assert verdict["quality_gate"]["frames_used"] == 2
@@ -0,0 +1,73 @@
+"""TFLite embedding tower: fixed bucket shapes and the parity/speed gate"""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+@pytest.fixture(scope="module")
+def towers(api):
+    import tensorflow as tf
+
+    inputs = tf.keras.Input((100, 100, 3))
+    features = tf.keras.layers.Conv2D(8, 3, strides=4, activation="relu")(inputs)
+    outputs = tf.keras.layers.Dense(16)(tf.keras.layers.GlobalAveragePooling2D()(features))
+    keras_embedding = tf.keras.Model(inputs, outputs)
+    content = api.convert_embedding_tflite(keras_embedding, "tflite-fp16")
+    return keras_embedding, api.TFLiteEmbedding(content, num_threads=1, buckets=(1, 4, 16))
+
+def test_warmed_interpreters_serve_other_threads(towers, monkeypatch):
+    import tensorflow as tf
+
+    keras_embedding, tflite = towers
+    allocations = []
+    allocate = tf.lite.Interpreter.allocate_tensors
+    monkeypatch.setattr(tf.lite.Interpreter, "allocate_tensors", lambda self: allocations.append(1) or allocate(self))
+    # Warm up here (the loader thread), predict from two executor-like threads at once
+    tflite.warmup(copies=2)
+    assert len(allocations) == tflite.interpreters_created == 2 * len(tflite.buckets)
+
+    rng = np.random.default_rng(0)
+    batches = [rng.random((total, 100, 100, 3), dtype=np.float32) for total in (1, 3, 4, 7, 15, 16, 21, 40)]
+    start = threading.Barrier(2)
+    errors = []
+
+    def worker():
+        start.wait()
+        try:
+            for batch in batches:
+                output = tflite.predict_on_batch(batch)
+                assert output.shape == (len(batch), 16)
+                np.testing.assert_allclose(output, keras_embedding(batch, training=False).numpy(), atol=0.05)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(allocations) == 2 * len(tflite.buckets)
+
+class FixedEmbedding:
+    def __init__(self, embeddings, delay=0.0):
+        self.embeddings = embeddings
+        self.delay = delay
+
+    def predict_on_batch(self, images):
+        time.sleep(self.delay)
+        return self.embeddings[:len(images)]
+
+def test_parity_check_requires_a_speedup(api, images):
+    embeddings = np.random.default_rng(1).random((4, 16), dtype=np.float32)
+    kernel, bias = np.full(16, -1.0, np.float32), np.float32(2.0)
+    slow, fast = FixedEmbedding(embeddings, delay=0.02), FixedEmbedding(embeddings)
+
+    report = api.check_quantized_parity(slow, fast, kernel, bias, images=images[:4])
+    assert report["max_score_error"] == 0.0
+    assert report["speedup"] > 1.0 and report["passed"]
+
+    report = api.check_quantized_parity(fast, slow, kernel, bias, images=images[:4])
+    assert report["max_score_error"] == 0.0
+    assert report["speedup"] < 1.0 and not report["passed"]
@@ -0,0 +1,72 @@
+"""1:N identification against a roster (/rosters, /identify/{roster_id})"""
+import json
+
+import numpy as np
+import pytest
+
+from conftest import call
+
+STUDENTS = {"RI1": slice(300, 305), "RI2": slice(310, 315), "RI3": slice(320, 325)}
+
+def put_roster(api, roster_id, student_ids):
+    body = json.dumps({"student_ids": student_ids}).encode()
+    return call(api, "PUT", f"/rosters/{roster_id}", body=body, content_type="application/json")
+
+def anchors(data):
+    return [("anchors", f"a{i}.jpg", d) for i, d in enumerate(data)]
+
+@pytest.fixture(scope="module")
+def roster(api, images):
+    for student_id, refs in STUDENTS.items():
+        fields = [("references", f"r{i}.jpg", d) for i, d in enumerate(images[refs])]
+        assert call(api, "POST", f"/enroll/{student_id}", fields)[0] == 200
+    status, body = put_roster(api, "hall-r", ["RI1", "RI2", "RI3", "RI9", "RI2"])
+    assert status == 200, body
+    assert body["students"] == 4 and body["missing_students"] == ["RI9"]
+    yield "hall-r"
+    call(api, "DELETE", "/rosters/hall-r")
+    for student_id in list(STUDENTS) + ["RI4"]:
+        call(api, "DELETE", f"/enroll/{student_id}")
+
+def expected_ranking(api, images, frames, student_ids):
+    """Per student: best reference score per anchor, averaged over anchors"""
+    live = api.embed_images([api.preprocess_image(d) for d in frames])
+    scores = {}
+    for student_id in student_ids:
+        references = api.get_gallery_entry(student_id)["embeddings"]
+        scores[student_id] = float(api.score_embeddings(live, references).max(axis=1).mean())
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+def test_roster_students_are_ranked_by_mean_best_score(api, images, roster):
+    frames = images[312:315]
+    status, body = call(api, "POST", f"/identify/{roster}", anchors(frames) + [("top_k", "2")])
+    assert status == 200, body
+    assert body["students_scored"] == 3 and body["anchors_processed"] == 3
+    assert body["total_comparisons"] == 3 * 15
+
+    expected = expected_ranking(api, images, frames, STUDENTS)
+    assert [c["student_id"] for c in body["candidates"]] == [sid for sid, _ in expected[:2]]
+    np.testing.assert_allclose([c["score"] for c in body["candidates"]],
+                               [score for _, score in expected[:2]], atol=1e-5)
+    assert all(c["references"] == 5 for c in body["candidates"])
+    top = body["candidates"][0]
+    assert body["identified"] == (top["score"] >= api.PRIMARY_THRESHOLD)
+    assert body["student_id"] == (top["student_id"] if body["identified"] else None)
+
+def test_roster_matrix_follows_enrollments(api, images, roster):
+    matrix = api.get_roster_matrix(roster)
+    assert api.get_roster_matrix(roster) is matrix
+    fields = [("references", f"r{i}.jpg", d) for i, d in enumerate(images[330:335])]
+    assert call(api, "POST", "/enroll/RI4", fields)[0] == 200
+    assert put_roster(api, roster, list(STUDENTS) + ["RI4"])[1]["enrolled_students"] == 4
+
+    status, body = call(api, "POST", f"/identify/{roster}", anchors(images[330:331]))
+    assert status == 200 and body["students_scored"] == 4
+    assert api.get_roster_matrix(roster) is not matrix
+
+def test_unknown_or_empty_rosters(api, images, roster):
+    assert call(api, "POST", "/identify/no-such-roster", anchors(images[:1]))[0] == 404
+    assert put_roster(api, "empty-r", ["RI9"])[0] == 200
+    status, body = call(api, "POST", "/identify/empty-r", anchors(images[:1]))
+    assert status == 400 and "No enrolled students" in body["detail"]
+    call(api, "DELETE", "/rosters/empty-r")
@@ -0,0 +1,59 @@
+"""SequentialVerifier bounds against build_verification_result"""
+import numpy as np
+import pytest
+
+def score_grid(rng, regime, anchors, references):
+    if regime == "match":
+        return rng.uniform(0.8, 1.0, (anchors, references))
+    if regime == "mismatch":
+        return rng.uniform(0.0, 0.6, (anchors, references))
+    if regime == "borderline":
+        return rng.uniform(0.75, 0.97, (anchors, references))
+    # A few strong scores in an otherwise weak grid
+    grid = rng.uniform(0.0, 0.5, (anchors, references))
+    grid[rng.random((anchors, references)) < 0.1] = 0.99
+    return grid
+
+@pytest.mark.parametrize("regime", ["match", "mismatch", "borderline", "sparse"])
+def test_decided_checks_hold_for_the_full_grid(api, regime):
+    rng = np.random.default_rng(len(regime))
+    for _ in range(20):
+        anchors, references = rng.integers(1, 8), rng.integers(1, 25)
+        grid = score_grid(rng, regime, anchors, references)
+        full = api.build_verification_result(grid)
+        verifier = api.SequentialVerifier(anchors, references)
+        for column in rng.permutation(references):
+            verifier.add(grid[:, [column]], [column])
+            # Whatever the unscored comparisons turn out to be, a decided
+            # check must match its outcome on the completed grid
+            for name, decided in verifier.check_bounds().items():
+                if decided is not None:
+                    assert decided == full["verification_checks"][name], (regime, name, verifier.report())
+            verdict = verifier.verdict()
+            if verdict is not None:
+                assert verdict == full["verified"]
+        assert verifier.complete
+        assert verifier.verdict() == full["verified"]
+        assert verifier.check_bounds() == full["verification_checks"]
+
+def test_clear_verdicts_stop_early(api):
+    for grid, verified in ((np.full((5, 30), 0.99), True), (np.full((5, 30), 0.1), False)):
+        verifier = api.SequentialVerifier(*grid.shape)
+        for column in range(grid.shape[1]):
+            verifier.add(grid[:, [column]])
+            if verifier.verdict() is not None:
+                break
+        assert verifier.verdict() is verified
+        report = verifier.report()
+        assert report["stopped_early"]
+        assert report["comparisons_spent"] < report["comparisons_total"]
+
+def test_sequential_verify_matches_the_full_grid(api, images):
+    anchors = [api.preprocess_image(data) for data in images[:3]]
+    references = [api.preprocess_image(data) for data in images[20:36]]
+    verifier = api.sequential_verify(anchors, references, chunk_size=4)
+    full = api.build_verification_result(api.score_pair_grid(anchors, references))
+    assert verifier.verdict() == full["verified"]
+    scored = sorted(verifier.reference_indices)
+    assert scored == sorted(set(scored))
+    assert len(scored) % 4 == 0 or verifier.complete
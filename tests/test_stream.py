@@ -0,0 +1,77 @@
+"""Incremental multi-frame verification over /batch-verify/stream"""
+import asyncio
+
+import pytest
+
+from conftest import call, stream
+
+BROKEN = b"\xff\xd8\xff not a jpeg"
+
+@pytest.fixture(scope="module")
+def enrolled(api, images):
+    status, body = call(api, "POST", "/enroll/ST1", [("references", f"r{i}.jpg", d) for i, d in enumerate(images[60:75])])
+    assert status == 200, body
+    return "ST1"
+
+def test_unusable_frames_are_bounded(api, enrolled):
+    # frames=2 allows 4 frames in total; the client keeps sending broken ones
+    messages = asyncio.run(stream(api, {"student_id": enrolled, "frames": 2}, [BROKEN] * 10, end=False))
+    ready, *frames, error = messages
+    assert ready["type"] == "ready" and ready["max_frames_received"] == 4
+    assert [m["index"] for m in frames] == [1, 2, 3, 4]
+    assert all("error" in m for m in frames)
+    assert error["type"] == "error"
+    assert "at most 4 frames" in error["detail"]
+
+def test_end_message_decides_on_the_frames_sent(api, images, enrolled, monkeypatch):
+    monkeypatch.setattr(api, "QUALITY_GATE", False)
+    frames = [images[60], BROKEN, images[61]]
+    messages = asyncio.run(stream(api, {"student_id": enrolled, "frames": 5}, frames))
+    ready, *updates, verdict = messages
+    assert ready == {
+        "type": "ready", "references": 15, "references_source": "gallery",
+        "max_frames": 5, "max_frames_received": 10
+    }
+    assert [m["type"] for m in updates] == ["frame"] * 3
+    assert [m["index"] for m in updates] == [1, 2, 3]
+    # An undecodable frame is reported and doesn't count as scored
+    assert "error" in updates[1] and "median" not in updates[1]
+    assert [updates[0]["frames_scored"], updates[2]["frames_scored"]] == [1, 2]
+
+    assert verdict["type"] == "verdict" and verdict["student_id"] == enrolled
+    assert verdict["references_source"] == "gallery"
+    assert verdict["stream"]["frames_scored"] == 2 and verdict["stream"]["frames_expected"] == 5
+    assert not verdict["stream"]["settled_early"]
+    assert verdict["comparisons_spent"] == 2 * 15
+    assert verdict["max_similarity"] == pytest.approx(updates[2]["max_similarity"])
+
+def test_end_without_usable_frames_is_an_error(api, enrolled, monkeypatch):
+    monkeypatch.setattr(api, "QUALITY_GATE", False)
+    *_, error = asyncio.run(stream(api, {"student_id": enrolled, "frames": 3}, [BROKEN]))
+    assert error == {"type": "error", "detail": "No valid frames"}
+
+@pytest.mark.parametrize("message, detail", [
+    ("not json", "Text messages must be JSON"),
+    ({"type": "pause"}, "Unexpected text message")
+])
+def test_unexpected_text_messages_are_errors(api, images, enrolled, message, detail):
+    ready, error = asyncio.run(stream(api, {"student_id": enrolled, "frames": 3}, [message], end=False))
+    assert ready["type"] == "ready"
+    assert error["type"] == "error" and error["detail"].startswith(detail)
+
+@pytest.mark.parametrize("start, detail", [
+    (["ST1"], "First message must be the JSON start message"),
+    ({"student_id": "ST1", "frames": 1000}, "frames must be between"),
+    ({"student_id": "ST1", "references": -1}, "references must be between"),
+    ({"frames": 3}, "Send student_id (enrolled) or references")
+])
+def test_bad_start_messages_are_rejected(api, enrolled, start, detail):
+    messages = asyncio.run(stream(api, start, [], end=False))
+    assert len(messages) == 1
+    assert messages[0]["type"] == "error" and messages[0]["detail"].startswith(detail)
+
+@pytest.mark.parametrize("student_id, status_code", [("NOPE", 404), ("../ST1", 400)])
+def test_unknown_or_invalid_student_is_an_error_frame(api, student_id, status_code):
+    messages = asyncio.run(stream(api, {"student_id": student_id, "frames": 3}, [], end=False))
+    assert len(messages) == 1
+    assert messages[0]["type"] == "error" and messages[0]["status_code"] == status_code
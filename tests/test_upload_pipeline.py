@@ -0,0 +1,68 @@
+"""UploadPipeline: upload order and per-file errors under out-of-order decodes"""
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+BROKEN = b"\xff\xd8\xff not a jpeg"
+
+@pytest.fixture
+def slow_decodes(api, monkeypatch):
+    """Decodes on 4 threads, earlier uploads taking longest; records concurrency"""
+    monkeypatch.setattr(api, "decode_executor", api.InferenceExecutor(4, 64, name="test-decode"))
+    monkeypatch.setattr(api, "image_cache", api.ImageCache(64 * 1024 * 1024))
+    delays, running, peak = {}, [0], [0]
+    lock = threading.Lock()
+    preprocess = api.cached_preprocess
+
+    def delayed(data):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        try:
+            time.sleep(delays.get(data, 0.0))
+            return preprocess(data)
+        finally:
+            with lock:
+                running[0] -= 1
+
+    monkeypatch.setattr(api, "cached_preprocess", delayed)
+    return delays, peak
+
+def run_pipeline(api, uploads, **kwargs):
+    async def scenario():
+        pipeline = api.UploadPipeline(**kwargs)
+        for data in uploads:
+            pipeline.add("Anchor", data, len(uploads))
+        return (await pipeline.finish())["Anchor"]
+    return asyncio.run(scenario())
+
+def test_results_keep_upload_order_and_skip_failed_files(api, images, slow_decodes):
+    delays, _ = slow_decodes
+    uploads = list(images[200:206])
+    uploads[1] = uploads[4] = BROKEN
+    for i, data in enumerate(uploads):
+        delays[data] = 0.02 * (len(uploads) - i)
+
+    result = run_pipeline(api, uploads, batch_size=2)
+    assert result["indices"] == [0, 2, 3, 5]
+    good = [uploads[i] for i in result["indices"]]
+    assert result["keys"] == [api.ImageCache.key_for(data) for data in good]
+    expected = np.stack([api.preprocess_image(data) for data in good])
+    np.testing.assert_allclose(np.stack(result["arrays"]), expected)
+    np.testing.assert_allclose(result["embeddings"], api.embed_images(expected), atol=1e-5)
+
+def test_decodes_in_flight_are_bounded(api, images, slow_decodes):
+    delays, peak = slow_decodes
+    uploads = list(images[210:218])
+    for data in uploads:
+        delays[data] = 0.02
+    result = run_pipeline(api, uploads, embed=False, max_decodes=2)
+    assert result["indices"] == list(range(8)) and result["embeddings"] is None
+    assert peak[0] == 2
+
+def test_only_failed_files_yield_an_empty_label(api, slow_decodes):
+    result = run_pipeline(api, [BROKEN, BROKEN])
+    assert result["indices"] == [] and result["arrays"] == [] and result["embeddings"] is None